@@ -10,16 +10,49 @@ C++ evaluation for top-k recommendation
 
 import os
 import sys
+import json
 import threading
 import tensorflow as tf
 import logging
-from tensorflow.python.client import device_lib
 from utility.helper import *
 from utility.batch_test import *
+from utility import batch_test
+from utility.subgraph import khop_subgraph, split_nodes
+from utility.propagation import VARIANTS, PropagationEngine, OutOfCoreEngine
+from utility import out_of_core
+from utility.data_parallel import DataParallelTrainer
+from utility.partition import PartitionedTrainer
+from utility import checkpoint
+from utility.eval_schedule import EvalScheduler
+from utility.instrument import timers
+from utility.resources import resources
+from utility.profiler import Profiler
+from utility.optimizers import LazyAdamOptimizer
 
 os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
 
-cpus = [x.name for x in device_lib.list_local_devices() if x.device_type == 'CPU']
+_logger = logging.getLogger()
+
+
+def setup(arguments=None, data=None):
+    """
+    Parses the options and loads the dataset of the run, see utility.batch_test.setup. Nothing is loaded at import.
+    """
+    global args, data_generator
+    args, data_generator = batch_test.setup(arguments, data)
+    return args, data_generator
+
+
+def add_log_handlers(log_file):
+    """
+    Logs to stdout and to log_file (log_file.out when empty), returns the handlers to remove after the run.
+    """
+    handlers = [logging.FileHandler(log_file if log_file != '' else 'log_file.out'), logging.StreamHandler(sys.stdout)]
+    _logger.setLevel(logging.DEBUG)
+    for handler in handlers:
+        _logger.addHandler(handler)
+    return handlers
+
 
 class LightGCN(object):
     def __init__(self, data_config, pretrain_data):
@@ -27,12 +60,13 @@ class LightGCN(object):
         self.model_type = 'LightGCN'
         self.adj_type = args.adj_type
         self.alg_type = args.alg_type
+        assert self.alg_type in VARIANTS, 'unknown alg_type %s, choose from %s' % (self.alg_type, sorted(VARIANTS))
         self.pretrain_data = pretrain_data
         self.n_users = data_config['n_users']
         self.n_items = data_config['n_items']
         self.n_cat = data_config['n_cat']
         self.n_price = data_config['n_price']
-        self.n_fold = 100
+        self.n_fold = args.n_fold
         self.norm_adj = data_config['norm_adj']
         if args.adj_type == 'adj_with_cp':
             self.cat_and_price_adj = data_config['cat_and_price_adj']
@@ -40,6 +74,7 @@ class LightGCN(object):
         #TODO: If we reduce a adjacency matrix, n_nonzero_elem might need to be changed, as this has counted the wrong adjacency matrix
         self.lr = args.lr
         self.emb_dim = args.embed_size
+        self.emb_dtype = tf.as_dtype(args.emb_dtype)
         self.batch_size = args.batch_size
         self.weight_size = eval(args.layer_size)
         self.alpha_k = args.alpha_k
@@ -47,6 +82,8 @@ class LightGCN(object):
         if (self.alpha_k == 'leveled'):
             self.layer_effects = eval(args.layer_effect)
             self._validate_layer_effects()
+        self.variant = VARIANTS[self.alg_type](self.alpha_k, self.layer_effects if self.alpha_k == 'leveled' else None)
+        self.propagation_adj = self.cat_and_price_adj if self.variant.adjacency == 'cat_and_price' else self.norm_adj
         self.regs = eval(args.regs)
         self.decay = self.regs[0]
         self.verbose = args.verbose
@@ -67,6 +104,16 @@ class LightGCN(object):
         self.node_dropout_flag = args.node_dropout_flag
         self.node_dropout = tf.placeholder(tf.float32, shape=[None])
         self.mess_dropout = tf.placeholder(tf.float32, shape=[None])
+
+        # k-hop subgraph of the batch (see sample_subgraph): its adjacency, the row ids of its nodes in every table,
+        # and the positions of the batch users and items among those nodes.
+        self.subgraph = args.subgraph
+        if self.subgraph:
+            self.sub_adj = tf.sparse_placeholder(tf.float32)
+            self.sub_nodes = [tf.placeholder(tf.int32, shape=(None,)) for t in self.variant.tables]
+            self.sub_users = tf.placeholder(tf.int32, shape=(None,))
+            self.sub_pos_items = tf.placeholder(tf.int32, shape=(None,))
+            self.sub_neg_items = tf.placeholder(tf.int32, shape=(None,))
         with tf.name_scope('TRAIN_LOSS'):
             self.train_loss = tf.placeholder(tf.float32)
             tf.summary.scalar('train_loss', self.train_loss)
@@ -123,50 +170,12 @@ class LightGCN(object):
         """
         *********************************************************
         Compute Graph-based Representations of all users & items via Message-Passing Mechanism of Graph Neural Networks.
-        Different Convolutional Layers:
+        The convolutional layer of every alg_type is registered in utility/propagation.py, e.g.:
             1. ngcf: defined in 'Neural Graph Collaborative Filtering', SIGIR2019;
             2. gcn:  defined in 'Semi-Supervised Classification with Graph Convolutional Networks', ICLR2018;
             3. gcmc: defined in 'Graph Convolutional Matrix Completion', KDD2018;
         """
-        if self.alg_type in ['lightgcn']:
-            self.ua_embeddings, self.ia_embeddings = self._create_lightgcn_embed()
-
-        elif self.alg_type in ['LightGCN-alpha-1']:
-            self.ua_embeddings, self.ia_embeddings = self._create_lightgcn_alpha_k_equals_1_embed()
-        
-        elif self.alg_type in ['ngcf']:
-            self.ua_embeddings, self.ia_embeddings = self._create_ngcf_embed()
-
-        elif self.alg_type in ['gcn']:
-            self.ua_embeddings, self.ia_embeddings = self._create_gcn_embed()
-
-        elif self.alg_type in ['gcmc']:
-            self.ua_embeddings, self.ia_embeddings = self._create_gcmc_embed()
-
-        elif self.alg_type in ['ngcfpas']:
-            self.ua_embeddings, self.ia_embeddings = self._create_ngcf_pas_embed()
-
-        elif self.alg_type in ['pas']:
-            self.ua_embeddings, self.ia_embeddings = self._create_price_aware_simple_embed()
-            
-        elif self.alg_type in ['gcf']:
-            self.ua_embeddings, self.ia_embeddings = self._create_gcf_embed()
-        
-        elif self.alg_type in ['gcf-only-ip']:
-            self.ua_embeddings, self.ia_embeddings = self._create_gcf_only_ip_embed()
-
-        elif self.alg_type in ['gcf-sum']:
-            self.ua_embeddings, self.ia_embeddings = self._create_gcf_sum_embed()
-        
-        elif self.alg_type in ['gcf-sum-only-ip']:
-            self.ua_embeddings, self.ia_embeddings = self._create_gcf_sum_only_ip_embed()
-        
-        elif self.alg_type in ['gcf-minus-ip']:
-            self.ua_embeddings, self.ia_embeddings =self._create_gcf_minus_IP_embed()
-        
-        elif self.alg_type in ['LightGCN-concat']:
-            self.ua_embeddings, self.ia_embeddings =self._create_lightgcn_concat_embed()
-        
+        self.ua_embeddings, self.ia_embeddings = self._create_embed()
 
         """
         *********************************************************
@@ -175,9 +184,9 @@ class LightGCN(object):
         self.u_g_embeddings = tf.nn.embedding_lookup(self.ua_embeddings, self.users)
         self.pos_i_g_embeddings = tf.nn.embedding_lookup(self.ia_embeddings, self.pos_items)
         self.neg_i_g_embeddings = tf.nn.embedding_lookup(self.ia_embeddings, self.neg_items)
-        self.u_g_embeddings_pre = tf.nn.embedding_lookup(self.weights['user_embedding'], self.users)
-        self.pos_i_g_embeddings_pre = tf.nn.embedding_lookup(self.weights['item_embedding'], self.pos_items)
-        self.neg_i_g_embeddings_pre = tf.nn.embedding_lookup(self.weights['item_embedding'], self.neg_items)
+        self.u_g_embeddings_pre = self._lookup('user_embedding', self.users)
+        self.pos_i_g_embeddings_pre = self._lookup('item_embedding', self.pos_items)
+        self.neg_i_g_embeddings_pre = self._lookup('item_embedding', self.neg_items)
 
         """
         *********************************************************
@@ -188,13 +197,38 @@ class LightGCN(object):
         """
         *********************************************************
         Generate Predictions & Optimize via BPR loss.
+        With subgraph training the loss only propagates over the k-hop subgraph of the batch.
         """
-        self.mf_loss, self.emb_loss, self.reg_loss = self.create_bpr_loss(self.u_g_embeddings,
-                                                                          self.pos_i_g_embeddings,
-                                                                          self.neg_i_g_embeddings)
+        if self.subgraph:
+            sub_embeddings = self._create_subgraph_embed()
+            self.mf_loss, self.emb_loss, self.reg_loss = self.create_bpr_loss(tf.gather(sub_embeddings, self.sub_users),
+                                                                              tf.gather(sub_embeddings, self.sub_pos_items),
+                                                                              tf.gather(sub_embeddings, self.sub_neg_items))
+        else:
+            self.mf_loss, self.emb_loss, self.reg_loss = self.create_bpr_loss(self.u_g_embeddings,
+                                                                              self.pos_i_g_embeddings,
+                                                                              self.neg_i_g_embeddings)
         self.loss = self.mf_loss + self.emb_loss
 
-        self.opt = tf.train.AdamOptimizer(learning_rate=self.lr).minimize(self.loss)
+        self.opt = self._create_optimizer()
+
+    def _create_optimizer(self):
+        if args.emb_optimizer == 'adagrad':
+            # Adagrad applies sparse gradients to the touched rows and accumulators only. The per-row gradients of
+            # a batch-averaged loss are far below the default initial accumulator of 0.1, which would stall training.
+            return tf.train.AdagradOptimizer(learning_rate=self.lr, initial_accumulator_value=1e-8).minimize(self.loss)
+
+        # Adam is invariant to scaling the loss when epsilon is scaled alike; scaling both keeps the gradients
+        # and second moments of reduced-precision tables out of the half precision underflow range.
+        loss_scale = 1. if self.emb_dtype == tf.float32 else 2. ** 14
+        # bfloat16 rounds beta2=0.999 up to 1, which freezes the second moment; use the largest representable value below 1.
+        beta2 = 1. - 2. ** -8 if self.emb_dtype == tf.bfloat16 else 0.999
+        if args.emb_optimizer == 'lazy_adam':
+            # Adam decays the moments of every row, even for sparse gradients; LazyAdam only touches the rows in the gradient.
+            optimizer = LazyAdamOptimizer(learning_rate=self.lr, beta2=beta2, epsilon=1e-8 * loss_scale)
+        else:
+            optimizer = tf.train.AdamOptimizer(learning_rate=self.lr, beta2=beta2, epsilon=1e-8 * loss_scale)
+        return optimizer.minimize(self.loss * loss_scale)
     
     def _validate_layer_effects(self):
         error = ''
@@ -215,462 +249,80 @@ class LightGCN(object):
     def _init_weights(self):
         all_weights = dict()
         initializer = tf.random_normal_initializer(stddev=0.01) #tf.contrib.layers.xavier_initializer()
+        self.embedding_tables = dict()
+        tables = self.variant.tables
+        table_sizes = {'user': self.n_users, 'item': self.n_items, 'price': self.n_price, 'cat': self.n_cat}
         if self.pretrain_data is None:
-            all_weights['user_embedding'] = tf.Variable(initializer([self.n_users, self.emb_dim]), name='user_embedding')
-            all_weights['item_embedding'] = tf.Variable(initializer([self.n_items, self.emb_dim]), name='item_embedding')
-            all_weights['price_embedding'] = tf.Variable(initializer([self.n_price, self.emb_dim]), name='price_embedding')
-            all_weights['cat_embedding'] = tf.Variable(initializer([self.n_cat, self.emb_dim]), name='cat_embedding')
+            for t in tables:
+                all_weights['%s_embedding' % t] = tf.Variable(tf.cast(initializer([table_sizes[t], self.emb_dim]), self.emb_dtype),
+                                                              name='%s_embedding' % t)
             print('using random initialization')#print('using xavier initialization')
         else:
-            all_weights['user_embedding'] = tf.Variable(initial_value=self.pretrain_data['user_embed'], trainable=True,
-                                                        name='user_embedding', dtype=tf.float32)
-            all_weights['item_embedding'] = tf.Variable(initial_value=self.pretrain_data['item_embed'], trainable=True,
-                                                        name='item_embedding', dtype=tf.float32)
-            all_weights['price_embedding'] = tf.Variable(initial_value=self.pretrain_data['price_embed'], trainable=True,
-                                                        name='price_embedding', dtype=tf.float32)
-            all_weights['cat_embedding'] = tf.Variable(initial_value=self.pretrain_data['cat_embed'], trainable=True,
-                                                        name='cat_embedding', dtype=tf.float32)
+            for t in tables:
+                all_weights['%s_embedding' % t] = tf.Variable(initial_value=tf.cast(self.pretrain_data['%s_embed' % t], self.emb_dtype),
+                                                              trainable=True, name='%s_embedding' % t, dtype=self.emb_dtype)
             print('using pretrained initialization')
+        for t in tables:
+            self.embedding_tables['%s_embedding' % t] = all_weights['%s_embedding' % t]
+
+        # reduced precision is only used for storage, every read of a table is upcast so that
+        # propagation, scores and loss accumulate in float32.
+        if self.emb_dtype != tf.float32:
+            for t in tables:
+                all_weights['%s_embedding' % t] = tf.cast(all_weights['%s_embedding' % t], tf.float32)
+            print('storing embedding tables as %s' % self.emb_dtype.name)
             
         self.weight_size_list = [self.emb_dim] + self.weight_size
         
+        # only the layer weights used by the variant are created, so that the saver and optimizer never see the others.
         for k in range(self.n_layers):
-            all_weights['W_gc_%d' %k] = tf.Variable(
-                initializer([self.weight_size_list[k], self.weight_size_list[k+1]]), name='W_gc_%d' % k)
-            all_weights['b_gc_%d' %k] = tf.Variable(
-                initializer([1, self.weight_size_list[k+1]]), name='b_gc_%d' % k)
-
-            all_weights['W_bi_%d' % k] = tf.Variable(
-                initializer([self.weight_size_list[k], self.weight_size_list[k + 1]]), name='W_bi_%d' % k)
-            all_weights['b_bi_%d' % k] = tf.Variable(
-                initializer([1, self.weight_size_list[k + 1]]), name='b_bi_%d' % k)
-
-            all_weights['W_mlp_%d' % k] = tf.Variable(
-                initializer([self.weight_size_list[k], self.weight_size_list[k+1]]), name='W_mlp_%d' % k)
-            all_weights['b_mlp_%d' % k] = tf.Variable(
-                initializer([1, self.weight_size_list[k+1]]), name='b_mlp_%d' % k)
+            for w in ['gc', 'bi', 'mlp']:
+                if w not in self.variant.weights:
+                    continue
+                all_weights['W_%s_%d' % (w, k)] = tf.Variable(
+                    initializer([self.weight_size_list[k], self.weight_size_list[k+1]]), name='W_%s_%d' % (w, k))
+                all_weights['b_%s_%d' % (w, k)] = tf.Variable(
+                    initializer([1, self.weight_size_list[k+1]]), name='b_%s_%d' % (w, k))
 
         return all_weights
-    def _split_A_hat(self, X):
-        A_fold_hat = []
-        length_of_adj = (X._shape[0])
-        fold_len = length_of_adj // self.n_fold
-        for i_fold in range(self.n_fold):
-            start = i_fold * fold_len
-            if i_fold == self.n_fold -1:
-                end = length_of_adj
-            else:
-                end = (i_fold + 1) * fold_len
-
-            A_fold_hat.append(self._convert_sp_mat_to_sp_tensor(X[start:end]))
-        return A_fold_hat
-
-    def _split_A_hat_node_dropout(self, X):
-        A_fold_hat = []
-        length_of_adj = (X._shape[0])
-        fold_len = (length_of_adj) // self.n_fold
-        for i_fold in range(self.n_fold):
-            start = i_fold * fold_len
-            if i_fold == self.n_fold -1:
-                end = length_of_adj
-            else:
-                end = (i_fold + 1) * fold_len
-
-            temp = self._convert_sp_mat_to_sp_tensor(X[start:end])
-            n_nonzero_temp = X[start:end].count_nonzero()
-            A_fold_hat.append(self._dropout_sparse(temp, 1 - self.node_dropout[0], n_nonzero_temp))
-
-        return A_fold_hat
-
-    def _create_price_aware_simple_embed(self): #adj matrix of I x U,C,P (one category pr. item)
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.cat_and_price_adj) # performance reasons
-        else:
-            A_fold_hat = self._split_A_hat(self.cat_and_price_adj)
-        
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding'],self.weights['cat_embedding'], self.weights['price_embedding']], axis=0)
-        all_embeddings = [ego_embeddings]
-        print("Size of ego_embeddings: ", ego_embeddings._shape)
-        print("Size of cat_and_price_adj: ", self.cat_and_price_adj._shape)
-        print("Size of A_fold_hat: ", len(A_fold_hat))
-        for k in range(0, self.n_layers):
-            temp_embed = []
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-
-            side_embeddings = tf.concat(temp_embed, 0)
-            ego_embeddings = side_embeddings
-            all_embeddings += [ego_embeddings]
-        all_embeddings=tf.stack(all_embeddings,1)
-        all_embeddings=tf.reduce_mean(all_embeddings,axis=1,keepdims=False)
-        u_g_embeddings, i_g_embeddings, c_g_embeddings, p_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items, self.n_cat, self.n_price], 0)
-        return u_g_embeddings, i_g_embeddings
-
-    def _create_ngcf_pas_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.cat_and_price_adj)
-        else:
-            A_fold_hat = self._split_A_hat(self.cat_and_price_adj)
-
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding'],self.weights['cat_embedding'], self.weights['price_embedding']], axis=0)
-
-        all_embeddings = [ego_embeddings]
-
-        for k in range(0, self.n_layers):
-
-            temp_embed = []
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-
-            side_embeddings = tf.concat(temp_embed, 0)
-            sum_embeddings = tf.nn.leaky_relu(tf.matmul(side_embeddings, self.weights['W_gc_%d' % k]) + self.weights['b_gc_%d' % k])
-            # bi messages of neighbors.
-            bi_embeddings = tf.multiply(ego_embeddings, side_embeddings)
-            # transformed bi messages of neighbors.
-            bi_embeddings = tf.nn.leaky_relu(tf.matmul(bi_embeddings, self.weights['W_bi_%d' % k]) + self.weights['b_bi_%d' % k])
-            # non-linear activation.
-            ego_embeddings = sum_embeddings + bi_embeddings
-
-            # message dropout.
-            # ego_embeddings = tf.nn.dropout(ego_embeddings, 1 - self.mess_dropout[k])
-            # normalize the distribution of embeddings.
-            norm_embeddings = tf.nn.l2_normalize(ego_embeddings, axis=1)
-
-            all_embeddings += [norm_embeddings]
-
-        all_embeddings = tf.concat(all_embeddings, 1)
-        u_g_embeddings, i_g_embeddings, c_g_embeddings, p_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items, self.n_cat, self.n_price], 0)
-        return u_g_embeddings, i_g_embeddings
-   
-    # Original GCF 
-    def _create_gcf_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.norm_adj)
-        else:
-            A_fold_hat = self._split_A_hat(self.norm_adj)
-
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-        all_embeddings = [ego_embeddings]
-
-        for k in range(0, self.n_layers):
-            temp_embed = []
-
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-            
-            side_embeddings = tf.concat(temp_embed, 0)
-            ego_embeddings = side_embeddings + tf.multiply(ego_embeddings, side_embeddings)
-
-            # normalize embeddings
-            norm_embeddings = tf.nn.l2_normalize(ego_embeddings, axis=1)
-
-            #concat
-            all_embeddings += [norm_embeddings]
-        all_embeddings = tf.concat(all_embeddings, 1)
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
-    
-    # Original GCF without inner product
-    def _create_gcf_minus_IP_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.norm_adj)
-        else:
-            A_fold_hat = self._split_A_hat(self.norm_adj)
-
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-        all_embeddings = [ego_embeddings]
-
-        for k in range(0, self.n_layers):
-            temp_embed = []
-
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-            
-            side_embeddings = tf.concat(temp_embed, 0)
-
-            # normalize embeddings
-            norm_embeddings = tf.nn.l2_normalize(side_embeddings, axis=1)
-
-            #concat
-            all_embeddings += [norm_embeddings]
-
-        all_embeddings = tf.concat(all_embeddings, 1)
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
-
-    #GCF only with IP 
-    def _create_gcf_only_ip_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.norm_adj)
-        else:
-            A_fold_hat = self._split_A_hat(self.norm_adj)
-
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-        all_embeddings = [ego_embeddings]
-
-        for k in range(0, self.n_layers):
-            temp_embed = []
-
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-            
-            side_embeddings = tf.concat(temp_embed, 0)
-            ego_embeddings = tf.multiply(ego_embeddings, side_embeddings)
-
-            # normalize embeddings
-            norm_embeddings = tf.nn.l2_normalize(ego_embeddings, axis=1)
-
-            #concat
-            all_embeddings += [norm_embeddings]
-
-        all_embeddings = tf.concat(all_embeddings, 1)
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
-    
-    # GCF with summing layers instead of concatenating layers
-    def _create_gcf_sum_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.norm_adj)
-        else:
-            A_fold_hat = self._split_A_hat(self.norm_adj)
-
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-        all_embeddings = [ego_embeddings]
-
-        for k in range(0, self.n_layers):
-            temp_embed = []
-
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-            
-            side_embeddings = tf.concat(temp_embed, 0)
-            ego_embeddings = side_embeddings + tf.multiply(ego_embeddings, side_embeddings)
-
-            # normalize embeddings
-            norm_embeddings = tf.nn.l2_normalize(ego_embeddings, axis=1)
-            all_embeddings += [norm_embeddings]
-
-        # Summing and averaging layers
-        all_embeddings=tf.stack(all_embeddings,1)
-        all_embeddings=tf.reduce_mean(all_embeddings,axis=1,keepdims=False)
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
-
-    # GCF with summing layers instead of concatenating layers and only with IP
-    def _create_gcf_sum_only_ip_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.norm_adj)
-        else:
-            A_fold_hat = self._split_A_hat(self.norm_adj)
-
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-        all_embeddings = [ego_embeddings]
-
-        for k in range(0, self.n_layers):
-            temp_embed = []
-
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-            
-            side_embeddings = tf.concat(temp_embed, 0)
-            ego_embeddings = tf.multiply(ego_embeddings, side_embeddings)
-
-            # normalize embeddings
-            norm_embeddings = tf.nn.l2_normalize(ego_embeddings, axis=1)
-            all_embeddings += [norm_embeddings]
-
-        # Summing and averaging layers
-        all_embeddings=tf.stack(all_embeddings,1)
-        all_embeddings=tf.reduce_mean(all_embeddings,axis=1,keepdims=False)
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
-
-
-    def _create_lightgcn_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.norm_adj) # performance reasons
-        else:
-            A_fold_hat = self._split_A_hat(self.norm_adj)
-        
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-        all_embeddings = [ego_embeddings]
-        
-        for k in range(0, self.n_layers):
-
-            temp_embed = []
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-
-            side_embeddings = tf.concat(temp_embed, 0)
-            ego_embeddings = side_embeddings
-            all_embeddings += [ego_embeddings]
-        all_embeddings = tf.stack(all_embeddings,1)
-        all_embeddings = self._calc_alpha_k(all_embeddings) 
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
-    
-    def _calc_alpha_k(self, embeddings):
-        if self.alpha_k == 'mean':
-            embeddings = tf.reduce_mean(embeddings,axis=1,keepdims=False)
-            return embeddings
-        elif self.alpha_k == 'leveled':
-            return self._leveled_alpha_k(embeddings)
-    
-    # Coefficient is an array of arrays, that contains the percentages of how much each layer should weigh.
-    def _leveled_alpha_k(self, embeddings):
-        # level_one, level_two, level_three = self._get_alpha_k_effect_levels()
-        # pre_temp = [0.25 for i in range(self.emb_dim)]
-        # temp = []
-        # for i in range(4):
-        #     temp.append(pre_temp)
-        # coeficients = []
-        # i = 0
-        # for dim in self.node_dim:
-        #     if i%100 == 0:
-        #         print(i)
-
-        #     if len(coeficients) == 0:
-        #         coeficients = [temp]
-        #     else:
-        #         coeficients.append(temp)
-        #     i += 1
-        layer_effects = self.layer_effects
-        for i in range(len(layer_effects)):
-            layer_effects[i] = [layer_effects[i] for k in range(self.emb_dim)]
-
-        coeficients = [layer_effects for k in range(len(self.node_dim))]
-        coeficients = np.array(coeficients)    
-        embeddings = tf.multiply(embeddings, coeficients)
-        return tf.reduce_sum(embeddings,axis=1,keepdims=False)
-
-    def _create_lightgcn_alpha_k_equals_1_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.norm_adj) # performance reasons
-        else:
-            A_fold_hat = self._split_A_hat(self.norm_adj)
-        
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-        all_embeddings = [ego_embeddings]
-        
-        for k in range(0, self.n_layers):
-            temp_embed = []
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-
-            side_embeddings = tf.concat(temp_embed, 0)
-            ego_embeddings = side_embeddings
-            all_embeddings += [ego_embeddings]
-        all_embeddings=tf.stack(all_embeddings,1)
-        all_embeddings=tf.reduce_sum(all_embeddings,axis=1,keepdims=False)
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
 
-    def _create_lightgcn_concat_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.norm_adj) # performance reasons
-        else:
-            A_fold_hat = self._split_A_hat(self.norm_adj)
-        
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-        all_embeddings = [ego_embeddings]
-        
-        for k in range(0, self.n_layers):
-
-            temp_embed = []
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
+    def _table_sizes(self):
+        sizes = {'user': self.n_users, 'item': self.n_items, 'price': self.n_price, 'cat': self.n_cat}
+        return [sizes[t] for t in self.variant.tables]
 
-            side_embeddings = tf.concat(temp_embed, 0)
-            ego_embeddings = side_embeddings
-            all_embeddings += [ego_embeddings]
-        all_embeddings = tf.concat(all_embeddings, 1)
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
+    def _node_keep_prob(self):
+        if self.node_dropout_flag and self.variant.node_dropout:
+            return 1 - self.node_dropout[0]
+        return None
 
-    def _create_ngcf_embed(self):
-        if self.node_dropout_flag:
-            A_fold_hat = self._split_A_hat_node_dropout(self.norm_adj)
+    def _create_embed(self):
+        if args.out_of_core:
+            engine = OutOfCoreEngine(self.propagation_adj, self._node_keep_prob())
         else:
-            A_fold_hat = self._split_A_hat(self.norm_adj)
-
-        ego_embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-
-        all_embeddings = [ego_embeddings]
-
-        for k in range(0, self.n_layers):
-
-            temp_embed = []
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], ego_embeddings))
-
-            side_embeddings = tf.concat(temp_embed, 0)
-            sum_embeddings = tf.nn.leaky_relu(tf.matmul(side_embeddings, self.weights['W_gc_%d' % k]) + self.weights['b_gc_%d' % k])
-
-            bi_embeddings = tf.multiply(ego_embeddings, side_embeddings)
-            # transformed bi messages of neighbors.
-            bi_embeddings = tf.nn.leaky_relu(tf.matmul(bi_embeddings, self.weights['W_bi_%d' % k]) + self.weights['b_bi_%d' % k])
-            # non-linear activation.
-            ego_embeddings = sum_embeddings + bi_embeddings
-
-            # message dropout.
-            # ego_embeddings = tf.nn.dropout(ego_embeddings, 1 - self.mess_dropout[k])
-
-            # normalize the distribution of embeddings.
-            norm_embeddings = tf.nn.l2_normalize(ego_embeddings, axis=1)
-
-            all_embeddings += [norm_embeddings]
-
-        all_embeddings = tf.concat(all_embeddings, 1)
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
-    
-    
-    def _create_gcn_embed(self):
-        A_fold_hat = self._split_A_hat(self.norm_adj)
-        embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-
-
-        all_embeddings = [embeddings]
-
-        for k in range(0, self.n_layers):
-            temp_embed = []
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], embeddings))
-
-            embeddings = tf.concat(temp_embed, 0)
-            embeddings = tf.nn.leaky_relu(tf.matmul(embeddings, self.weights['W_gc_%d' %k]) + self.weights['b_gc_%d' %k])
-            # embeddings = tf.nn.dropout(embeddings, 1 - self.mess_dropout[k])
-
-            all_embeddings += [embeddings]
-
-        all_embeddings = tf.concat(all_embeddings, 1)
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
+            engine = PropagationEngine(self.propagation_adj, self.n_fold, self._node_keep_prob())
+        ego_embeddings = tf.concat([self.weights['%s_embedding' % t] for t in self.variant.tables], axis=0)
+        all_embeddings = engine.propagate(self.variant, ego_embeddings, self.weights, self.n_layers)
+        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, self._table_sizes(), 0)[:2]
         return u_g_embeddings, i_g_embeddings
-    
-    def _create_gcmc_embed(self):
-        A_fold_hat = self._split_A_hat(self.norm_adj)
-
-        embeddings = tf.concat([self.weights['user_embedding'], self.weights['item_embedding']], axis=0)
-
-        all_embeddings = []
-
-        for k in range(0, self.n_layers):
-            temp_embed = []
-            for f in range(self.n_fold):
-                temp_embed.append(tf.sparse_tensor_dense_matmul(A_fold_hat[f], embeddings))
-            embeddings = tf.concat(temp_embed, 0)
-            # convolutional layer.
-            embeddings = tf.nn.leaky_relu(tf.matmul(embeddings, self.weights['W_gc_%d' % k]) + self.weights['b_gc_%d' % k])
-            # dense layer.
-            mlp_embeddings = tf.matmul(embeddings, self.weights['W_mlp_%d' %k]) + self.weights['b_mlp_%d' %k]
-            # mlp_embeddings = tf.nn.dropout(mlp_embeddings, 1 - self.mess_dropout[k])
-
-            all_embeddings += [mlp_embeddings]
-        all_embeddings = tf.concat(all_embeddings, 1)
-        
 
-        u_g_embeddings, i_g_embeddings = tf.split(all_embeddings, [self.n_users, self.n_items], 0)
-        return u_g_embeddings, i_g_embeddings
+    def _create_subgraph_embed(self):
+        """
+        Propagation over the k-hop subgraph of a batch. The tables are only read through
+        embedding lookups, so their gradients are sparse in the rows of the subgraph.
+        """
+        engine = PropagationEngine(self.sub_adj, 1, self._node_keep_prob())
+        ego_embeddings = tf.concat([self._lookup('%s_embedding' % t, ids) for t, ids in zip(self.variant.tables, self.sub_nodes)], axis=0)
+        return engine.propagate(self.variant, ego_embeddings, self.weights, self.n_layers)
+
+    def get_subgraph_feed_dict(self, users, pos_items, neg_items, subgraph):
+        nodes, sub_adj = subgraph
+        indices = np.stack([sub_adj.row, sub_adj.col], axis=1)
+        feed_dict = dict(zip(self.sub_nodes, split_nodes(nodes, self._table_sizes())))
+        feed_dict.update({self.sub_adj: tf.SparseTensorValue(indices, sub_adj.data.astype(np.float32), sub_adj.shape),
+                self.sub_users: np.searchsorted(nodes, users),
+                self.sub_pos_items: np.searchsorted(nodes, self.n_users + np.asarray(pos_items)),
+                self.sub_neg_items: np.searchsorted(nodes, self.n_users + np.asarray(neg_items))})
+        return feed_dict
 
     def create_bpr_loss(self, users, pos_items, neg_items):
         pos_scores = tf.reduce_sum(tf.multiply(users, pos_items), axis=1)
@@ -689,22 +341,9 @@ class LightGCN(object):
 
         return mf_loss, emb_loss, reg_loss
     
-    def _convert_sp_mat_to_sp_tensor(self, X):
-        coo = X.tocoo().astype(np.float32)
-        indices = np.mat([coo.row, coo.col]).transpose()
-        return tf.SparseTensor(indices, coo.data, coo.shape)
-        
-    def _dropout_sparse(self, X, keep_prob, n_nonzero_elems):
-        """
-        Dropout for sparse tensors.
-        """
-        noise_shape = [n_nonzero_elems]
-        random_tensor = keep_prob
-        random_tensor += tf.random_uniform(noise_shape)
-        dropout_mask = tf.cast(tf.floor(random_tensor), dtype=tf.bool)
-        pre_out = tf.sparse_retain(X, dropout_mask)
-
-        return pre_out * tf.div(1., keep_prob)
+    def _lookup(self, name, ids):
+        # rows are read before the upcast, so that the gradient of a reduced-precision table stays sparse.
+        return tf.cast(tf.nn.embedding_lookup(self.embedding_tables[name], ids), tf.float32)
 
 def load_pretrained_data():
     pretrain_path = '%spretrain/%s/%s.npz' % (args.proj_path, args.dataset, 'embedding')
@@ -715,36 +354,149 @@ def load_pretrained_data():
         pretrain_data = None
     return pretrain_data
 
+def get_weights_path(model_type):
+    layer = '-'.join([str(l) for l in eval(args.layer_size)])
+    return '%sweights/%s/%s/%s/l%s_r%s' % (args.weights_path, args.dataset, model_type, layer,
+                                          str(args.lr), '-'.join([str(r) for r in eval(args.regs)]))
+
+def load_incremental_data(checkpoint, adj):
+    """
+    Embedding tables of a stored model grown to the current users and items, to warm-start after interactions
+    were appended to train.txt. New users and items get one propagation step over their stored neighbours,
+    e_v = sum_u adj[v, u] e_u; the ones without stored neighbours keep a random initialization.
+    """
+    reader = tf.train.NewCheckpointReader(checkpoint)
+    sizes = [data_generator.n_users, data_generator.n_items]
+    stored = [reader.get_tensor('%s_embedding' % t).astype(np.float32) for t in ['user', 'item']]
+    ego = np.concatenate([np.concatenate([e, np.zeros((n - len(e), e.shape[1]), dtype=np.float32)])
+                          for e, n in zip(stored, sizes)])
+    is_stored = np.concatenate([np.arange(n) < len(e) for e, n in zip(stored, sizes)]).astype(np.float32)
+
+    new_nodes = np.flatnonzero(is_stored == 0)
+    new_adj = adj.tocsr()[new_nodes]
+    has_stored_neighbours = new_adj.dot(is_stored) > 0
+    random_rows = np.random.normal(scale=0.01, size=(len(new_nodes), ego.shape[1])).astype(np.float32)
+    ego[new_nodes] = np.where(has_stored_neighbours[:, None], new_adj.dot(ego), random_rows)
+    print('initialize %d new users and items, %d from their neighbours' % (len(new_nodes), has_stored_neighbours.sum()))
+
+    user_embed, item_embed = np.split(ego, [sizes[0]])
+    return {'user_embed': user_embed, 'item_embed': item_embed}
+
+def restore_layer_weights(sess, checkpoint, model):
+    # all stored variables but the embedding tables, which load_incremental_data grew; optimizer slots
+    # of tables that changed shape start from scratch.
+    shapes = tf.train.NewCheckpointReader(checkpoint).get_variable_to_shape_map()
+    tables = list(model.embedding_tables.values())
+    var_list = [v for v in tf.global_variables()
+                if shapes.get(v.op.name) == v.shape.as_list() and not any(v is t for t in tables)]
+    if len(var_list) > 0:
+        tf.train.Saver(var_list).restore(sess, checkpoint)
+
+def export_embeddings(sess, model, export_path):
+    """
+    Write what serving/ needs to recommend without TensorFlow:
+        user_embeddings.npy, item_embeddings.npy: the final (propagated) representations, loaded memory-mapped;
+        train_indptr.npy, train_indices.npy: the training items of every user as CSR rows, excluded from the top-K;
+        embedding.npz: the ego embeddings, in the format read by load_pretrained_data;
+        meta.json: sizes and settings of the model, written last so that its presence marks a complete export.
+    """
+    ensureDir(export_path + '/')
+    feed_dict = {model.node_dropout: [0.] * len(model.weight_size), model.mess_dropout: [0.] * len(model.weight_size)}
+    ua_embeddings, ia_embeddings = sess.run([model.ua_embeddings, model.ia_embeddings], feed_dict)
+    np.save(os.path.join(export_path, 'user_embeddings.npy'), ua_embeddings.astype(np.float32))
+    np.save(os.path.join(export_path, 'item_embeddings.npy'), ia_embeddings.astype(np.float32))
+
+    ego_embeddings = sess.run({'%s_embed' % t: model.weights['%s_embedding' % t] for t in model.variant.tables})
+    np.savez(os.path.join(export_path, 'embedding.npz'), **ego_embeddings)
+
+    train_items = [sorted(data_generator.train_items.get(u, [])) for u in range(model.n_users)]
+    indptr = np.concatenate([[0], np.cumsum([len(items) for items in train_items])]).astype(np.int64)
+    indices = np.array([i for items in train_items for i in items], dtype=np.int32)
+    np.save(os.path.join(export_path, 'train_indptr.npy'), indptr)
+    np.save(os.path.join(export_path, 'train_indices.npy'), indices)
+
+    # the version tells serving processes (and their caches) apart exports written to the same path.
+    meta = {'version': int(time() * 1000), 'dataset': args.dataset, 'alg_type': model.alg_type, 'adj_type': args.adj_type,
+            'alpha_k': model.alpha_k, 'n_users': model.n_users, 'n_items': model.n_items,
+            'embed_dim': int(ua_embeddings.shape[1]), 'n_layers': model.n_layers, 'Ks': model.Ks}
+    with open(os.path.join(export_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+def log_instrumentation(epoch, writer):
+    """
+    Log the timers and counters of an epoch (--instrument 1) and write them to TensorBoard.
+    """
+    stats = timers.collect()
+    _logger.debug('Epoch %d instrumentation: %s' % (epoch, ', '.join(['%s=%.4g' % (name, value) for name, value in sorted(stats.items())])))
+    writer.add_summary(tf.Summary(value=[tf.Summary.Value(tag='instrument/' + name, simple_value=value)
+                                         for name, value in sorted(stats.items())]), epoch)
+
+def profile_test_memory(sess, model, users_to_test):
+    # the memory of the first evaluation is traced on a few users only, tracemalloc slows the evaluator down too much.
+    if profiler.enabled and 'test_memory' not in profiler.captured:
+        profiler.call('test_memory', test, sess, model, users_to_test[:128], drop_flag=True)
+
+def subsample_users(users, n_users, seed):
+    """
+    A fixed random subset of at most n_users users (all of them with n_users <= 0), from its own generator.
+    """
+    if n_users <= 0 or n_users >= len(users):
+        return users
+    return [users[i] for i in np.random.RandomState(seed).permutation(len(users))[:n_users]]
+
+def sample_subgraph(adj, n_layers, users, pos_items, neg_items):
+    seeds = np.concatenate([users, data_generator.n_users + np.asarray(pos_items), data_generator.n_users + np.asarray(neg_items)])
+    return khop_subgraph(adj, seeds, n_layers)
+
 # parallelized sampling on CPU 
 class sample_thread(threading.Thread):
-    def __init__(self):
+    def __init__(self, subgraph_adj=None, step=None):
         threading.Thread.__init__(self)
+        self.subgraph_adj = subgraph_adj
+        # the training step the batch is sampled for, profiled with --profile_steps.
+        self.step = step
     def run(self):
-        with tf.device(cpus[0]):
-            self.data = data_generator.sample()
+        t = time()
+        with tf.device('/cpu:0'):
+            if self.step is not None and profiler.wants(self.step):
+                self.data = profiler.call('sample_step%d' % self.step, data_generator.sample)
+            else:
+                self.data = data_generator.sample()
+            if self.subgraph_adj is not None:
+                self.subgraph = sample_subgraph(self.subgraph_adj, len(eval(args.layer_size)), *self.data)
+        self.duration = time() - t
 
 class sample_thread_test(threading.Thread):
-    def __init__(self):
+    def __init__(self, subgraph_adj=None):
         threading.Thread.__init__(self)
+        self.subgraph_adj = subgraph_adj
     def run(self):
-        with tf.device(cpus[0]):
+        with tf.device('/cpu:0'):
             self.data = data_generator.sample_test()
+            if self.subgraph_adj is not None:
+                self.subgraph = sample_subgraph(self.subgraph_adj, len(eval(args.layer_size)), *self.data)
             
 # training on GPU
 class train_thread(threading.Thread):
-    def __init__(self,model, sess, sample):
+    def __init__(self,model, sess, sample, step=None):
         threading.Thread.__init__(self)
         self.model = model
         self.sess = sess
         self.sample = sample
+        self.step = step
     def run(self):
 
         users, pos_items, neg_items = self.sample.data
-        self.data = sess.run([self.model.opt, self.model.loss, self.model.mf_loss, self.model.emb_loss, self.model.reg_loss],
-                                feed_dict={model.users: users, model.pos_items: pos_items,
-                                            model.node_dropout: eval(args.node_dropout),
-                                            model.mess_dropout: eval(args.mess_dropout),
-                                            model.neg_items: neg_items})
+        feed_dict = {self.model.users: users, self.model.pos_items: pos_items,
+                     self.model.node_dropout: eval(args.node_dropout),
+                     self.model.mess_dropout: eval(args.mess_dropout),
+                     self.model.neg_items: neg_items}
+        if self.model.subgraph:
+            feed_dict.update(self.model.get_subgraph_feed_dict(users, pos_items, neg_items, self.sample.subgraph))
+        t = time()
+        self.data = profiler.run(self.sess, [self.model.opt, self.model.loss, self.model.mf_loss, self.model.emb_loss, self.model.reg_loss],
+                                 feed_dict, self.step)
+        self.duration = time() - t
 
 class train_thread_test(threading.Thread):
     def __init__(self,model, sess, sample):
@@ -755,11 +507,14 @@ class train_thread_test(threading.Thread):
     def run(self):
         
         users, pos_items, neg_items = self.sample.data
-        self.data = sess.run([self.model.loss, self.model.mf_loss, self.model.emb_loss],
-                                feed_dict={model.users: users, model.pos_items: pos_items,
-                                        model.neg_items: neg_items,
-                                        model.node_dropout: eval(args.node_dropout),
-                                        model.mess_dropout: eval(args.mess_dropout)})       
+        feed_dict = {self.model.users: users, self.model.pos_items: pos_items,
+                     self.model.neg_items: neg_items,
+                     self.model.node_dropout: eval(args.node_dropout),
+                     self.model.mess_dropout: eval(args.mess_dropout)}
+        if self.model.subgraph:
+            feed_dict.update(self.model.get_subgraph_feed_dict(users, pos_items, neg_items, self.sample.subgraph))
+        self.data = self.sess.run([self.model.loss, self.model.mf_loss, self.model.emb_loss],
+                                feed_dict=feed_dict)
 def get_multi_split_train_writers(sess, tensorboard_model_path, splits):
     users_to_test = []
     train_writers = []
@@ -787,19 +542,15 @@ def get_multi_split_train_writers(sess, tensorboard_model_path, splits):
     
     return users_to_test, train_writers, splits_with_users
 
-if __name__ == '__main__':
+def train(adj_mats=None):
+    """
+    Trains and evaluates the model of the options and dataset of setup(). adj_mats are the matrices of
+    data_generator.get_adj_mat() when already loaded. Returns the evaluations of the run.
+    """
+    # the sampling and training threads profile the steps.
+    global profiler
     os.environ["CUDA_VISIBLE_DEVICES"] = str(args.gpu_id)
     f0 = time()
-    _logger = logging.getLogger()
-    _logger.setLevel(logging.DEBUG)
-    logging_file_path = args.log_file
-    if logging_file_path == '':
-        logging_file_path = 'log_file.out'
-    output_file_handler = logging.FileHandler(logging_file_path)
-    stdout_handler = logging.StreamHandler(sys.stdout)
-
-    _logger.addHandler(output_file_handler)
-    _logger.addHandler(stdout_handler)
     running_method_settings = (f"running with settings:\n" 
                       f"dataset=            {args.dataset}\n" 
                       f"layer_size=         {args.layer_size}\n"
@@ -812,6 +563,9 @@ if __name__ == '__main__':
                       f"evaluation=         {args.evaluation}\n")
 
     _logger.debug(running_method_settings)
+    # before the workers are forked and the session is created, which both size their pools from it.
+    resources.configure_from_args(args)
+    _logger.debug('resources: %s' % resources.get_settings())
     config = dict()
     config['n_users'] = data_generator.n_users
     config['n_items'] = data_generator.n_items
@@ -822,7 +576,16 @@ if __name__ == '__main__':
     *********************************************************
     Generate the Laplacian matrix, where each entry defines the decay factor (e.g., p_ui) between two connected nodes.
     """
-    plain_adj, norm_adj, mean_adj,pre_adj, adj_with_cp, node_dim = data_generator.get_adj_mat()
+    if args.out_of_core:
+        # only the memory-mapped pre adjacency is built, none of the in-memory matrices of get_adj_mat.
+        assert args.adj_type == 'pre', 'out-of-core training only supports --adj_type pre'
+        assert not args.incremental and not args.subgraph, 'out-of-core training does not support --incremental and --subgraph'
+        pre_adj = out_of_core.load_pre_adj(data_generator.path + '/s_pre_adj_csr', data_generator.path + '/train.txt',
+                                           data_generator.n_users, data_generator.n_items, args.ooc_memory_mb)
+        plain_adj, norm_adj, mean_adj, adj_with_cp, node_dim = None, None, None, None, pre_adj.degrees()
+        _logger.debug('propagating the memory-mapped pre adjacency matrix in %d blocks' % len(pre_adj.blocks))
+    else:
+        plain_adj, norm_adj, mean_adj,pre_adj, adj_with_cp, node_dim = adj_mats if adj_mats is not None else data_generator.get_adj_mat()
 
     config['node_dim'] = node_dim
     if args.adj_type == 'plain':
@@ -849,9 +612,39 @@ if __name__ == '__main__':
     t0 = time()
     if args.pretrain == -1:
         pretrain_data = load_pretrained_data()
+    elif args.incremental == 1:
+        assert args.adj_type != 'adj_with_cp', 'incremental training does not support the category and price adjacency'
+        incremental_checkpoint = tf.train.latest_checkpoint(get_weights_path('LightGCN'))
+        assert incremental_checkpoint is not None, 'incremental training needs a model stored with --save_flag 1'
+        pretrain_data = load_incremental_data(incremental_checkpoint, config['norm_adj'])
     else:
         pretrain_data = None
     model = LightGCN(data_config=config, pretrain_data=pretrain_data)
+    if args.incremental == 1 and data_generator.changed_nodes is not None:
+        # only the users near the new interactions are trained; n_layers hops cover every user whose
+        # final embedding changed, fewer hops train the most affected ones.
+        affected_nodes, _ = khop_subgraph(model.propagation_adj.tocsr(), data_generator.changed_nodes, args.incremental_hops)
+        data_generator.restrict_training(affected_nodes[affected_nodes < data_generator.n_users].tolist())
+        _logger.debug('incremental training on %d users with %d interactions' % (len(data_generator.exist_users),
+                                                                                data_generator.n_train))
+    subgraph_adj = model.propagation_adj.tocsr() if args.subgraph else None
+
+    # data-parallel workers share the memory-mapped pre adjacency of --out_of_core, the session applies their gradients.
+    trainer = None
+    if args.n_workers > 0:
+        assert args.adj_type == 'pre' and not args.subgraph and not args.incremental, \
+            'data-parallel training needs --adj_type pre and does not support --subgraph and --incremental'
+        assert args.n_partitions <= 1, '--n_workers and --n_partitions cannot be combined'
+        workers_adj_path = data_generator.path + '/s_pre_adj_csr'
+        out_of_core.load_pre_adj(workers_adj_path, data_generator.path + '/train.txt', data_generator.n_users,
+                                 data_generator.n_items, args.ooc_memory_mb)
+        trainer = DataParallelTrainer(model, workers_adj_path, args.ooc_memory_mb, data_generator, args.n_workers, args.lr)
+    # the parts of --n_partitions own their embeddings and optimizer state, the session tables are synced every epoch.
+    elif args.out_of_core and args.n_partitions > 1:
+        assert not args.resume, 'the Adam moments of --n_partitions live in the part processes, --resume cannot restore them'
+        trainer = PartitionedTrainer(model, data_generator.path + '/s_pre_adj_csr', args.ooc_memory_mb, data_generator,
+                                     args.n_partitions, args.lr)
+        _logger.debug('partitioned training: %s' % trainer.summary())
     
     """
     *********************************************************
@@ -860,14 +653,25 @@ if __name__ == '__main__':
     saver = tf.train.Saver()
 
     if args.save_flag == 1:
-        layer = '-'.join([str(l) for l in eval(args.layer_size)])
-        weights_save_path = '%sweights/%s/%s/%s/l%s_r%s' % (args.weights_path, args.dataset, model.model_type, layer,
-                                                            str(args.lr), '-'.join([str(r) for r in eval(args.regs)]))
+        weights_save_path = get_weights_path(model.model_type)
         ensureDir(weights_save_path)
         save_saver = tf.train.Saver(max_to_keep=1)
 
+    # resumable checkpoints of the full training state, next to the weights of the same settings.
+    checkpoint_dir = get_weights_path(model.model_type) + '/resume'
+    checkpoint_writer = None
+    if args.checkpoint_every > 0:
+        checkpoint_writer = checkpoint.CheckpointWriter(checkpoint_dir, args.checkpoint_keep)
+
+    if args.export_flag == 1:
+        export_path = args.export_path
+        if export_path == '':
+            export_path = '%sexport/%s/%s/%s' % (args.proj_path, args.dataset, model.model_type, model.alg_type)
+
     config = tf.ConfigProto()
     config.gpu_options.allow_growth = True
+    config.intra_op_parallelism_threads = resources.intra_op_threads
+    config.inter_op_parallelism_threads = resources.inter_op_threads
     sess = tf.Session(config=config)
 
     """
@@ -875,10 +679,7 @@ if __name__ == '__main__':
     Reload the pretrained model parameters.
     """
     if args.pretrain == 1:
-        layer = '-'.join([str(l) for l in eval(args.layer_size)])
-
-        pretrain_path = '%sweights/%s/%s/%s/l%s_r%s' % (args.weights_path, args.dataset, model.model_type, layer,
-                                                        str(args.lr), '-'.join([str(r) for r in eval(args.regs)]))
+        pretrain_path = get_weights_path(model.model_type)
 
 
         ckpt = tf.train.get_checkpoint_state(os.path.dirname(pretrain_path + '/checkpoint'))
@@ -905,11 +706,27 @@ if __name__ == '__main__':
             cur_best_pre_0 = 0.
             _logger.debug('without pretraining.')
 
+    elif args.incremental == 1:
+        sess.run(tf.global_variables_initializer())
+        restore_layer_weights(sess, incremental_checkpoint, model)
+        cur_best_pre_0 = 0.
+        _logger.debug('warm-start from: %s' % incremental_checkpoint)
+
     else:
         sess.run(tf.global_variables_initializer())
         cur_best_pre_0 = 0.
         _logger.debug('without pretraining.')
 
+    start_epoch, resume_state = 0, None
+    if args.resume == 1:
+        resume_checkpoint = checkpoint.latest_checkpoint(checkpoint_dir)
+        if resume_checkpoint is not None:
+            start_epoch, resume_state = checkpoint.restore(sess, resume_checkpoint)
+            cur_best_pre_0 = resume_state['cur_best_pre_0']
+            _logger.debug('resume after epoch %d from: %s' % (start_epoch, resume_checkpoint))
+        else:
+            _logger.debug('no checkpoint to resume from in: %s' % checkpoint_dir)
+
     """
     *********************************************************
     Get the performance w.r.t. different sparsity levels.
@@ -928,7 +745,7 @@ if __name__ == '__main__':
             % (args.embed_size, args.lr, args.layer_size, args.keep_prob, args.regs, args.loss_type, args.adj_type))
 
         for i, users_to_test in enumerate(users_to_test_list):
-            ret = test(sess, model, users_to_test, drop_flag=True)
+            ret = test(sess, model, users_to_test, drop_flag=True, model_version='report')
 
             final_perf = "recall=[%s], precision=[%s], ndcg=[%s]" % \
                          (', '.join(['%.5f' % r for r in ret['recall']]),
@@ -979,12 +796,40 @@ if __name__ == '__main__':
         users_to_test_multiple, train_writers, train_writer_splits = get_multi_split_train_writers(sess, tensorboard_model_path + model.log_dir, train_writer_splits)
     else:
         train_writer = tf.summary.FileWriter(tensorboard_model_path +model.log_dir, sess.graph)
+    timers.enabled = args.instrument == 1
+    # training steps are counted from 0 over all epochs.
+    profiler = Profiler(args.profile_dir if args.profile_dir != '' else tensorboard_model_path + model.log_dir + '/profile',
+                        eval(args.profile_steps))
+    instrument_writer = train_writers[0] if args.evaluation == 'multiple' else train_writer
     loss_loger, pre_loger, rec_loger, ndcg_loger, hit_loger = [], [], [], [], []
     stopping_step = 0
     should_stop = False
+    scheduler = EvalScheduler(args.eval_every, args.eval_schedule == 'adaptive', args.eval_min_every, args.eval_max_every,
+                              args.eval_tolerance, args.probe_every, args.time_budget * 60)
+    # fixed subsets of the test and training users, drawn without touching the random state of the sampler.
+    probe_users = subsample_users(list(data_generator.test_set.keys()), args.probe_users, seed=0)
+    if args.evaluation == 'multiple':
+        train_recall_users = [subsample_users(users, args.train_recall_users, seed=1) for users in users_to_test_multiple]
+    else:
+        train_recall_users = subsample_users(list(data_generator.train_items.keys()), args.train_recall_users, seed=1)
+    if resume_state is not None:
+        stopping_step = resume_state['stopping_step']
+        loss_loger, pre_loger, rec_loger, ndcg_loger, hit_loger = [resume_state[name] for name in
+                                                                   ['loss_loger', 'pre_loger', 'rec_loger', 'ndcg_loger', 'hit_loger']]
+        scheduler.set_state(resume_state['scheduler'])
     
     
-    for epoch in range(1, args.epoch + 1):
+    # a resumed run that already trained --epoch epochs skips the loop.
+    epoch = start_epoch
+    for epoch in range(start_epoch + 1, args.epoch + 1):
+        # checkpoint the state after the previous epoch, also when that epoch was not evaluated.
+        if checkpoint_writer is not None and epoch - 1 > start_epoch and (epoch - 1) % args.checkpoint_every == 0:
+            checkpoint_writer.save(sess, epoch - 1, {'cur_best_pre_0': cur_best_pre_0, 'stopping_step': stopping_step,
+                                                     'loss_loger': list(loss_loger), 'pre_loger': list(pre_loger),
+                                                     'rec_loger': list(rec_loger), 'ndcg_loger': list(ndcg_loger),
+                                                     'hit_loger': list(hit_loger), 'scheduler': scheduler.get_state()})
+        if timers.enabled and epoch - 1 > start_epoch:
+            log_instrumentation(epoch - 1, instrument_writer)
         t1 = time()
         loss, mf_loss, emb_loss, reg_loss = 0., 0., 0., 0.
         n_batch = data_generator.n_train // args.batch_size + 1
@@ -993,51 +838,82 @@ if __name__ == '__main__':
         *********************************************************
         parallelized sampling
         '''
-        sample_last = sample_thread()
-        sample_last.start()
-        sample_last.join()
-        for idx in range(n_batch):
-            train_cur = train_thread(model, sess, sample_last)
-            sample_next = sample_thread()
+        first_step = (epoch - 1) * n_batch
+        if trainer is not None:
+            # a data-parallel step trains one batch per worker, a partitioned one a single batch; an epoch keeps its number of updates.
+            for idx in range(n_batch):
+                t = time()
+                batch_loss, batch_mf_loss, batch_emb_loss = trainer.step(sess)
+                timers.add('train/sess_run', time() - t)
+                timers.count('train/samples', args.batch_size * max(1, args.n_workers))
+                loss += batch_loss/n_batch
+                mf_loss += batch_mf_loss/n_batch
+                emb_loss += batch_emb_loss/n_batch
+            trainer.sync(sess)
+        else:
+            sample_last = sample_thread(subgraph_adj, first_step)
+            sample_last.start()
+            sample_last.join()
+            timers.add('train/sampler_stall', sample_last.duration)
+            for idx in range(n_batch):
+                train_cur = train_thread(model, sess, sample_last, first_step + idx)
+                sample_next = sample_thread(subgraph_adj, first_step + idx + 1)
             
-            train_cur.start()
-            sample_next.start()
+                train_cur.start()
+                sample_next.start()
             
-            sample_next.join()
-            train_cur.join()
+                sample_next.join()
+                train_cur.join()
             
-            users, pos_items, neg_items = sample_last.data
-            _, batch_loss, batch_mf_loss, batch_emb_loss, batch_reg_loss = train_cur.data
-            sample_last = sample_next
+                users, pos_items, neg_items = sample_last.data
+                _, batch_loss, batch_mf_loss, batch_emb_loss, batch_reg_loss = train_cur.data
+                sample_last = sample_next
+                # the sampler stalls the training when the next batch is not ready when the step ends.
+                timers.add('train/sess_run', train_cur.duration)
+                timers.add('train/sample', sample_next.duration)
+                timers.add('train/sampler_stall', max(0., sample_next.duration - train_cur.duration))
+                timers.count('train/samples', len(users))
         
-            loss += batch_loss/n_batch
-            mf_loss += batch_mf_loss/n_batch
-            emb_loss += batch_emb_loss/n_batch
+                loss += batch_loss/n_batch
+                mf_loss += batch_mf_loss/n_batch
+                emb_loss += batch_emb_loss/n_batch
+        timers.add('train/epoch', time() - t1)
             
-        summary_train_loss= sess.run(model.merged_train_loss,
-                                      feed_dict={model.train_loss: loss, model.train_mf_loss: mf_loss,
-                                                 model.train_emb_loss: emb_loss, model.train_reg_loss: reg_loss})
-
-        if args.evaluation == 'multiple':
-            for i in range(len(train_writers)):
-                train_writers[i].add_summary(summary_train_loss, epoch)
-        else:
-            train_writer.add_summary(summary_train_loss, epoch)
+        with timers.timer('tensorboard'):
+            summary_train_loss= sess.run(model.merged_train_loss,
+                                          feed_dict={model.train_loss: loss, model.train_mf_loss: mf_loss,
+                                                     model.train_emb_loss: emb_loss, model.train_reg_loss: reg_loss})
+
+            if args.evaluation == 'multiple':
+                for i in range(len(train_writers)):
+                    train_writers[i].add_summary(summary_train_loss, epoch)
+            else:
+                train_writer.add_summary(summary_train_loss, epoch)
         
 
         if np.isnan(loss) == True:
             _logger.debug('ERROR: loss is nan.')
             sys.exit()
+        scheduler.add_epoch(time() - t1)
         
-        if (epoch % 20) != 0:
+        if not scheduler.evaluation_due(epoch):
             if args.verbose > 0 and epoch % args.verbose == 0:
                 perf_str = 'Epoch %d [%.1fs]: train==[%.5f=%.5f + %.5f]' % (
                     epoch, time() - t1, loss, mf_loss, emb_loss)
                 _logger.debug(perf_str)
-            continue
-        if args.evaluation == 'multiple':
+            if scheduler.probe_due(epoch):
+                t2 = time()
+                ret = test(sess, model, probe_users, drop_flag=True)
+                scheduler.add_probe(ret['recall'][0])
+                _logger.debug('Epoch %d [%.1fs]: probe on %d users, recall=[%s]' % (
+                    epoch, time() - t2, len(probe_users), ', '.join(['%.5f' % r for r in ret['recall']])))
+            # a dropping probe asks for a full evaluation in this epoch.
+            if not scheduler.evaluation_due(epoch):
+                continue
+        t_eval = time()
+        if args.evaluation == 'multiple' and args.train_recall == 1:
             for i in range(len(train_writers)):
-                users_to_test = users_to_test_multiple[i]
+                users_to_test = train_recall_users[i]
                 ret = test(sess, model, users_to_test ,drop_flag=True,train_set_flag=1)
                 perf_str = 'Epoch %d - Split %s: train==[%.5f=%.5f + %.5f + %.5f], recall=[%s], precision=[%s], ndcg=[%s]' % \
                         (epoch, train_writer_splits[i], loss, mf_loss, emb_loss, reg_loss, 
@@ -1049,9 +925,9 @@ if __name__ == '__main__':
                                                                                 model.train_rec_last: ret['recall'][-1],
                                                                                 model.train_ndcg_first: ret['ndcg'][0],
                                                                                 model.train_ndcg_last: ret['ndcg'][-1]})
-                train_writers[i].add_summary(summary_train_acc, epoch // 20)
-        else:
-            users_to_test = list(data_generator.train_items.keys())
+                train_writers[i].add_summary(summary_train_acc, epoch)
+        elif args.train_recall == 1:
+            users_to_test = train_recall_users
             ret = test(sess, model, users_to_test ,drop_flag=True,train_set_flag=1)
             perf_str = 'Epoch %d: train==[%.5f=%.5f + %.5f + %.5f], recall=[%s], precision=[%s], ndcg=[%s]' % \
                     (epoch, loss, mf_loss, emb_loss, reg_loss, 
@@ -1063,19 +939,24 @@ if __name__ == '__main__':
                                                                             model.train_rec_last: ret['recall'][-1],
                                                                             model.train_ndcg_first: ret['ndcg'][0],
                                                                             model.train_ndcg_last: ret['ndcg'][-1]})
-            train_writer.add_summary(summary_train_acc, epoch // 20)
+            train_writer.add_summary(summary_train_acc, epoch)
+        t_train_recall = time() - t_eval
 
         
         '''
         *********************************************************
         parallelized sampling
         '''
-        sample_last= sample_thread_test()
-        sample_last.start()
-        sample_last.join()
-        for idx in range(n_batch):
+        t_test_loss = time()
+        # the test loss is averaged over --test_loss_batches batches, all n_batch ones with -1.
+        n_test_batch = n_batch if args.test_loss_batches < 0 else min(args.test_loss_batches, n_batch)
+        if n_test_batch > 0:
+            sample_last= sample_thread_test(subgraph_adj)
+            sample_last.start()
+            sample_last.join()
+        for idx in range(n_test_batch):
             train_cur = train_thread_test(model, sess, sample_last)
-            sample_next = sample_thread_test()
+            sample_next = sample_thread_test(subgraph_adj)
             
             train_cur.start()
             sample_next.start()
@@ -1087,28 +968,32 @@ if __name__ == '__main__':
             batch_loss_test, batch_mf_loss_test, batch_emb_loss_test = train_cur.data
             sample_last = sample_next
             
-            loss_test += batch_loss_test / n_batch
-            mf_loss_test += batch_mf_loss_test / n_batch
-            emb_loss_test += batch_emb_loss_test / n_batch
+            loss_test += batch_loss_test / n_test_batch
+            mf_loss_test += batch_mf_loss_test / n_test_batch
+            emb_loss_test += batch_emb_loss_test / n_test_batch
             
-        summary_test_loss = sess.run(model.merged_test_loss,
-                                     feed_dict={model.test_loss: loss_test, model.test_mf_loss: mf_loss_test,
-                                                model.test_emb_loss: emb_loss_test, model.test_reg_loss: reg_loss_test})
-        if args.evaluation == 'multiple':
-            for i in range(len(train_writers)):
-                train_writers[i].add_summary(summary_test_loss, epoch // 20)
-        else:
-            train_writer.add_summary(summary_test_loss, epoch // 20)
+        if n_test_batch > 0:
+            summary_test_loss = sess.run(model.merged_test_loss,
+                                         feed_dict={model.test_loss: loss_test, model.test_mf_loss: mf_loss_test,
+                                                    model.test_emb_loss: emb_loss_test, model.test_reg_loss: reg_loss_test})
+            if args.evaluation == 'multiple':
+                for i in range(len(train_writers)):
+                    train_writers[i].add_summary(summary_test_loss, epoch)
+            else:
+                train_writer.add_summary(summary_test_loss, epoch)
+        t_test_loss = time() - t_test_loss
+        _logger.debug('Epoch %d diagnostics: train recall [%.1fs], test loss on %d batches [%.1fs]' % (
+            epoch, t_train_recall, n_test_batch, t_test_loss))
         _logger.debug('\n' + model.log_dir)
         if args.evaluation == 'multiple':
             for i in range(len(train_writers)):
                 t2 = time()
                 users_to_test = users_to_test_multiple[i]
-                ret = test(sess, model, users_to_test, drop_flag=True)
+                ret = test(sess, model, users_to_test, drop_flag=True, model_version=epoch)
                 summary_test_acc = sess.run(model.merged_test_acc,
                                             feed_dict={model.test_rec_first: ret['recall'][0], model.test_rec_last: ret['recall'][-1],
                                                     model.test_ndcg_first: ret['ndcg'][0], model.test_ndcg_last: ret['ndcg'][-1]})
-                train_writers[i].add_summary(summary_test_acc, epoch // 20)
+                train_writers[i].add_summary(summary_test_acc, epoch)
                 
                                                   
                 t3 = time()
@@ -1130,10 +1015,12 @@ if __name__ == '__main__':
             stop_test_time = time()
             
             users_to_test = list(data_generator.test_set.keys())
-            ret = test(sess, model, users_to_test, drop_flag=True)
+            profile_test_memory(sess, model, users_to_test)
+            ret = profiler.call('test', test, sess, model, users_to_test, drop_flag=True, model_version=epoch, trace_memory=False)
 
             cur_best_pre_0, stopping_step, should_stop = early_stopping(ret['recall'][0], cur_best_pre_0,
-                                                                        stopping_step, expected_order='acc', flag_step=5)
+                                                                        stopping_step, expected_order='acc', flag_step=args.stopping_patience)
+            scheduler.add_evaluation(epoch, ret['recall'][0], time() - t_eval)
             if args.verbose > 0:
                 perf_str = 'Epoch %d - Combined: [%.1fs + %.1fs]: test==[%.5f=%.5f + %.5f + %.5f], recall=[%s], ' \
                         'precision=[%s], ndcg=[%s]' % \
@@ -1159,11 +1046,12 @@ if __name__ == '__main__':
             t2 = time()
 
             users_to_test = list(data_generator.test_set.keys())
-            ret = test(sess, model, users_to_test, drop_flag=True)
+            profile_test_memory(sess, model, users_to_test)
+            ret = profiler.call('test', test, sess, model, users_to_test, drop_flag=True, trace_memory=False)
             summary_test_acc = sess.run(model.merged_test_acc,
                                         feed_dict={model.test_rec_first: ret['recall'][0], model.test_rec_last: ret['recall'][-1],
                                                 model.test_ndcg_first: ret['ndcg'][0], model.test_ndcg_last: ret['ndcg'][-1]})
-            train_writer.add_summary(summary_test_acc, epoch // 20)
+            train_writer.add_summary(summary_test_acc, epoch)
                                                                                                     
             t3 = time()
             
@@ -1182,7 +1070,8 @@ if __name__ == '__main__':
                 _logger.debug(perf_str)
                 
             cur_best_pre_0, stopping_step, should_stop = early_stopping(ret['recall'][0], cur_best_pre_0,
-                                                                        stopping_step, expected_order='acc', flag_step=5)
+                                                                        stopping_step, expected_order='acc', flag_step=args.stopping_patience)
+            scheduler.add_evaluation(epoch, ret['recall'][0], time() - t_eval)
 
             # *********************************************************
             # early stopping when cur_best_pre_0 is decreasing for ten successive steps.
@@ -1194,25 +1083,66 @@ if __name__ == '__main__':
             if ret['recall'][0] == cur_best_pre_0 and args.save_flag == 1:
                 save_saver.save(sess, weights_save_path + '/weights', global_step=epoch)
                 _logger.debug('save the weights in path: ', weights_save_path)
-    recs = np.array(rec_loger)
-    pres = np.array(pre_loger)
-    ndcgs = np.array(ndcg_loger)
-
-    best_rec_0 = max(recs[:, 0])
-    idx = list(recs[:, 0]).index(best_rec_0)
-
-    final_perf = "Best Iter=[%d]@[%.1f]\trecall=[%s], precision=[%s], ndcg=[%s]" % \
-                 (idx, time() - t0, '\t'.join(['%.5f' % r for r in recs[idx]]),
-                  '\t'.join(['%.5f' % r for r in pres[idx]]),
-                  '\t'.join(['%.5f' % r for r in ndcgs[idx]]))
-    _logger.debug(final_perf)
-
-    save_path = '%soutput/%s/%s.result' % (args.proj_path, args.dataset, model.model_type)
-    ensureDir(save_path)
-    f = open(save_path, 'a')
-
-    f.write(
-        'embed_size=%d, lr=%.4f, layer_size=%s, node_dropout=%s, mess_dropout=%s, regs=%s, adj_type=%s\n\t%s\n'
-        % (args.embed_size, args.lr, args.layer_size, args.node_dropout, args.mess_dropout, args.regs,
-           args.adj_type, final_perf))
-    f.close()
+
+        if scheduler.out_of_time():
+            _logger.debug('the time budget of %.1f minutes ends after epoch %d' % (args.time_budget, epoch))
+            break
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+    if trainer is not None:
+        trainer.close()
+    if timers.enabled:
+        log_instrumentation(epoch, instrument_writer)
+    if profiler.enabled:
+        _logger.debug(profiler.summary())
+
+    # *********************************************************
+    # an incremental run keeps its last model, the next increment starts from it.
+    if args.incremental == 1 and args.save_flag == 1:
+        save_saver.save(sess, weights_save_path + '/weights', global_step=epoch)
+        _logger.debug('save the weights in path: %s' % weights_save_path)
+
+    # short (e.g. incremental) runs may end before the first evaluation.
+    if len(rec_loger) > 0:
+        recs = np.array(rec_loger)
+        pres = np.array(pre_loger)
+        ndcgs = np.array(ndcg_loger)
+
+        best_rec_0 = max(recs[:, 0])
+        idx = list(recs[:, 0]).index(best_rec_0)
+
+        final_perf = "Best Iter=[%d]@[%.1f]\trecall=[%s], precision=[%s], ndcg=[%s]" % \
+                     (idx, time() - t0, '\t'.join(['%.5f' % r for r in recs[idx]]),
+                      '\t'.join(['%.5f' % r for r in pres[idx]]),
+                      '\t'.join(['%.5f' % r for r in ndcgs[idx]]))
+        _logger.debug(final_perf)
+
+        save_path = '%soutput/%s/%s.result' % (args.proj_path, args.dataset, model.model_type)
+        ensureDir(save_path)
+        f = open(save_path, 'a')
+
+        f.write(
+            'embed_size=%d, lr=%.4f, layer_size=%s, node_dropout=%s, mess_dropout=%s, regs=%s, adj_type=%s\n\t%s\n'
+            % (args.embed_size, args.lr, args.layer_size, args.node_dropout, args.mess_dropout, args.regs,
+               args.adj_type, final_perf))
+        f.close()
+
+    # *********************************************************
+    # export the embeddings of the best model (the last one when the saver is disabled) for serving.
+    if args.export_flag == 1:
+        if args.save_flag == 1:
+            save_saver.restore(sess, tf.train.latest_checkpoint(weights_save_path))
+        export_embeddings(sess, model, export_path)
+        _logger.debug('export the embeddings in path: %s' % export_path)
+    sess.close()
+
+    # every full evaluation of the run, the metrics hold one value per K of --Ks.
+    return {'epochs': epoch, 'seconds': time() - f0, 'best_iter': idx if len(rec_loger) > 0 else None,
+            'loss': [float(loss) for loss in loss_loger], 'recall': np.array(rec_loger).tolist(),
+            'precision': np.array(pre_loger).tolist(), 'ndcg': np.array(ndcg_loger).tolist()}
+
+
+if __name__ == '__main__':
+    setup()
+    add_log_handlers(args.log_file)
+    train()
@@ -0,0 +1,58 @@
+'''
+Recall against latency of the IVF item index (serving/ann.py) compared with exact top-K scoring,
+on an embedding export of LightGCN.py (--export_flag 1), e.g.
+    python benchmarks/ann_recall.py --export_path export/amazon-book/LightGCN/lightgcn --nprobes [1,4,16,64]
+Recall is the overlap of the approximate and the exact top-K, both excluding the training items.
+Prints one JSON line for the exact path and one per number of probed lists.
+'''
+import argparse
+import json
+import os
+import sys
+from time import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving import InferenceEngine
+from serving.ann import IVFIndex
+
+parser = argparse.ArgumentParser(description="Benchmark the IVF item index.")
+parser.add_argument('--export_path', nargs='?', required=True,
+                    help='Directory of the embedding export.')
+parser.add_argument('--n_lists', type=int, default=0,
+                    help='Number of lists of the index, 0: sqrt of the number of items.')
+parser.add_argument('--nprobes', nargs='?', default='[1, 4, 16, 64]',
+                    help='Numbers of probed lists to time.')
+parser.add_argument('--k', type=int, default=20,
+                    help='Number of recommended items.')
+parser.add_argument('--n_users', type=int, default=2048,
+                    help='Number of randomly drawn users to query.')
+parser.add_argument('--batch_size', type=int, default=256,
+                    help='Number of users per query batch.')
+args = parser.parse_args()
+
+
+def time_queries(recommend, users):
+    items, t0 = [], time()
+    for start in range(0, len(users), args.batch_size):
+        items.append(recommend(users[start:start + args.batch_size])[0])
+    return np.concatenate(items, axis=0), (time() - t0) / len(users)
+
+
+engine = InferenceEngine(args.export_path)
+users = np.random.RandomState(0).choice(engine.n_users, min(args.n_users, engine.n_users), replace=False)
+
+t0 = time()
+engine.index = IVFIndex.build(engine.item_embeddings, args.n_lists if args.n_lists > 0 else None)
+build_time = time() - t0
+
+exact, exact_latency = time_queries(lambda batch: engine.recommend(batch, args.k), users)
+print(json.dumps({'method': 'exact', 'n_items': engine.n_items, 'k': args.k, 'recall': 1.0,
+                  'ms_per_user': 1000 * exact_latency}))
+for nprobe in eval(args.nprobes):
+    approx, latency = time_queries(lambda batch: engine.recommend(batch, args.k, nprobe=nprobe), users)
+    recall = np.mean([len(np.intersect1d(a, e)) / float(args.k) for a, e in zip(approx, exact)])
+    print(json.dumps({'method': 'ivf', 'n_lists': engine.index.n_lists, 'nprobe': nprobe, 'k': args.k,
+                      'build_s': build_time, 'recall': recall, 'ms_per_user': 1000 * latency,
+                      'speedup': exact_latency / latency}))
@@ -0,0 +1,104 @@
+'''
+Measures the CPU settings of utility/resources.py on this machine and writes the fastest as a --resource_config:
+    training: the step time of LightGCN.py for every pair of --intra_op_threads and --inter_op_threads;
+    evaluation: the time of eval_score_matrix_foldout on a fixed score matrix for every --eval_threads.
+    python benchmarks/autotune.py --dataset gowalla --output resources.json
+    python LightGCN.py --dataset gowalla --resource_config resources.json
+Options other than the ones below are passed to LightGCN.py, --cpus restricts the measured set.
+Prints one JSON line per measurement.
+'''
+import argparse
+import json
+import os
+import sys
+from time import time
+
+bench_parser = argparse.ArgumentParser(description="Tune the thread pools of LightGCN training and evaluation.")
+bench_parser.add_argument('--thread_counts', nargs='?', default='',
+                          help='Thread counts to try, default: 1, 2, 4, ... up to twice the CPUs of the set.')
+bench_parser.add_argument('--n_steps', type=int, default=10,
+                          help='Number of timed training steps per setting.')
+bench_parser.add_argument('--eval_users', type=int, default=2048,
+                          help='Rows of the score matrix of the evaluation.')
+bench_parser.add_argument('--output', nargs='?', default='resources.json',
+                          help='Resource config written with the fastest settings.')
+bench_args, sys.argv[1:] = bench_parser.parse_known_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LightGCN import *
+
+
+def time_steps(model, intra_op_threads, inter_op_threads):
+    session_config = tf.ConfigProto()
+    session_config.intra_op_parallelism_threads = intra_op_threads
+    session_config.inter_op_parallelism_threads = inter_op_threads
+    sess = tf.Session(config=session_config)
+    sess.run(tf.global_variables_initializer())
+    step_time = 0.
+    # the first step builds the graph buffers and is not timed.
+    for step in range(bench_args.n_steps + 1):
+        users, pos_items, neg_items = data_generator.sample()
+        t1 = time()
+        sess.run([model.opt, model.loss], feed_dict={model.users: users, model.pos_items: pos_items,
+                                                     model.neg_items: neg_items,
+                                                     model.node_dropout: eval(args.node_dropout),
+                                                     model.mess_dropout: eval(args.mess_dropout)})
+        if step > 0:
+            step_time += time() - t1
+    sess.close()
+    return step_time / bench_args.n_steps
+
+
+def time_evaluation(score_matrix, test_items, eval_threads):
+    eval_score_matrix_foldout(score_matrix, test_items, 20, eval_threads)
+    t1 = time()
+    eval_score_matrix_foldout(score_matrix, test_items, 20, eval_threads)
+    return time() - t1
+
+
+if __name__ == '__main__':
+    args, data_generator = setup()
+    resources.configure_from_args(args)
+    n_cpus = len(resources.cpus)
+    if bench_args.thread_counts != '':
+        thread_counts = eval(bench_args.thread_counts)
+    else:
+        thread_counts = [1 << i for i in range(n_cpus.bit_length() + 1)]
+
+    plain_adj, norm_adj, mean_adj, pre_adj, adj_with_cp, node_dim = data_generator.get_adj_mat()
+    config = dict()
+    config['n_users'] = data_generator.n_users
+    config['n_items'] = data_generator.n_items
+    config['n_cat'] = data_generator.n_cat
+    config['n_price'] = data_generator.n_price
+    config['node_dim'] = node_dim
+    config['norm_adj'] = pre_adj
+    model = LightGCN(data_config=config, pretrain_data=None)
+
+    step_times = dict()
+    for intra_op_threads in thread_counts:
+        for inter_op_threads in thread_counts:
+            step_time = time_steps(model, intra_op_threads, inter_op_threads)
+            step_times[(intra_op_threads, inter_op_threads)] = step_time
+            print(json.dumps({'stage': 'training', 'n_cpus': n_cpus, 'intra_op_threads': intra_op_threads,
+                              'inter_op_threads': inter_op_threads, 'step_time': step_time}))
+
+    rng = np.random.RandomState(0)
+    test_users = list(data_generator.test_set.keys())[:bench_args.eval_users]
+    score_matrix = rng.random_sample((len(test_users), data_generator.n_items)).astype(np.float32)
+    test_items = [data_generator.test_set[u] for u in test_users]
+    eval_times = dict()
+    for eval_threads in thread_counts:
+        eval_times[eval_threads] = time_evaluation(score_matrix, test_items, eval_threads)
+        print(json.dumps({'stage': 'evaluation', 'n_cpus': n_cpus, 'eval_threads': eval_threads,
+                          'seconds': eval_times[eval_threads]}))
+
+    intra_op_threads, inter_op_threads = min(step_times, key=step_times.get)
+    settings = {'cpus': resources.cpus, 'intra_op_threads': intra_op_threads, 'inter_op_threads': inter_op_threads,
+                'eval_threads': min(eval_times, key=eval_times.get), 'pin': resources.pin,
+                'step_times': [[intra, inter, seconds] for (intra, inter), seconds in sorted(step_times.items())],
+                'eval_times': sorted(eval_times.items())}
+    with open(bench_args.output, 'w') as f:
+        json.dump(settings, f, indent=1)
+    print(json.dumps({'stage': 'best', 'output': bench_args.output,
+                      **{key: settings[key] for key in ['intra_op_threads', 'inter_op_threads', 'eval_threads']}}))
@@ -0,0 +1,107 @@
+'''
+Checks and times data-parallel training (--n_workers) on CPU:
+    gradient: the numpy loss and gradient of a worker against the tensorflow ones of the same batch;
+    combined: --check_workers batches, each propagated over its subgraph as a worker does and averaged as
+    DataParallelTrainer.step does, against the mean of the tensorflow gradients of the batches;
+    scaling: training samples per second of the single-process tensorflow step (sampling and sess.run)
+    and of the data-parallel step for every worker count.
+    python benchmarks/data_parallel.py --dataset gowalla --worker_counts [1,2,4,8]
+Options other than the ones below are passed to LightGCN.py. Prints one JSON line per measurement.
+'''
+import argparse
+import json
+import os
+import sys
+from time import time
+
+import numpy as np
+
+bench_parser = argparse.ArgumentParser(description="Check and time data-parallel training.")
+bench_parser.add_argument('--worker_counts', nargs='?', default='[1, 2, 4]',
+                          help='Numbers of workers to time.')
+bench_parser.add_argument('--n_steps', type=int, default=5,
+                          help='Number of timed steps per configuration.')
+bench_parser.add_argument('--check_workers', type=int, default=3,
+                          help='Number of batches of the combined check.')
+bench_args, sys.argv[1:] = bench_parser.parse_known_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LightGCN import *
+from utility.data_parallel import bpr_gradient, subgraph_gradient
+
+
+def build(adj):
+    tf.reset_default_graph()
+    config = dict(n_users=data_generator.n_users, n_items=data_generator.n_items, n_cat=data_generator.n_cat,
+                  n_price=data_generator.n_price, node_dim=None, norm_adj=adj)
+    return LightGCN(data_config=config, pretrain_data=None)
+
+
+def feed(model, batch):
+    users, pos_items, neg_items = batch
+    return {model.users: users, model.pos_items: pos_items, model.neg_items: neg_items,
+            model.node_dropout: [0.] * model.n_layers, model.mess_dropout: [0.] * model.n_layers}
+
+
+if __name__ == '__main__':
+    args, data_generator = setup()
+    adj_path = data_generator.path + '/s_pre_adj_csr'
+    mmap_adj = out_of_core.load_pre_adj(adj_path, data_generator.path + '/train.txt', data_generator.n_users,
+                                        data_generator.n_items, args.ooc_memory_mb)
+    in_memory_adj = data_generator.get_adj_mat()[3]
+
+    model = build(in_memory_adj)
+    tables = [model.embedding_tables['user_embedding'], model.embedding_tables['item_embedding']]
+    gradients = [tf.convert_to_tensor(g) for g in tf.gradients(model.loss, tables)]
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    batch = data_generator.sample()
+    expected = sess.run([model.mf_loss, model.emb_loss] + gradients, feed(model, batch))
+    embeddings = np.concatenate(sess.run(tables), axis=0)
+    coefficient = 1. / (model.n_layers + 1) if model.alg_type == 'lightgcn' else 1.
+    mf_loss, emb_loss, gradient = bpr_gradient(mmap_adj, embeddings, model.n_users, *batch, n_layers=model.n_layers,
+                                               coefficient=coefficient, decay=model.decay, batch_size=args.batch_size)
+    expected_gradient = np.concatenate(expected[2:], axis=0)
+    print(json.dumps(dict(stage='gradient', mf_loss=float(mf_loss), tf_mf_loss=float(expected[0]),
+                          emb_loss=float(emb_loss), tf_emb_loss=float(expected[1]),
+                          max_abs_diff=float(np.abs(gradient - expected_gradient).max()),
+                          max_abs_gradient=float(np.abs(expected_gradient).max()))))
+
+    batches = [batch] + [data_generator.sample() for _ in range(bench_args.check_workers - 1)]
+    expected_gradient = np.mean([np.concatenate(sess.run(gradients, feed(model, b)), axis=0) for b in batches], axis=0)
+    gradient = np.zeros_like(embeddings)
+    subgraph_nodes = []
+    for b in batches:
+        _, _, nodes, batch_gradient = subgraph_gradient(mmap_adj, embeddings, model.n_users, *b, n_layers=model.n_layers,
+                                                        coefficient=coefficient, decay=model.decay,
+                                                        batch_size=args.batch_size)
+        gradient[nodes] += batch_gradient / len(batches)
+        subgraph_nodes.append(len(nodes))
+    print(json.dumps(dict(stage='combined', n_workers=bench_args.check_workers, subgraph_nodes=subgraph_nodes,
+                          n_nodes=len(embeddings), max_abs_diff=float(np.abs(gradient - expected_gradient).max()))))
+
+    fetches = [model.opt, model.loss]
+    sess.run(fetches, feed(model, data_generator.sample()))
+    t1 = time()
+    for _ in range(bench_args.n_steps):
+        sess.run(fetches, feed(model, data_generator.sample()))
+    seconds = (time() - t1) / bench_args.n_steps
+    print(json.dumps(dict(stage='scaling', mode='single_process', n_fold=args.n_fold, seconds_per_step=seconds,
+                          samples_per_s=args.batch_size / seconds)))
+    sess.close()
+
+    for n_workers in eval(bench_args.worker_counts):
+        model = build(in_memory_adj)
+        trainer = DataParallelTrainer(model, adj_path, args.ooc_memory_mb, data_generator, n_workers, args.lr)
+        sess = tf.Session()
+        sess.run(tf.global_variables_initializer())
+        trainer.step(sess)
+        t1 = time()
+        for _ in range(bench_args.n_steps):
+            trainer.step(sess)
+        seconds = (time() - t1) / bench_args.n_steps
+        trainer.close()
+        sess.close()
+        print(json.dumps(dict(stage='scaling', mode='data_parallel', n_workers=n_workers, seconds_per_step=seconds,
+                              samples_per_s=n_workers * args.batch_size / seconds)))
@@ -0,0 +1,152 @@
+'''
+Times the hot paths of LightGCN.py in isolation, on CPU:
+    parse: Data.__init__ reading train.txt/test.txt;
+    adj: create_adj_mat (with the norm and mean normalizations) and every normalization on its own;
+    sample: Data.sample at several batch sizes;
+    propagation: one forward propagation of LightGCN at several fold counts (--n_fold);
+    test: batch_test.test end to end on a subset of the test users;
+    evaluator: eval_score_matrix_foldout in C++ (when built) and in python on the same score matrix.
+Runs on a bundled dataset or on a synthetic power-law graph, e.g.
+    python benchmarks/hot_paths.py --dataset gowalla --output bench/gowalla.json
+    python benchmarks/hot_paths.py --synthetic [100000,50000,5000000] --stages [parse,adj,sample]
+Options other than the ones below are passed to LightGCN.py. Prints one JSON line per measurement;
+--output also writes them with the commit and the dataset sizes, to compare commits.
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+from time import time
+
+import numpy as np
+import scipy.sparse as sp
+
+bench_parser = argparse.ArgumentParser(description="Benchmark the data, sampling, propagation and evaluation hot paths.")
+bench_parser.add_argument('--stages', nargs='?', default='[parse, adj, sample, propagation, test, evaluator]',
+                          help='Stages to time.')
+bench_parser.add_argument('--batch_sizes', nargs='?', default='[1024, 4096, 16384]',
+                          help='Batch sizes of the sample stage.')
+bench_parser.add_argument('--fold_counts', nargs='?', default='[1, 10, 100]',
+                          help='Fold counts of the propagation stage.')
+bench_parser.add_argument('--n_repeats', type=int, default=5,
+                          help='Number of timed repeats of the fast stages (sample, propagation).')
+bench_parser.add_argument('--test_users', type=int, default=1024,
+                          help='Number of test users of the test and evaluator stages.')
+bench_parser.add_argument('--synthetic', nargs='?', default='',
+                          help='[n_users,n_items,n_interactions] of a synthetic power-law dataset (utility/synthetic.py) to benchmark on instead of --dataset.')
+bench_parser.add_argument('--synthetic_dir', nargs='?', default='Data/synthetic/',
+                          help='Directory the synthetic datasets are written to (and reused from).')
+bench_parser.add_argument('--output', nargs='?', default='',
+                          help='JSON file the results are written to.')
+bench_args, sys.argv[1:] = bench_parser.parse_known_args()
+STAGES = [stage.strip() for stage in bench_args.stages.strip('[]').split(',')]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utility.synthetic import generate
+
+if bench_args.synthetic != '':
+    sizes = [int(n) for n in bench_args.synthetic.strip('[]').split(',')]
+    synthetic_name = 'synthetic-%d-%d-%d' % tuple(sizes)
+    if not os.path.exists(os.path.join(bench_args.synthetic_dir, synthetic_name, 'train.txt')):
+        generate(os.path.join(bench_args.synthetic_dir, synthetic_name), *sizes)
+    sys.argv += ['--data_path', bench_args.synthetic_dir, '--dataset', synthetic_name]
+
+from LightGCN import *
+from utility.load_data import Data, normalized_adj_single, normalized_adj_symmetric
+
+results = []
+
+
+def timed(fn, n_repeats=1):
+    # mean seconds of n_repeats calls after one untimed warm-up call when repeating, and the last result.
+    if n_repeats > 1:
+        fn()
+    t1 = time()
+    for _ in range(n_repeats):
+        result = fn()
+    return (time() - t1) / n_repeats, result
+
+
+def report(stage, seconds, **params):
+    record = dict(stage=stage, seconds=seconds, **params)
+    print(json.dumps(record))
+    results.append(record)
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    path = args.data_path + args.dataset
+    data = None
+    if 'parse' in STAGES or 'adj' in STAGES:
+        seconds, data = timed(lambda: Data(path=path, batch_size=args.batch_size))
+        report('parse', seconds, n_train=data.n_train)
+    # the timed dataset is the one the other stages run on.
+    args, data_generator = setup(args, data)
+    if 'adj' in STAGES:
+        seconds, (adj_mat, _, _, _) = timed(data.create_adj_mat)
+        report('create_adj_mat', seconds, nnz=adj_mat.nnz)
+        for name, normalize in [('norm', lambda: normalized_adj_single(adj_mat + sp.eye(adj_mat.shape[0]))),
+                                ('mean', lambda: normalized_adj_single(adj_mat)),
+                                ('pre', lambda: normalized_adj_symmetric(adj_mat))]:
+            report('normalize', timed(normalize)[0], adj_type=name)
+
+    if 'sample' in STAGES:
+        for batch_size in eval(bench_args.batch_sizes):
+            data_generator.batch_size = batch_size
+            seconds = timed(data_generator.sample, bench_args.n_repeats)[0]
+            report('sample', seconds, batch_size=batch_size, samples_per_s=batch_size / seconds)
+        data_generator.batch_size = args.batch_size
+
+    users_to_test = list(data_generator.test_set.keys())[:bench_args.test_users]
+    if 'propagation' in STAGES or 'test' in STAGES or 'evaluator' in STAGES:
+        plain_adj, norm_adj, mean_adj, pre_adj, adj_with_cp, node_dim = data_generator.get_adj_mat()
+        config = dict(n_users=data_generator.n_users, n_items=data_generator.n_items, n_cat=data_generator.n_cat,
+                      n_price=data_generator.n_price, node_dim=node_dim, norm_adj=pre_adj)
+        feed_dict = {}
+        # the model of the last fold count is evaluated by the test and evaluator stages.
+        for n_fold in (eval(bench_args.fold_counts) if 'propagation' in STAGES else [args.n_fold]):
+            args.n_fold = n_fold
+            tf.reset_default_graph()
+            model = LightGCN(data_config=config, pretrain_data=None)
+            sess = tf.Session()
+            sess.run(tf.global_variables_initializer())
+            feed_dict = {model.node_dropout: [0.] * model.n_layers, model.mess_dropout: [0.] * model.n_layers}
+            if 'propagation' in STAGES:
+                seconds = timed(lambda: sess.run([model.ua_embeddings, model.ia_embeddings], feed_dict),
+                                bench_args.n_repeats)[0]
+                report('propagation', seconds, n_fold=n_fold, n_layers=model.n_layers)
+
+    if 'test' in STAGES:
+        seconds = timed(lambda: test(sess, model, users_to_test, drop_flag=True))[0]
+        report('test', seconds, n_users=len(users_to_test), users_per_s=len(users_to_test) / seconds)
+
+    if 'evaluator' in STAGES:
+        feed_dict.update({model.users: users_to_test, model.pos_items: range(data_generator.n_items)})
+        rate_batch = sess.run(model.batch_ratings, feed_dict)
+        for idx, user in enumerate(users_to_test):
+            rate_batch[idx][data_generator.train_items[user]] = -np.inf
+        test_items = [data_generator.test_set[user] for user in users_to_test]
+        for implementation in ['cpp', 'python']:
+            try:
+                module = __import__('evaluator.%s.evaluate_foldout' % implementation, fromlist=['eval_score_matrix_foldout'])
+            except ImportError:
+                report('evaluator', None, implementation=implementation, error='not built')
+                continue
+            seconds = timed(lambda: module.eval_score_matrix_foldout(rate_batch, test_items, max(model.Ks)))[0]
+            report('evaluator', seconds, implementation=implementation, n_users=len(users_to_test))
+
+    if bench_args.output != '':
+        ensureDir(bench_args.output)
+        with open(bench_args.output, 'w') as f:
+            json.dump({'commit': commit(), 'dataset': args.dataset, 'n_users': data_generator.n_users,
+                       'n_items': data_generator.n_items, 'n_train': data_generator.n_train,
+                       'results': results}, f, indent=2)
@@ -0,0 +1,74 @@
+'''
+Checks --out_of_core 1 against the in-memory propagation on a dataset and times both, on CPU:
+    adjacency: the memory-mapped pre adjacency against the s_pre_adj_mat.npz of get_adj_mat;
+    propagation: the final user and item embeddings and the gradient of the embedding tables of one batch,
+    for every memory budget, as the largest absolute difference to the in-memory model of --n_fold folds.
+    python benchmarks/out_of_core.py --dataset gowalla --memory_mbs [16,256]
+Options other than the ones below are passed to LightGCN.py. Prints one JSON line per measurement.
+'''
+import argparse
+import json
+import os
+import sys
+from time import time
+
+import numpy as np
+
+bench_parser = argparse.ArgumentParser(description="Compare out-of-core and in-memory propagation.")
+bench_parser.add_argument('--memory_mbs', nargs='?', default='[0.25, 256]',
+                          help='Memory budgets (--ooc_memory_mb) to compare.')
+bench_parser.add_argument('--n_repeats', type=int, default=3,
+                          help='Number of timed propagations per model.')
+bench_args, sys.argv[1:] = bench_parser.parse_known_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LightGCN import *
+
+
+def build(pre_adj, out_of_core_flag, batch):
+    # the same seed gives the same initial tables in every graph.
+    args.out_of_core = out_of_core_flag
+    tf.reset_default_graph()
+    tf.set_random_seed(0)
+    config = dict(n_users=data_generator.n_users, n_items=data_generator.n_items, n_cat=data_generator.n_cat,
+                  n_price=data_generator.n_price, node_dim=None, norm_adj=pre_adj)
+    model = LightGCN(data_config=config, pretrain_data=None)
+    tables = [model.embedding_tables['user_embedding'], model.embedding_tables['item_embedding']]
+    gradients = [tf.convert_to_tensor(g) for g in tf.gradients(model.loss, tables)]
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    users, pos_items, neg_items = batch
+    feed_dict = {model.users: users, model.pos_items: pos_items, model.neg_items: neg_items,
+                 model.node_dropout: [0.] * model.n_layers, model.mess_dropout: [0.] * model.n_layers}
+
+    fetches = [model.ua_embeddings, model.ia_embeddings] + gradients
+    sess.run(fetches, feed_dict)
+    t1 = time()
+    for _ in range(bench_args.n_repeats):
+        result = sess.run(fetches, feed_dict)
+    seconds = (time() - t1) / bench_args.n_repeats
+    sess.close()
+    return result, seconds
+
+
+if __name__ == '__main__':
+    args, data_generator = setup()
+    in_memory_adj = data_generator.get_adj_mat()[3]
+    for memory_mb in eval(bench_args.memory_mbs):
+        mmap_adj = out_of_core.load_pre_adj(data_generator.path + '/s_pre_adj_csr', data_generator.path + '/train.txt',
+                                            data_generator.n_users, data_generator.n_items, memory_mb)
+        difference = abs(mmap_adj.tocsr() - in_memory_adj.tocsr())
+        print(json.dumps(dict(stage='adjacency', memory_mb=memory_mb, n_blocks=len(mmap_adj.blocks), nnz=mmap_adj.nnz,
+                              in_memory_nnz=int(in_memory_adj.nnz), max_abs_diff=float(difference.max()))))
+
+    batch = data_generator.sample()
+    expected, seconds = build(in_memory_adj, 0, batch)
+    print(json.dumps(dict(stage='propagation', mode='in_memory', n_fold=args.n_fold, seconds=seconds)))
+    for memory_mb in eval(bench_args.memory_mbs):
+        mmap_adj = out_of_core.MmapCSR(data_generator.path + '/s_pre_adj_csr', memory_mb)
+        result, seconds = build(mmap_adj, 1, batch)
+        diffs = [float(np.abs(r - e).max()) for r, e in zip(result, expected)]
+        print(json.dumps(dict(stage='propagation', mode='out_of_core', memory_mb=memory_mb, n_blocks=len(mmap_adj.blocks),
+                              seconds=seconds, max_abs_diff_user=diffs[0], max_abs_diff_item=diffs[1],
+                              max_abs_diff_gradients=max(diffs[2:]), max_abs_gradient=float(max(np.abs(e).max() for e in expected[2:])))))
@@ -0,0 +1,114 @@
+'''
+Partitions the pre adjacency of a dataset for --n_partitions and reports, for every number of parts:
+    partition: edge cut, edges per part and the halo rows and bytes exchanged per layer of the greedy
+    partitioner and of contiguous node ranges with the same number of edges;
+    update: the tables after one partitioned training step against the ones after the tensorflow step of the
+    same batch from the same tables;
+    scaling: seconds per step of the single-process tensorflow step and of the partitioned one.
+    python benchmarks/partition.py --dataset gowalla --part_counts [2,4,8]
+Options other than the ones below are passed to LightGCN.py. Prints one JSON line per measurement.
+'''
+import argparse
+import json
+import os
+import sys
+from time import time
+
+import numpy as np
+
+bench_parser = argparse.ArgumentParser(description="Partition the adjacency and time partitioned training.")
+bench_parser.add_argument('--part_counts', nargs='?', default='[2, 4, 8]',
+                          help='Numbers of parts.')
+bench_parser.add_argument('--n_steps', type=int, default=5,
+                          help='Number of timed steps per configuration.')
+bench_args, sys.argv[1:] = bench_parser.parse_known_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LightGCN import *
+from utility.partition import PartitionedTrainer, partition_nodes, partition_stats
+
+
+class FixedSampler(object):
+    # the same batch at every step.
+    def __init__(self, batch):
+        self.batch = batch
+        self.batch_size = len(batch[0])
+
+    def sample(self):
+        return self.batch
+
+
+def build(adj):
+    tf.reset_default_graph()
+    config = dict(n_users=data_generator.n_users, n_items=data_generator.n_items, n_cat=data_generator.n_cat,
+                  n_price=data_generator.n_price, node_dim=None, norm_adj=adj)
+    return LightGCN(data_config=config, pretrain_data=None)
+
+
+def feed(model, batch):
+    users, pos_items, neg_items = batch
+    return {model.users: users, model.pos_items: pos_items, model.neg_items: neg_items,
+            model.node_dropout: [0.] * model.n_layers, model.mess_dropout: [0.] * model.n_layers}
+
+
+if __name__ == '__main__':
+    args, data_generator = setup()
+    adj_path = data_generator.path + '/s_pre_adj_csr'
+    adj = out_of_core.load_pre_adj(adj_path, data_generator.path + '/train.txt', data_generator.n_users,
+                                   data_generator.n_items, args.ooc_memory_mb)
+    batch = data_generator.sample()
+
+    model = build(adj)
+    tables = [model.embedding_tables['user_embedding'], model.embedding_tables['item_embedding']]
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    fetches = [model.opt, model.loss]
+    sess.run(fetches, feed(model, data_generator.sample()))
+    t1 = time()
+    for _ in range(bench_args.n_steps):
+        sess.run(fetches, feed(model, data_generator.sample()))
+    seconds = (time() - t1) / bench_args.n_steps
+    print(json.dumps(dict(stage='scaling', n_parts=1, seconds_per_step=seconds)))
+    sess.close()
+
+    for n_parts in eval(bench_args.part_counts):
+        # contiguous ranges of about nnz / n_parts edges each.
+        ranges = np.searchsorted(adj.indptr, np.arange(1, n_parts) * adj.nnz / n_parts)
+        contiguous = np.searchsorted(ranges, np.arange(adj.shape[0]), side='right')
+        print(json.dumps(dict(stage='partition', partitioner='contiguous', **partition_stats(adj, contiguous, n_parts, args.embed_size))))
+        t1 = time()
+        parts = partition_nodes(adj, n_parts)
+        seconds = time() - t1
+        print(json.dumps(dict(stage='partition', partitioner='greedy', seconds=seconds, **partition_stats(adj, parts, n_parts, args.embed_size))))
+
+        model = build(adj)
+        tables = [model.embedding_tables['user_embedding'], model.embedding_tables['item_embedding']]
+        trainer = PartitionedTrainer(model, adj_path, args.ooc_memory_mb, FixedSampler(batch), n_parts, args.lr)
+        sess = tf.Session()
+        sess.run(tf.global_variables_initializer())
+        trainer.load(sess)
+        _, mf_loss, emb_loss = sess.run([model.opt, model.mf_loss, model.emb_loss], feed(model, batch))
+        expected = np.concatenate(sess.run(tables), axis=0)
+        _, partitioned_mf_loss, partitioned_emb_loss = trainer.step(sess)
+        trainer.sync(sess)
+        result = np.concatenate(sess.run(tables), axis=0)
+        trainer.close()
+        print(json.dumps(dict(stage='update', n_parts=n_parts, mf_loss=float(partitioned_mf_loss), tf_mf_loss=float(mf_loss),
+                              emb_loss=float(partitioned_emb_loss), tf_emb_loss=float(emb_loss),
+                              max_abs_diff=float(np.abs(result - expected).max()))))
+        sess.close()
+
+        # the workers are forked before the session is created.
+        model = build(adj)
+        trainer = PartitionedTrainer(model, adj_path, args.ooc_memory_mb, data_generator, n_parts, args.lr)
+        sess = tf.Session()
+        sess.run(tf.global_variables_initializer())
+        trainer.step(sess)
+        t1 = time()
+        for _ in range(bench_args.n_steps):
+            trainer.step(sess)
+        seconds = (time() - t1) / bench_args.n_steps
+        trainer.close()
+        sess.close()
+        print(json.dumps(dict(stage='scaling', n_parts=n_parts, seconds_per_step=seconds)))
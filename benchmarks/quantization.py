@@ -0,0 +1,75 @@
+'''
+Memory, latency and ranking quality of compressed embedding tables (serving/quantization.py)
+against the float embeddings of an export of LightGCN.py (--export_flag 1), e.g.
+    python benchmarks/quantization.py --export_path export/amazon-book/LightGCN/lightgcn --data_path Data/
+The test users are ranked with eval_score_matrix_foldout, excluding their training items as in batch_test.
+Prints one JSON line per table format, with the recall/ndcg change relative to float32.
+'''
+import argparse
+import json
+import os
+import sys
+from time import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving import InferenceEngine
+from serving.quantization import Int8Embeddings, PQEmbeddings
+from utility.load_data import Data
+from evaluator import eval_score_matrix_foldout
+
+parser = argparse.ArgumentParser(description="Benchmark compressed embedding tables.")
+parser.add_argument('--export_path', nargs='?', required=True,
+                    help='Directory of the embedding export.')
+parser.add_argument('--data_path', nargs='?', default='Data/',
+                    help='Input data path, the dataset is read from the export.')
+parser.add_argument('--n_subspaces', nargs='?', default='[8, 16]',
+                    help='Numbers of PQ subspaces to evaluate.')
+parser.add_argument('--Ks', nargs='?', default='[20]',
+                    help='Top k(s) recommend')
+parser.add_argument('--batch_size', type=int, default=1024,
+                    help='Number of test users scored at once.')
+args = parser.parse_args()
+
+
+def evaluate(engine, data, Ks):
+    max_top = max(Ks)
+    users = sorted(data.test_set.keys())
+    all_result, score_time = [], 0.
+    for start in range(0, len(users), args.batch_size):
+        user_batch = np.array(users[start:start + args.batch_size])
+        t0 = time()
+        rate_batch = engine.score(user_batch)
+        score_time += time() - t0
+        rows, items = engine.train_items(user_batch)
+        rate_batch[rows, items] = -np.inf
+        test_items = [data.test_set[user] for user in user_batch]
+        all_result.append(eval_score_matrix_foldout(rate_batch, test_items, max_top))
+    final_result = np.reshape(np.mean(np.concatenate(all_result, axis=0), axis=0), [5, max_top])
+    return final_result[1, np.array(Ks) - 1], final_result[3, np.array(Ks) - 1], score_time / len(users)
+
+
+engine = InferenceEngine(args.export_path)
+data = Data(path=os.path.join(args.data_path, engine.meta['dataset']), batch_size=args.batch_size)
+Ks = eval(args.Ks)
+
+formats = [('float32', None, None)]
+formats += [('int8', Int8Embeddings.build, {})]
+formats += [('pq%d' % m, PQEmbeddings.build, {'n_subspaces': m}) for m in eval(args.n_subspaces)]
+base_recall, base_ndcg = None, None
+for name, build, kwargs in formats:
+    t0 = time()
+    if build is None:
+        engine.quantized = None
+        nbytes = engine.user_embeddings.nbytes + engine.item_embeddings.nbytes
+    else:
+        engine.quantized = build(engine.user_embeddings, **kwargs), build(engine.item_embeddings, **kwargs)
+        nbytes = engine.quantized[0].nbytes + engine.quantized[1].nbytes
+    build_time = time() - t0
+    recall, ndcg, latency = evaluate(engine, data, Ks)
+    if base_recall is None:
+        base_recall, base_ndcg = recall, ndcg
+    print(json.dumps({'format': name, 'bytes': int(nbytes), 'build_s': build_time, 'ms_per_user': 1000 * latency,
+                      'recall': recall.tolist(), 'ndcg': ndcg.tolist(),
+                      'recall_change': (recall / base_recall - 1).tolist(), 'ndcg_change': (ndcg / base_ndcg - 1).tolist()}))
@@ -0,0 +1,100 @@
+'''
+Load test of the micro-batching server (serving/server.py) on localhost, e.g.
+    python benchmarks/serving_load.py --export_path export/amazon-book/LightGCN/lightgcn --concurrency [1,16,128]
+starts a server for the export, sends n_requests for random users at every concurrency level and
+prints one JSON line per level with the client side throughput and latencies and the server statistics.
+Without --export_path an already running server at --host/--port is tested.
+'''
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from time import time
+
+import numpy as np
+
+parser = argparse.ArgumentParser(description="Load test the recommendation server.")
+parser.add_argument('--export_path', nargs='?', default='',
+                    help='Embedding export to start a server for, empty: use a running server.')
+parser.add_argument('--host', nargs='?', default='127.0.0.1',
+                    help='Address of the server.')
+parser.add_argument('--port', type=int, default=8080,
+                    help='Port of the server.')
+parser.add_argument('--concurrency', nargs='?', default='[1, 16, 128]',
+                    help='Numbers of concurrent clients.')
+parser.add_argument('--n_requests', type=int, default=2000,
+                    help='Number of requests per concurrency level.')
+parser.add_argument('--n_users', type=int, default=1000,
+                    help='Requests are drawn from user ids [0, n_users).')
+parser.add_argument('--k', type=int, default=20,
+                    help='Number of recommended items per request.')
+parser.add_argument('--max_batch_size', type=int, default=256,
+                    help='Passed to the started server.')
+parser.add_argument('--max_wait_ms', type=float, default=2.,
+                    help='Passed to the started server.')
+args = parser.parse_args()
+
+
+async def get(path):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (path, args.host)).encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    header, body = response.split(b'\r\n\r\n', 1)
+    assert header.startswith(b'HTTP/1.1 200'), header
+    return json.loads(body)
+
+
+async def client(users, latencies):
+    for user in users:
+        t0 = time()
+        await get('/recommend?user=%d&k=%d' % (user, args.k))
+        latencies.append(time() - t0)
+
+
+async def load(concurrency):
+    users = np.random.randint(args.n_users, size=args.n_requests)
+    latencies = []
+    before = await get('/stats')
+    t0 = time()
+    await asyncio.gather(*[client(users[c::concurrency], latencies) for c in range(concurrency)])
+    elapsed = time() - t0
+    after = await get('/stats')
+    latencies = np.array(latencies) * 1000
+    return {'concurrency': concurrency, 'requests_per_s': args.n_requests / elapsed,
+            'client_p50_ms': float(np.percentile(latencies, 50)), 'client_p99_ms': float(np.percentile(latencies, 99)),
+            'mean_batch_size': (after['requests'] - before['requests']) / float(max(after['batches'] - before['batches'], 1)),
+            'server': after}
+
+
+async def wait_for_server(timeout=60.):
+    t0 = time()
+    while True:
+        try:
+            return await get('/stats')
+        except OSError:
+            if time() - t0 > timeout:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def main():
+    await wait_for_server()
+    for concurrency in eval(args.concurrency):
+        print(json.dumps(await load(concurrency)))
+
+
+server = None
+if args.export_path != '':
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen([sys.executable, '-m', 'serving.server', '--export_path', args.export_path,
+                               '--host', args.host, '--port', str(args.port), '--max_batch_size', str(args.max_batch_size),
+                               '--max_wait_ms', str(args.max_wait_ms)], cwd=root)
+try:
+    asyncio.run(main())
+finally:
+    if server is not None:
+        server.terminate()
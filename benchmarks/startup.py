@@ -0,0 +1,49 @@
+'''
+Start-up cost of the entry points, each measured in a fresh interpreter:
+    import: importing the module, which neither parses the options nor loads the dataset;
+    setup: setup() of utility/batch_test.py and LightGCN.py, parsing the options and loading the dataset.
+    python benchmarks/startup.py --dataset gowalla
+Options other than the ones below are passed to the measured modules. Prints one JSON line per measurement.
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+bench_parser = argparse.ArgumentParser(description="Time the imports and the setup of the entry points.")
+bench_parser.add_argument('--modules', nargs='?', default='[evaluator, utility.load_data, utility.batch_test, LightGCN]',
+                          help='Modules to import, setup() is also timed for the ones that have it.')
+bench_parser.add_argument('--n_repeats', type=int, default=3,
+                          help='Number of fresh interpreters per module, the fastest is reported.')
+bench_args, sys.argv[1:] = bench_parser.parse_known_args()
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the child interpreter, the last line of its output is the measurement.
+MEASURE = '''
+import json, sys
+from time import time
+sys.path.insert(0, %r)
+sys.argv = [sys.argv[0]] + %r
+t1 = time()
+import %s as module
+t2 = time()
+if hasattr(module, 'setup'):
+    module.setup()
+print(json.dumps([t2 - t1, time() - t2 if hasattr(module, 'setup') else None]))
+'''
+
+
+def measure(module):
+    output = subprocess.check_output([sys.executable, '-c', MEASURE % (ROOT, sys.argv[1:], module)],
+                                     stderr=subprocess.DEVNULL)
+    return json.loads(output.decode().strip().split('\n')[-1])
+
+
+if __name__ == '__main__':
+    for module in [name.strip() for name in bench_args.modules.strip('[]').split(',')]:
+        runs = [measure(module) for _ in range(bench_args.n_repeats)]
+        print(json.dumps({'stage': 'import', 'module': module, 'seconds': min(run[0] for run in runs)}))
+        if runs[0][1] is not None:
+            print(json.dumps({'stage': 'setup', 'module': module, 'seconds': min(run[1] for run in runs)}))
@@ -0,0 +1,69 @@
+'''
+Training step time of LightGCN.py against the batch size, for full-graph and k-hop subgraph training.
+Options other than the ones below are passed to LightGCN.py, e.g.
+    python benchmarks/step_time.py --batch_sizes [512,2048,8192] --dataset gowalla --emb_optimizer lazy_adam
+Prints one JSON line per (mode, batch size).
+'''
+import argparse
+import json
+import os
+import sys
+from time import time
+
+bench_parser = argparse.ArgumentParser(description="Benchmark LightGCN training steps.")
+bench_parser.add_argument('--batch_sizes', nargs='?', default='[256, 1024, 4096]',
+                          help='Batch sizes to time.')
+bench_parser.add_argument('--n_steps', type=int, default=10,
+                          help='Number of timed steps per batch size.')
+bench_args, sys.argv[1:] = bench_parser.parse_known_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LightGCN import *
+
+
+def time_steps(model, sess, subgraph_adj, batch_size):
+    data_generator.batch_size = batch_size
+    sample_time, step_time = 0., 0.
+    # the first step builds the graph buffers and is not timed.
+    for step in range(bench_args.n_steps + 1):
+        t1 = time()
+        users, pos_items, neg_items = data_generator.sample()
+        feed_dict = {model.users: users, model.pos_items: pos_items, model.neg_items: neg_items,
+                     model.node_dropout: eval(args.node_dropout), model.mess_dropout: eval(args.mess_dropout)}
+        if subgraph_adj is not None:
+            subgraph = sample_subgraph(subgraph_adj, model.n_layers, users, pos_items, neg_items)
+            feed_dict.update(model.get_subgraph_feed_dict(users, pos_items, neg_items, subgraph))
+        t2 = time()
+        sess.run([model.opt, model.loss], feed_dict=feed_dict)
+        t3 = time()
+        if step > 0:
+            sample_time += t2 - t1
+            step_time += t3 - t2
+    return sample_time / bench_args.n_steps, step_time / bench_args.n_steps
+
+
+if __name__ == '__main__':
+    args, data_generator = setup()
+    plain_adj, norm_adj, mean_adj, pre_adj, adj_with_cp, node_dim = data_generator.get_adj_mat()
+    config = dict()
+    config['n_users'] = data_generator.n_users
+    config['n_items'] = data_generator.n_items
+    config['n_cat'] = data_generator.n_cat
+    config['n_price'] = data_generator.n_price
+    config['node_dim'] = node_dim
+    config['norm_adj'] = pre_adj
+
+    for subgraph in [0, 1]:
+        args.subgraph = subgraph
+        tf.reset_default_graph()
+        model = LightGCN(data_config=config, pretrain_data=None)
+        sess = tf.Session()
+        sess.run(tf.global_variables_initializer())
+        subgraph_adj = pre_adj.tocsr() if subgraph else None
+
+        for batch_size in eval(bench_args.batch_sizes):
+            sample_time, step_time = time_steps(model, sess, subgraph_adj, batch_size)
+            print(json.dumps({'dataset': args.dataset, 'mode': 'subgraph' if subgraph else 'full',
+                              'emb_optimizer': args.emb_optimizer, 'batch_size': batch_size,
+                              'sample_time': sample_time, 'step_time': step_time}))
+        sess.close()
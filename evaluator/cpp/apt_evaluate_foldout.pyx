@@ -24,7 +24,8 @@ def apt_evaluate_foldout(ranking_scores, ground_truth, top_k = 20, thread_num=No
     users_num, rank_len = np.shape(ranking_scores)
     if users_num != len(ground_truth):
         raise Exception("The lengths of 'ranking_scores' and 'ground_truth' are different.")
-    thread_num = (thread_num or (os.cpu_count() or 1) * 5)
+    # one thread per CPU the process may run on, more only compete for the same cores.
+    thread_num = thread_num or (len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1))
 
     float_type = get_float_type()
     int_type = get_int_type()
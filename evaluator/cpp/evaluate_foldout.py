@@ -12,7 +12,12 @@ import sys
 def eval_score_matrix_foldout(score_matrix, test_items, top_k=20, thread_num=None):
     if len(score_matrix) != len(test_items):
         raise ValueError("The lengths of score_matrix and test_items are not equal.")
-    thread_num = (thread_num or (os.cpu_count() or 1) * 5)
+    # one thread per CPU the process may run on, more only compete for the same cores.
+    thread_num = thread_num or (len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1))
+    # the C++ kernel reads 32-bit floats, reduced-precision (float16/bfloat16) scores are upcast once here.
+    score_matrix = np.asarray(score_matrix)
+    if score_matrix.dtype != np.float32:
+        score_matrix = score_matrix.astype(np.float32)
     results = apt_evaluate_foldout(score_matrix, test_items, top_k, thread_num)
     
     return results
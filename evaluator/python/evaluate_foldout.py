@@ -60,6 +60,11 @@ def mrr(rank, ground_truth):
 
 
 def eval_score_matrix_foldout(score_matrix, test_items, top_k=50, thread_num=None):
+    # reduced-precision (float16/bfloat16) scores are ranked in float32 like the C++ evaluator.
+    score_matrix = np.asarray(score_matrix)
+    if score_matrix.dtype.itemsize < 4:
+        score_matrix = score_matrix.astype(np.float32)
+
     def _eval_one_user(idx):
         scores = score_matrix[idx]  # all scores of the test user
         test_item = test_items[idx]  # all test items of the test user
@@ -0,0 +1,172 @@
+'''
+Trains many configurations of LightGCN.py over one dataset, e.g. a grid of --regs and --layer_effect, parsing the
+dataset and loading its adjacency matrices once instead of once per launch:
+    from experiment import Experiment
+    experiment = Experiment(['--dataset', 'gowalla', '--epoch', '400'], results_path='sweeps/gowalla.jsonl')
+    experiment.run(Experiment.grid(regs=['[1e-4]', '[1e-3]'], lr=[0.001, 0.01]), n_processes=2)
+or from the command line, where options other than the ones below are shared by the configurations:
+    python experiment.py --dataset gowalla --grid "{'regs': ['[1e-4]', '[1e-3]']}" --results sweeps/gowalla.jsonl
+
+An Experiment holds the shared options, the Data and the matrices of get_adj_mat(). A Trainer trains one
+configuration, the options that differ from the shared ones, with LightGCN.train in a graph of its own. With
+n_processes > 1 every configuration runs in a process forked from the experiment, which shares the loaded arrays
+copy-on-write (and the memory-mapped adjacency of --out_of_core through the page cache). Every configuration
+appends a record to the results store, the configurations already done are skipped when a sweep is run again.
+'''
+import argparse
+import copy
+import itertools
+import json
+import multiprocessing
+import os
+import traceback
+from time import time
+
+import tensorflow as tf
+
+import LightGCN
+from utility.parser import parse_args
+
+# options the configurations of an experiment cannot change: they share its dataset, which incremental runs modify.
+SHARED_OPTIONS = ['data_path', 'dataset', 'incremental']
+
+
+class ResultsStore(object):
+    """
+    JSON lines, one record per trained configuration: its name, the options that differ from the shared ones,
+    all options, the status ('done' or the error), the seconds and the evaluations returned by LightGCN.train.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, record):
+        if os.path.dirname(self.path) != '':
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line) for line in f if line.strip() != '']
+
+    def done(self):
+        return set(record['name'] for record in self.load() if record['status'] == 'done')
+
+
+class Trainer(object):
+    def __init__(self, experiment, overrides, log_file=None):
+        self.experiment = experiment
+        self.args = experiment.config_args(overrides)
+        if log_file is not None and 'log_file' not in overrides:
+            self.args.log_file = log_file
+        self.overrides = {name: getattr(self.args, name) for name in sorted(overrides)}
+        self.name = ','.join('%s=%s' % (name, value) for name, value in self.overrides.items()) or 'default'
+
+    def run(self):
+        """
+        Trains the configuration in this process and returns its record, a failed run is recorded with its error.
+        """
+        t1 = time()
+        record = {'name': self.name, 'config': self.overrides, 'args': vars(self.args)}
+        LightGCN.setup(self.args, self.experiment.data)
+        handlers = LightGCN.add_log_handlers(self.args.log_file)
+        try:
+            with tf.Graph().as_default():
+                record['result'] = LightGCN.train(self.experiment.adj_mats)
+            record['status'] = 'done'
+        # a nan loss ends the run with sys.exit().
+        except (Exception, SystemExit):
+            record['status'] = 'failed'
+            record['error'] = traceback.format_exc()
+        finally:
+            for handler in handlers:
+                LightGCN._logger.removeHandler(handler)
+                handler.close()
+        record['seconds'] = time() - t1
+        return record
+
+
+# the trainers of a parallel run, inherited by the forked processes.
+_trainers = []
+
+
+def run_trainer(index):
+    return _trainers[index].run()
+
+
+class Experiment(object):
+    def __init__(self, argv=None, data=None, results_path='experiment.jsonl'):
+        """
+        argv: the options shared by the configurations, sys.argv when None. data: their Data when already loaded.
+        """
+        self.args, self.data = LightGCN.setup(parse_args(argv), data)
+        # --out_of_core runs map their adjacency from disk instead.
+        self.adj_mats = None if self.args.out_of_core else self.data.get_adj_mat()
+        self.store = ResultsStore(results_path)
+
+    @staticmethod
+    def grid(**options):
+        """
+        Every combination of the values of the options, e.g. grid(regs=['[1e-4]', '[1e-3]'], lr=[0.001, 0.01]).
+        """
+        names = sorted(options)
+        return [dict(zip(names, values)) for values in itertools.product(*[options[name] for name in names])]
+
+    def config_args(self, overrides):
+        # values are converted to the type of the option, e.g. [1e-4] to the string '[0.0001]' of --regs.
+        unknown = sorted(set(overrides) - set(vars(self.args)))
+        if len(unknown) > 0:
+            raise ValueError('unknown options %s' % unknown)
+        shared = sorted(set(overrides) & set(SHARED_OPTIONS))
+        if len(shared) > 0:
+            raise ValueError('the configurations of an experiment share its dataset, %s cannot differ' % shared)
+        args = copy.copy(self.args)
+        for name, value in overrides.items():
+            default = getattr(self.args, name)
+            setattr(args, name, value if isinstance(value, type(default)) else type(default)(value))
+        return args
+
+    def run(self, configs, n_processes=1):
+        """
+        Trains the configurations that are not done in the results store, in this process or in n_processes forked
+        ones, and returns all records of the store. Forking needs a process without tensorflow sessions, so a
+        parallel run should come before any sequential one.
+        """
+        global _trainers
+        log_prefix = os.path.splitext(self.store.path)[0]
+        trainers = [Trainer(self, overrides, '%s-%d.log' % (log_prefix, i) if self.args.log_file == '' else None)
+                    for i, overrides in enumerate(configs)]
+        done = self.store.done()
+        trainers = [trainer for trainer in trainers if trainer.name not in done]
+        if n_processes > 1:
+            _trainers = trainers
+            # a process per configuration frees its graph and session.
+            with multiprocessing.get_context('fork').Pool(n_processes, maxtasksperchild=1) as pool:
+                for record in pool.imap_unordered(run_trainer, range(len(trainers))):
+                    self.store.append(record)
+            _trainers = []
+        else:
+            for trainer in trainers:
+                self.store.append(trainer.run())
+        return self.store.load()
+
+
+if __name__ == '__main__':
+    experiment_parser = argparse.ArgumentParser(description="Train a grid of LightGCN configurations over one dataset.")
+    experiment_parser.add_argument('--grid', nargs='?', default='{}',
+                                   help="Values of the options that differ, e.g. \"{'regs': ['[1e-4]', '[1e-3]'], 'lr': [0.001, 0.01]}\", every combination is trained.")
+    experiment_parser.add_argument('--n_processes', type=int, default=1,
+                                   help='Number of configurations trained at the same time, each in a forked process. 1: in this process.')
+    experiment_parser.add_argument('--results', nargs='?', default='experiment.jsonl',
+                                   help='JSON lines file the records are appended to, the configurations done in it are skipped.')
+    experiment_args, argv = experiment_parser.parse_known_args()
+
+    experiment = Experiment(argv, results_path=experiment_args.results)
+    for record in experiment.run(Experiment.grid(**eval(experiment_args.grid)), experiment_args.n_processes):
+        summary = {'name': record['name'], 'status': record['status'], 'seconds': record['seconds']}
+        if record['status'] == 'done' and record['result']['best_iter'] is not None:
+            best_iter = record['result']['best_iter']
+            summary.update({metric: record['result'][metric][best_iter] for metric in ['recall', 'precision', 'ndcg']})
+        print(json.dumps(summary))
@@ -0,0 +1,2 @@
+# top-K recommendation from an embedding export (LightGCN.py --export_flag 1), without TensorFlow.
+from serving.inference import InferenceEngine
@@ -0,0 +1,115 @@
+'''
+Inverted file (IVF) index for approximate maximum inner product search over item embeddings.
+
+Items are augmented with one extra dimension, sqrt(M^2 - |x|^2) for the largest norm M, so that
+the item with the largest inner product with a query [q, 0] is also its nearest neighbour.
+k-means over the augmented items gives the coarse lists; a query only scores the items
+of its nprobe nearest lists, exactly, instead of the whole catalog.
+'''
+import os
+import json
+import numpy as np
+
+from serving.inference import top_k
+
+
+def augment(items):
+    norms = np.sum(np.square(items), axis=1)
+    return np.concatenate([items, np.sqrt(np.maximum(norms.max() - norms, 0.))[:, None]], axis=1)
+
+
+def nearest_centroids(x, centroids, n_nearest=1, batch_size=8192):
+    """
+    Ids of the n_nearest centroids (squared L2) of every row of x, x may have one dimension less than
+    the centroids, the missing coordinate is taken as 0.
+    """
+    sq_norms = np.sum(np.square(centroids), axis=1)
+    nearest = [np.zeros((0, n_nearest), dtype=np.int64)]
+    for start in range(0, len(x), batch_size):
+        # |x|^2 is the same for every centroid and does not change the order.
+        dist = sq_norms - 2 * np.matmul(x[start:start + batch_size], centroids[:, :x.shape[1]].T)
+        if n_nearest == 1:
+            nearest.append(np.argmin(dist, axis=1)[:, None])
+        else:
+            nearest.append(top_k(-dist, n_nearest)[0])
+    return np.concatenate(nearest, axis=0)
+
+
+def kmeans(x, n_clusters, n_iter=20, seed=0):
+    rng = np.random.RandomState(seed)
+    centroids = x[rng.choice(len(x), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        assign = nearest_centroids(x, centroids)[:, 0]
+        counts = np.bincount(assign, minlength=n_clusters)
+        order = np.argsort(assign, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        non_empty = counts > 0
+        centroids = centroids.copy()
+        centroids[non_empty] = np.add.reduceat(x[order], starts[non_empty], axis=0) / counts[non_empty, None]
+        # restart empty clusters from random points.
+        centroids[~non_empty] = x[rng.choice(len(x), int(np.sum(~non_empty)), replace=False)]
+    return centroids
+
+
+class IVFIndex(object):
+    def __init__(self, centroids, indptr, item_ids, vectors):
+        """
+        The items of list l are item_ids[indptr[l]:indptr[l+1]], their embeddings are the same rows of vectors.
+        """
+        self.centroids = centroids
+        self.indptr = indptr
+        self.item_ids = item_ids
+        self.vectors = vectors
+        self.n_lists = len(centroids)
+
+    @classmethod
+    def build(cls, items, n_lists=None, n_iter=20, seed=0):
+        """
+        n_lists defaults to sqrt(#items), which balances probing the centroids against scanning the lists.
+        """
+        items = np.asarray(items, dtype=np.float32)
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(items)))
+        augmented = augment(items)
+        centroids = kmeans(augmented, n_lists, n_iter, seed)
+        assign = nearest_centroids(augmented, centroids)[:, 0]
+        item_ids = np.argsort(assign, kind='stable').astype(np.int64)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))]).astype(np.int64)
+        return cls(centroids.astype(np.float32), indptr, item_ids, items[item_ids])
+
+    def save(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'ivf_centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'ivf_indptr.npy'), self.indptr)
+        np.save(os.path.join(path, 'ivf_item_ids.npy'), self.item_ids)
+        np.save(os.path.join(path, 'ivf_vectors.npy'), self.vectors)
+        with open(os.path.join(path, 'ivf.json'), 'w') as f:
+            json.dump({'n_lists': self.n_lists, 'n_items': len(self.item_ids), 'dim': int(self.vectors.shape[1])}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        return cls(*[np.load(os.path.join(path, 'ivf_%s.npy' % name), mmap_mode=mmap_mode)
+                     for name in ['centroids', 'indptr', 'item_ids', 'vectors']])
+
+    def query(self, queries, k=20, nprobe=8, exclude=None):
+        """
+        Approximate top-k item ids and inner products for every query vector, as two [len(queries), k] arrays.
+        exclude is an optional list with the item ids to skip for every query. Slots that cannot be
+        filled from the probed lists get item id -1 and score -inf.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        probes = nearest_centroids(queries, self.centroids, min(nprobe, self.n_lists))
+        items = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, lists in enumerate(probes):
+            rows = np.concatenate([np.arange(self.indptr[l], self.indptr[l + 1]) for l in lists])
+            candidates = self.item_ids[rows]
+            candidate_scores = np.matmul(self.vectors[rows], queries[i])
+            if exclude is not None:
+                candidate_scores[np.isin(candidates, exclude[i])] = -np.inf
+            top, top_scores = top_k(candidate_scores[None, :], k)
+            n = top.shape[1]
+            items[i, :n], scores[i, :n] = candidates[top[0]], top_scores[0]
+        items[np.isneginf(scores)] = -1
+        return items, scores
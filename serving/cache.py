@@ -0,0 +1,82 @@
+'''
+LRU cache of per-user top-K lists, shared by the serving engine and the evaluation in batch_test.
+
+Entries are keyed by (model version, user, K, exclusion version), so a new model or new training
+interactions never return stale lists; a change of model version drops the whole cache at once.
+The cache is bounded by the bytes of the cached arrays, and entries optionally expire after ttl seconds.
+'''
+from time import time
+from collections import OrderedDict
+
+import numpy as np
+
+# bytes of the key, the tuple and the dictionary slot of an entry, on top of its arrays.
+ENTRY_OVERHEAD = 200
+
+
+class TopKCache(object):
+    def __init__(self, max_bytes=64 * 2 ** 20, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.model_version = None
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def set_model_version(self, model_version):
+        if model_version != self.model_version:
+            self.clear()
+            self.model_version = model_version
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def get(self, user, k, exclusion_version=None):
+        key = (self.model_version, user, k, exclusion_version)
+        entry = self.entries.get(key)
+        if entry is not None and self.ttl is not None and time() > entry[2]:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0], entry[1]
+
+    def put(self, user, k, items, scores, exclusion_version=None):
+        key = (self.model_version, user, k, exclusion_version)
+        if key in self.entries:
+            self._remove(key)
+        expires = time() + self.ttl if self.ttl is not None else None
+        self.entries[key] = (items, scores, expires)
+        self.nbytes += items.nbytes + scores.nbytes + ENTRY_OVERHEAD
+        while self.nbytes > self.max_bytes and self.entries:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        items, scores, expires = self.entries.pop(key)
+        self.nbytes -= items.nbytes + scores.nbytes + ENTRY_OVERHEAD
+
+    def lookup_batch(self, users, k, compute, exclusion_version=None):
+        """
+        Top-k items and scores of a batch of users, as two [len(users), k] arrays. The users that are
+        not cached are passed to compute (user ids -> items, scores) in one call and cached.
+        """
+        if len(users) == 0:
+            return np.zeros((0, k), dtype=np.int64), np.zeros((0, k), dtype=np.float32)
+        cached = [self.get(user, k, exclusion_version) for user in users]
+        missing = [i for i, entry in enumerate(cached) if entry is None]
+        if missing:
+            items, scores = compute(np.asarray(users)[missing])
+            for j, i in enumerate(missing):
+                cached[i] = items[j].copy(), scores[j].copy()
+                self.put(users[i], k, cached[i][0], cached[i][1], exclusion_version)
+        return np.stack([entry[0] for entry in cached]), np.stack([entry[1] for entry in cached])
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / float(lookups) if lookups else None}
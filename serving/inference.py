@@ -0,0 +1,166 @@
+'''
+NumPy inference engine for the embeddings exported by LightGCN.py (--export_flag 1).
+
+Only numpy is imported, and the embedding and training matrices are memory-mapped,
+so a serving process starts in milliseconds and shares the pages with other processes.
+'''
+import os
+import json
+import numpy as np
+
+
+def top_k(scores, k):
+    """
+    Indices and values of the k largest scores of every row, in descending order.
+    argpartition selects the k candidates in linear time, only those are sorted.
+    """
+    k = min(k, scores.shape[1])
+    rows = np.arange(scores.shape[0])[:, None]
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-scores[rows, candidates], axis=1)
+    items = candidates[rows, order]
+    return items, scores[rows, items]
+
+
+class InferenceEngine(object):
+    def __init__(self, export_path, mmap_mode='r', cache=None):
+        """
+        cache is an optional serving.cache.TopKCache for the exact top-K lists of recommend.
+        """
+        self.export_path = export_path
+        self.mmap_mode = mmap_mode
+        self.cache = cache
+        self.reload()
+
+    def reload(self):
+        """
+        (Re)load the export, e.g. after a new model was exported to the same path; cached lists are dropped.
+        """
+        export_path, mmap_mode = self.export_path, self.mmap_mode
+        with open(os.path.join(export_path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.n_users, self.n_items = self.meta['n_users'], self.meta['n_items']
+        self.model_version = self.meta.get('version', os.path.getmtime(os.path.join(export_path, 'meta.json')))
+        # changes whenever the training interactions excluded from the recommendations change.
+        self.exclusion_version = 0
+
+        self.user_embeddings = np.load(os.path.join(export_path, 'user_embeddings.npy'), mmap_mode=mmap_mode)
+        self.item_embeddings = np.load(os.path.join(export_path, 'item_embeddings.npy'), mmap_mode=mmap_mode)
+        self.train_indptr = np.load(os.path.join(export_path, 'train_indptr.npy'), mmap_mode=mmap_mode)
+        self.train_indices = np.load(os.path.join(export_path, 'train_indices.npy'), mmap_mode=mmap_mode)
+        self.index = None
+        self.quantized = None
+        # how recommend scores, 'exact' or the quantized tables it loaded: part of the version of the cached lists.
+        self.scoring = 'exact'
+        # training degree of every item, counted on the first fold-in.
+        self.item_degrees = None
+        self.update_cache_version()
+
+    def update_cache_version(self):
+        # a new model or scoring mode drops the whole cache.
+        if self.cache is not None:
+            self.cache.set_model_version((self.model_version, self.scoring))
+
+    def load_index(self, path, mmap_mode='r'):
+        """
+        Load an IVF index (serving/ann.py) over the item embeddings, used by recommend with nprobe.
+        """
+        from serving.ann import IVFIndex
+        self.index = IVFIndex.load(path, mmap_mode)
+
+    def load_quantized(self, path, mmap_mode='r'):
+        """
+        Score with the compressed user and item tables written by serving/quantization.py instead of the float ones.
+        """
+        from serving import quantization
+        self.quantized = quantization.load(path, 'user', mmap_mode), quantization.load(path, 'item', mmap_mode)
+        # the scores change with the tables, the cached lists of the float model are stale.
+        self.scoring = 'quantized:%s' % os.path.abspath(path)
+        self.update_cache_version()
+
+    def train_items(self, users):
+        """
+        Row (position in users) and item ids of the training interactions of a batch of users.
+        """
+        starts, ends = self.train_indptr[users], self.train_indptr[users + 1]
+        lengths = ends - starts
+        rows = np.repeat(np.arange(len(users)), lengths)
+        # position of every entry in train_indices: its row start plus its offset within the row.
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return rows, self.train_indices[np.repeat(starts, lengths) + offsets]
+
+    def fold_in(self, item_lists):
+        """
+        Embeddings of users that are not in the export, from the lists of items they interacted with.
+        This is a one-hop approximation: a user gets the sum of the exported final embeddings of its items, weighted
+        by 1/sqrt(|N(u)|)/sqrt(d_i) as in the pre adjacency matrix, with the user counted in the item degrees d_i.
+        The item embeddings are not propagated again over the new edges (nor rescaled for their new degrees), and
+        the layer coefficient of the combination (1/(K+1) for lightgcn) is left out, which scales every score of a
+        user alike and keeps its ranking. The user's own (untrained) ego embedding is left out too.
+        Users without items get a zero embedding.
+        """
+        if self.meta['alg_type'] not in ('lightgcn', 'LightGCN-alpha-1') or self.meta.get('adj_type', 'pre') != 'pre':
+            raise ValueError('fold-in needs a linear LightGCN model propagated over the pre adjacency matrix, not %s over %s'
+                             % (self.meta['alg_type'], self.meta.get('adj_type')))
+        # the layers of lightgcn must be weighted alike, LightGCN-alpha-1 always sums them.
+        if self.meta['alg_type'] == 'lightgcn' and self.meta.get('alpha_k') != 'mean':
+            raise ValueError('fold-in needs the layers combined with --alpha_k mean, the export has alpha_k=%s'
+                             ' (exports without it are older than the setting, export them again)' % self.meta.get('alpha_k'))
+        if self.item_degrees is None:
+            self.item_degrees = np.bincount(self.train_indices, minlength=self.n_items)
+
+        lengths = np.array([len(items) for items in item_lists], dtype=np.int64)
+        items = np.concatenate([np.asarray(items, dtype=np.int64) for items in item_lists] + [np.zeros(0, dtype=np.int64)])
+        weights = (1. / np.sqrt(np.repeat(lengths, lengths)) / np.sqrt(self.item_degrees[items] + 1.)).astype(np.float32)
+
+        embeddings = np.zeros((len(item_lists), self.item_embeddings.shape[1]), dtype=np.float32)
+        weighted = self.item_embeddings[items] * weights[:, None]
+        # the items of every user are contiguous, one reduceat sums all the non-empty lists.
+        nonempty = lengths > 0
+        if nonempty.any():
+            embeddings[nonempty] = np.add.reduceat(weighted, (np.cumsum(lengths) - lengths)[nonempty], axis=0)
+        return embeddings
+
+    def recommend_items(self, item_lists, k=20, exclude_given=True):
+        """
+        Top-k items and scores for a batch of cold users given by their item lists (see fold_in).
+        With exclude_given the listed items are never recommended.
+        """
+        scores = np.matmul(self.fold_in(item_lists), self.item_embeddings.T)
+        if exclude_given:
+            lengths = [len(items) for items in item_lists]
+            rows = np.repeat(np.arange(len(item_lists)), lengths)
+            scores[rows, np.concatenate([np.asarray(items, dtype=np.int64) for items in item_lists] + [np.zeros(0, dtype=np.int64)])] = -np.inf
+        return top_k(scores, k)
+
+    def score(self, users):
+        users = np.asarray(users, dtype=np.int64)
+        if self.quantized is not None:
+            user_table, item_table = self.quantized
+            return item_table.score(user_table.decode(users))
+        return np.matmul(self.user_embeddings[users], self.item_embeddings.T)
+
+    def recommend(self, users, k=20, exclude_train=True, nprobe=None):
+        """
+        Top-k items and scores for a batch of user ids, as two [len(users), k] arrays.
+        With exclude_train the training items of a user are never recommended; a user with fewer than
+        k other items gets the remaining slots filled with -inf scores.
+        With nprobe the items are retrieved approximately from the nprobe nearest lists of the loaded index.
+        """
+        users = np.asarray(users, dtype=np.int64)
+        if nprobe is not None:
+            exclude = None
+            if exclude_train:
+                exclude = [self.train_indices[self.train_indptr[u]:self.train_indptr[u + 1]] for u in users]
+            return self.index.query(self.user_embeddings[users], k, nprobe, exclude)
+        if self.cache is not None:
+            return self.cache.lookup_batch(users, k, lambda missing: self._recommend(missing, k, exclude_train),
+                                           self.exclusion_version if exclude_train else None)
+        return self._recommend(users, k, exclude_train)
+
+    def _recommend(self, users, k, exclude_train):
+        scores = self.score(users)
+        if exclude_train:
+            rows, items = self.train_items(users)
+            scores[rows, items] = -np.inf
+        return top_k(scores, k)
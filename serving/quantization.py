@@ -0,0 +1,138 @@
+'''
+Compressed embedding tables for serving: int8 scalar quantization with one scale per row,
+and product quantization (PQ) with 256 centroids per subspace (one byte per subspace and row).
+
+Both score float queries against the compressed rows without decoding the table (asymmetric scoring):
+int8 rows are multiplied with the query and rescaled, PQ rows sum the inner products of the query
+subvectors with their centroids, looked up from one small table per query.
+Writing compressed tables next to an export:
+    python -m serving.quantization --export_path export/amazon-book/LightGCN/lightgcn --method pq --n_subspaces 16
+'''
+import os
+import json
+import argparse
+import numpy as np
+
+from serving.ann import kmeans
+
+
+class Int8Embeddings(object):
+    name = 'int8'
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def build(cls, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        scales = np.max(np.abs(embeddings), axis=1) / 127.
+        scales[scales == 0] = 1.
+        codes = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    def decode(self, rows):
+        return self.codes[rows].astype(np.float32) * self.scales[rows, None]
+
+    def score(self, queries, block_size=65536):
+        # the codes are upcast block by block, never the whole table at once.
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), block_size):
+            block = slice(start, start + block_size)
+            scores[:, block] = np.matmul(queries, self.codes[block].T.astype(np.float32)) * self.scales[block]
+        return scores
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def arrays(self):
+        return {'codes': self.codes, 'scales': self.scales}
+
+
+class PQEmbeddings(object):
+    name = 'pq'
+
+    def __init__(self, codes, centroids):
+        """
+        codes: [n_rows, n_subspaces] uint8, centroids: [n_subspaces, 256, dim / n_subspaces].
+        """
+        self.codes = codes
+        self.centroids = centroids
+        self.n_subspaces = centroids.shape[0]
+
+    @classmethod
+    def build(cls, embeddings, n_subspaces=8, n_iter=20, seed=0):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        assert embeddings.shape[1] % n_subspaces == 0, 'embedding size must be a multiple of n_subspaces'
+        n_centroids = min(256, len(embeddings))
+        centroids, codes = [], []
+        for sub in np.split(embeddings, n_subspaces, axis=1):
+            sub_centroids = kmeans(sub, n_centroids, n_iter, seed)
+            dist = np.sum(np.square(sub_centroids), axis=1) - 2 * np.matmul(sub, sub_centroids.T)
+            centroids.append(sub_centroids)
+            codes.append(np.argmin(dist, axis=1))
+        return cls(np.stack(codes, axis=1).astype(np.uint8), np.stack(centroids, axis=0).astype(np.float32))
+
+    def decode(self, rows):
+        codes = self.codes[rows]
+        return np.concatenate([self.centroids[m][codes[:, m]] for m in range(self.n_subspaces)], axis=1)
+
+    def score(self, queries):
+        # inner products of every query subvector with the centroids of its subspace: [n_subspaces, B, 256].
+        tables = np.einsum('bmd,mcd->mbc', queries.reshape(len(queries), self.n_subspaces, -1), self.centroids)
+        scores = np.zeros((len(queries), len(self.codes)), dtype=np.float32)
+        for m in range(self.n_subspaces):
+            # np.take gathers whole columns much faster than fancy indexing.
+            scores += np.take(tables[m], self.codes[:, m], axis=1)
+        return scores
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.centroids.nbytes
+
+    def arrays(self):
+        return {'codes': self.codes, 'centroids': self.centroids}
+
+
+QUANTIZERS = {Int8Embeddings.name: Int8Embeddings, PQEmbeddings.name: PQEmbeddings}
+
+
+def save(table, path, prefix):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for name, array in table.arrays().items():
+        np.save(os.path.join(path, '%s_%s.npy' % (prefix, name)), array)
+    with open(os.path.join(path, '%s.json' % prefix), 'w') as f:
+        json.dump({'method': table.name}, f)
+
+
+def load(path, prefix, mmap_mode='r'):
+    with open(os.path.join(path, '%s.json' % prefix)) as f:
+        cls = QUANTIZERS[json.load(f)['method']]
+    names = ['codes', 'scales'] if cls is Int8Embeddings else ['codes', 'centroids']
+    return cls(*[np.load(os.path.join(path, '%s_%s.npy' % (prefix, name)), mmap_mode=mmap_mode) for name in names])
+
+
+def quantize(embeddings, method, n_subspaces=8):
+    if method == 'pq':
+        return PQEmbeddings.build(embeddings, n_subspaces)
+    return Int8Embeddings.build(embeddings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compress the embeddings of an export.")
+    parser.add_argument('--export_path', nargs='?', required=True,
+                        help='Directory of the embedding export.')
+    parser.add_argument('--method', nargs='?', default='int8',
+                        help='Specify the compression from {int8, pq}.')
+    parser.add_argument('--n_subspaces', type=int, default=8,
+                        help='Number of PQ subspaces (bytes per row).')
+    args = parser.parse_args()
+
+    out_path = os.path.join(args.export_path, args.method)
+    for table in ['user', 'item']:
+        embeddings = np.load(os.path.join(args.export_path, '%s_embeddings.npy' % table), mmap_mode='r')
+        compressed = quantize(embeddings, args.method, args.n_subspaces)
+        save(compressed, out_path, table)
+        print('%s embeddings: %d -> %d bytes' % (table, embeddings.nbytes, compressed.nbytes))
@@ -0,0 +1,203 @@
+'''
+Local asyncio HTTP server for top-K recommendation from an embedding export.
+
+Requests for single users are queued and coalesced into micro-batches: a batch is closed when it holds
+max_batch_size users or max_wait_ms after its first request, and is scored with one matrix multiply
+and top-K (InferenceEngine.recommend, training items excluded).
+    python -m serving.server --export_path export/amazon-book/LightGCN/lightgcn --port 8080
+    curl 'localhost:8080/recommend?user=0&k=20'
+    curl 'localhost:8080/stats'
+    curl 'localhost:8080/reload'    # after a new export was written to the same path
+'''
+import json
+import asyncio
+import argparse
+from time import time
+from collections import deque, Counter
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from serving.inference import InferenceEngine
+from serving.cache import TopKCache
+
+
+class ServerStats(object):
+    def __init__(self, window=10000):
+        # latencies of the last window requests, from arrival to response.
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = Counter()
+        self.n_requests = 0
+
+    def add_request(self, latency):
+        self.latencies.append(latency)
+        self.n_requests += 1
+
+    def add_batch(self, batch_size):
+        # power-of-two buckets: 1, 2-3, 4-7, ...
+        self.batch_sizes[1 << (batch_size.bit_length() - 1)] += 1
+
+    def summary(self):
+        latencies = np.array(self.latencies) * 1000
+        n_batches = sum(self.batch_sizes.values())
+        return {'requests': self.n_requests,
+                'batches': n_batches,
+                'mean_batch_size': self.n_requests / float(max(n_batches, 1)),
+                'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+                'batch_size_histogram': {('%d' % b if b == 1 else '%d-%d' % (b, 2 * b - 1)): n
+                                         for b, n in sorted(self.batch_sizes.items())}}
+
+
+class MicroBatcher(object):
+    def __init__(self, engine, max_batch_size=256, max_wait_ms=2.):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.queue = asyncio.Queue()
+        self.stats = ServerStats()
+        # held while a batch is scored, so that the engine is never reloaded in the middle of a batch.
+        self.lock = asyncio.Lock()
+
+    async def recommend(self, user, k):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((user, k, future))
+        return await future
+
+    async def next_batch(self):
+        loop = asyncio.get_running_loop()
+        requests = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(requests) < self.max_batch_size:
+            # requests that are already queued join the batch even after the deadline.
+            if not self.queue.empty():
+                requests.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return requests
+
+    def score(self, requests):
+        # one call per distinct k, so that every user is scored (and cached) for the k it asked for.
+        results = [None] * len(requests)
+        for k in set(k for user, k, future in requests):
+            batch = [i for i, request in enumerate(requests) if request[1] == k]
+            items, scores = self.engine.recommend(np.array([requests[i][0] for i in batch]), k)
+            for j, i in enumerate(batch):
+                results[i] = items[j], scores[j]
+        return results
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = await self.next_batch()
+            try:
+                # scoring runs in a worker thread, the loop keeps queueing the requests of the next batch.
+                async with self.lock:
+                    results = await loop.run_in_executor(None, self.score, requests)
+            except Exception as e:
+                for user, k, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.stats.add_batch(len(requests))
+            for (user, k, future), result in zip(requests, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class RecommendationServer(object):
+    def __init__(self, engine, max_batch_size=256, max_wait_ms=2., default_k=20):
+        self.engine = engine
+        self.batcher = MicroBatcher(engine, max_batch_size, max_wait_ms)
+        self.default_k = default_k
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # headers are read and ignored, every response closes the connection.
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            status, body = await self.route(request_line.decode('latin-1'))
+        except Exception as e:
+            status, body = '500 Internal Server Error', {'error': str(e)}
+        payload = json.dumps(body).encode()
+        writer.write(b'HTTP/1.1 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                     % (status.encode(), len(payload)) + payload)
+        await writer.drain()
+        writer.close()
+
+    async def route(self, request_line):
+        parts = request_line.split()
+        if len(parts) < 2 or parts[0] != 'GET':
+            return '405 Method Not Allowed', {'error': 'only GET is supported'}
+        url = urlsplit(parts[1])
+        params = parse_qs(url.query)
+        if url.path == '/stats':
+            stats = self.batcher.stats.summary()
+            if self.engine.cache is not None:
+                stats['cache'] = self.engine.cache.summary()
+            return '200 OK', stats
+        if url.path == '/reload':
+            async with self.batcher.lock:
+                self.engine.reload()
+            return '200 OK', {'model_version': self.engine.model_version}
+        if url.path != '/recommend':
+            return '404 Not Found', {'error': 'unknown path %s' % url.path}
+        try:
+            user = int(params['user'][0])
+            k = int(params.get('k', [self.default_k])[0])
+        except (KeyError, ValueError):
+            return '400 Bad Request', {'error': 'expected /recommend?user=<id>&k=<int>'}
+        if not 0 <= user < self.engine.n_users or k <= 0:
+            return '400 Bad Request', {'error': 'user must be in [0, %d) and k positive' % self.engine.n_users}
+
+        t0 = time()
+        items, scores = await self.batcher.recommend(user, k)
+        self.batcher.stats.add_request(time() - t0)
+        # users with fewer than k unseen items get only the valid ones.
+        valid = np.isfinite(scores)
+        return '200 OK', {'user': user, 'items': items[valid].tolist(), 'scores': scores[valid].tolist()}
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        batcher = asyncio.ensure_future(self.batcher.run())
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        print('serving on http://%s:%d' % (host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve top-K recommendations from an embedding export.")
+    parser.add_argument('--export_path', nargs='?', required=True,
+                        help='Directory of the embedding export.')
+    parser.add_argument('--host', nargs='?', default='127.0.0.1',
+                        help='Address to listen on.')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='Port to listen on.')
+    parser.add_argument('--max_batch_size', type=int, default=256,
+                        help='Largest number of users scored at once.')
+    parser.add_argument('--max_wait_ms', type=float, default=2.,
+                        help='Longest time a batch waits for more requests after its first one.')
+    parser.add_argument('--k', type=int, default=20,
+                        help='Number of recommended items when a request does not set k.')
+    parser.add_argument('--cache_mb', type=float, default=0,
+                        help='Memory bound of the top-K cache in MB, 0: no cache.')
+    parser.add_argument('--cache_ttl', type=float, default=0,
+                        help='Seconds a cached top-K list stays valid, 0: until the model is reloaded.')
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache_mb > 0:
+        cache = TopKCache(int(args.cache_mb * 2 ** 20), args.cache_ttl if args.cache_ttl > 0 else None)
+    engine = InferenceEngine(args.export_path, cache=cache)
+    server = RecommendationServer(engine, args.max_batch_size, args.max_wait_ms, args.k)
+    asyncio.run(server.serve(args.host, args.port))
@@ -8,27 +8,103 @@ Wang Xiang et al. Neural Graph Collaborative Filtering. In SIGIR 2019.
 from utility.parser import parse_args
 from utility.load_data import *
 from evaluator import eval_score_matrix_foldout
-import multiprocessing
+from serving.ann import IVFIndex
+from serving.cache import TopKCache
+from serving.inference import top_k
+from utility.instrument import timers
+from utility.resources import resources
+from time import time
+import hashlib
 import heapq
 import numpy as np
-cores = multiprocessing.cpu_count() // 2
 
-args = parse_args()
-
-data_generator = Data(path=args.data_path + args.dataset, batch_size=args.batch_size)
-USR_NUM, ITEM_NUM = data_generator.n_users, data_generator.n_items
-N_TRAIN, N_TEST = data_generator.n_train, data_generator.n_test
-
-BATCH_SIZE = args.batch_size
-
-
-def test(sess, model, users_to_test, drop_flag=False, train_set_flag=0):
+# set by setup(): importing the module neither parses sys.argv nor reads a dataset, so that tools that only need
+# the evaluation start without loading the data.
+args = None
+data_generator = None
+USR_NUM, ITEM_NUM = None, None
+N_TRAIN, N_TEST = None, None
+BATCH_SIZE = None
+# top-K lists of the evaluated users, reused by the tests of the same model version (e.g. the sparsity splits
+# and the whole test set of one epoch).
+topk_cache = None
+# (key, IVFIndex) of the last item embeddings indexed by ann_index.
+ann_index_cache = None
+
+
+def setup(arguments=None, data=None):
+    """
+    Sets the options and the dataset the tests run on, parsed from sys.argv and loaded from --data_path and
+    --dataset unless given. Returns (args, data_generator).
+    """
+    global args, data_generator, USR_NUM, ITEM_NUM, N_TRAIN, N_TEST, BATCH_SIZE, topk_cache
+    args = arguments if arguments is not None else parse_args()
+    data_generator = data if data is not None else Data(path=args.data_path + args.dataset, batch_size=args.batch_size)
+    # a given dataset samples the batches of these options.
+    data_generator.batch_size = args.batch_size
+    USR_NUM, ITEM_NUM = data_generator.n_users, data_generator.n_items
+    N_TRAIN, N_TEST = data_generator.n_train, data_generator.n_test
+    BATCH_SIZE = args.batch_size
+    topk_cache = TopKCache(int(args.topk_cache_mb * 2 ** 20)) if args.topk_cache_mb > 0 else None
+    return args, data_generator
+
+
+def topk_ratings(items, scores, test_items):
+    # the evaluator only needs the ranking: the score matrix is reduced to the k columns of the top-k lists,
+    # every test item gets its column, or a distinct negative id that is never ranked when it is not in the list.
+    test_columns = []
+    for row, truth in zip(items, test_items):
+        column = {item: c for c, item in enumerate(row) if item >= 0}
+        test_columns.append([column.get(item, -1 - i) for i, item in enumerate(truth)])
+    return scores, test_columns
+
+
+def ann_index(sess, model):
+    # the IVF index of the current item embeddings, built once for every test() of the same weights (the test,
+    # probe and training users of an epoch, or a sweep over --ann_nprobe).
+    global ann_index_cache
+    item_embeddings = sess.run(model.ia_embeddings, {model.node_dropout: [0.] * len(eval(args.layer_size)),
+                                                     model.mess_dropout: [0.] * len(eval(args.layer_size))})
+    key = (hashlib.sha1(np.ascontiguousarray(item_embeddings).tobytes()).hexdigest(), args.ann_lists)
+    if ann_index_cache is None or ann_index_cache[0] != key:
+        ann_index_cache = (key, IVFIndex.build(item_embeddings, args.ann_lists if args.ann_lists > 0 else None))
+    return ann_index_cache[1]
+
+
+def ann_topk(sess, model, index, user_batch, k, exclude_train):
+    # top-k items retrieved from the IVF index.
+    user_embeddings = sess.run(model.u_g_embeddings, {model.users: user_batch,
+                                                      model.node_dropout: [0.] * len(eval(args.layer_size)),
+                                                      model.mess_dropout: [0.] * len(eval(args.layer_size))})
+    exclude = [data_generator.train_items[user] for user in user_batch] if exclude_train else None
+    return index.query(user_embeddings, k, args.ann_nprobe, exclude)
+
+
+def cached_topk(sess, model, user_batch, k, exclude_train, model_version):
+    def compute(users):
+        rate_batch = sess.run(model.batch_ratings, {model.users: users,
+                                                    model.pos_items: range(ITEM_NUM),
+                                                    model.node_dropout: [0.] * len(eval(args.layer_size)),
+                                                    model.mess_dropout: [0.] * len(eval(args.layer_size))})
+        if exclude_train:
+            for idx, user in enumerate(users):
+                rate_batch[idx][data_generator.train_items[user]] = -np.inf
+        return top_k(rate_batch, k)
+
+    topk_cache.set_model_version(model_version)
+    # the training interactions do not change, the exclusion version only tells excluded and full lists apart.
+    return topk_cache.lookup_batch(user_batch, k, compute, exclusion_version=exclude_train)
+
+
+def test(sess, model, users_to_test, drop_flag=False, train_set_flag=0, model_version=None):
+    # model_version: identifies the current weights, the top-K lists are then cached (--topk_cache_mb).
     # B: batch size
     # N: the number of items
     top_show = np.sort(model.Ks)
     max_top = max(top_show)
     result = {'precision': np.zeros(len(model.Ks)), 'recall': np.zeros(len(model.Ks)), 'ndcg': np.zeros(len(model.Ks))}
 
+    t_test = time()
     u_batch_size = BATCH_SIZE
 
     test_users = users_to_test
@@ -38,40 +114,58 @@ def test(sess, model, users_to_test, drop_flag=False, train_set_flag=0):
     count = 0
     all_result = []
     item_batch = range(ITEM_NUM)
+    if args.ann_nprobe > 0:
+        # approximate validation: only the items retrieved from an IVF index over the item embeddings are ranked.
+        index = ann_index(sess, model)
     for u_batch_id in range(n_user_batchs):
         start = u_batch_id * u_batch_size
         end = (u_batch_id + 1) * u_batch_size
 
         user_batch = test_users[start: end]
-        if drop_flag == False:
-            rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
-                                                        model.pos_items: item_batch})
-        else:
-            rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
-                                                        model.pos_items: item_batch,
-                                                        model.node_dropout: [0.] * len(eval(args.layer_size)),
-                                                        model.mess_dropout: [0.] * len(eval(args.layer_size))})
-        rate_batch = np.array(rate_batch)# (B, N)
+        # top-k lists (items, scores) that replace the full score matrix, training items are already left out.
+        with timers.timer('eval/score'):
+            topk = None
+            if args.ann_nprobe > 0:
+                topk = ann_topk(sess, model, index, user_batch, max_top, train_set_flag == 0)
+            elif topk_cache is not None and model_version is not None:
+                topk = cached_topk(sess, model, user_batch, max_top, train_set_flag == 0, model_version)
+            elif drop_flag == False:
+                rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
+                                                            model.pos_items: item_batch})
+            else:
+                rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
+                                                            model.pos_items: item_batch,
+                                                            model.node_dropout: [0.] * len(eval(args.layer_size)),
+                                                            model.mess_dropout: [0.] * len(eval(args.layer_size))})
         test_items = []
         if train_set_flag == 0:
             for user in user_batch:
                 test_items.append(data_generator.test_set[user])# (B, #test_items)
-                
-            # set the ranking scores of training items to -inf,
-            # then the training items will be sorted at the end of the ranking list.    
-            for idx, user in enumerate(user_batch):
-                    train_items_off = data_generator.train_items[user]
-                    rate_batch[idx][train_items_off] = -np.inf
         else:
             for user in user_batch:
                 test_items.append(data_generator.train_items[user])
-        
-        batch_result = eval_score_matrix_foldout(rate_batch, test_items, max_top)#(B,k*metric_num), max_top= 20
+
+        with timers.timer('eval/mask'):
+            if topk is not None:
+                rate_batch, test_items = topk_ratings(topk[0], topk[1], test_items)
+            else:
+                rate_batch = np.array(rate_batch)# (B, N)
+                if train_set_flag == 0:
+                    # set the ranking scores of training items to -inf,
+                    # then the training items will be sorted at the end of the ranking list.    
+                    for idx, user in enumerate(user_batch):
+                            train_items_off = data_generator.train_items[user]
+                            rate_batch[idx][train_items_off] = -np.inf
+
+        with timers.timer('eval/metrics'):
+            batch_result = eval_score_matrix_foldout(rate_batch, test_items, max_top, resources.eval_threads)#(B,k*metric_num), max_top= 20
         count += len(batch_result)
         all_result.append(batch_result)
         
     
     assert count == n_test_users
+    timers.add('eval/total', time() - t_test)
+    timers.count('eval/users', n_test_users)
     all_result = np.concatenate(all_result, axis=0)
     final_result = np.mean(all_result, axis=0)  # mean
     final_result = np.reshape(final_result, newshape=[5, max_top])
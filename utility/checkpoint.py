@@ -0,0 +1,112 @@
+'''
+Resumable training checkpoints: the values of all the variables (including the optimizer slots) together with
+the training state that tf.train.Saver does not keep (epoch, early stopping counters, loggers and the states
+of the random generators used by the sampler).
+
+The values are fetched from the session between two epochs, the file is written by a background thread so
+that training continues meanwhile. Every file is written to a temporary name, synced and renamed, and the
+'latest' file naming the newest checkpoint is only replaced after that: a crash in the middle of a write
+leaves the previous checkpoint intact.
+'''
+import os
+import pickle
+import random as rd
+import threading
+from queue import Queue
+
+import numpy as np
+import tensorflow as tf
+
+
+def atomic_write(path, write):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def rng_state():
+    return {'random': rd.getstate(), 'numpy': np.random.get_state()}
+
+
+def set_rng_state(state):
+    rd.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+
+
+class CheckpointWriter(object):
+    def __init__(self, checkpoint_dir, max_to_keep=2):
+        self.checkpoint_dir = checkpoint_dir
+        self.max_to_keep = max_to_keep
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        # one checkpoint waits while the previous one is written, a third blocks the training loop.
+        self.queue = Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, sess, epoch, state):
+        """
+        Snapshot the variables and the training state after epoch; the write happens in the background.
+        """
+        if self.error is not None:
+            raise self.error
+        variables = tf.global_variables()
+        values = sess.run(variables)
+        checkpoint = {'epoch': epoch, 'state': state, 'rng': rng_state(),
+                      'variables': {v.op.name: value for v, value in zip(variables, values)}}
+        self.queue.put(checkpoint)
+
+    def _run(self):
+        while True:
+            checkpoint = self.queue.get()
+            if checkpoint is None:
+                break
+            try:
+                self._write(checkpoint)
+            except Exception as e:
+                self.error = e
+
+    def _write(self, checkpoint):
+        name = 'checkpoint-%d.pkl' % checkpoint['epoch']
+        atomic_write(os.path.join(self.checkpoint_dir, name),
+                     lambda f: pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL))
+        atomic_write(os.path.join(self.checkpoint_dir, 'latest'), lambda f: f.write(name.encode()))
+
+        stored = sorted((int(f[len('checkpoint-'):-len('.pkl')]), f) for f in os.listdir(self.checkpoint_dir)
+                        if f.startswith('checkpoint-') and f.endswith('.pkl'))
+        for _, f in stored[:-self.max_to_keep]:
+            os.remove(os.path.join(self.checkpoint_dir, f))
+
+    def close(self):
+        """
+        Wait until the queued checkpoints are written.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def latest_checkpoint(checkpoint_dir):
+    path = os.path.join(checkpoint_dir, 'latest')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return os.path.join(checkpoint_dir, f.read().strip())
+
+
+def restore(sess, path):
+    """
+    Load the variables of a checkpoint into the session and restore the random generators;
+    returns the epoch and the training state it was saved with.
+    """
+    with open(path, 'rb') as f:
+        checkpoint = pickle.load(f)
+    for v in tf.global_variables():
+        v.load(checkpoint['variables'][v.op.name], sess)
+    set_rng_state(checkpoint['rng'])
+    return checkpoint['epoch'], checkpoint['state']
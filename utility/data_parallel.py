@@ -0,0 +1,187 @@
+'''
+Data-parallel training on one CPU host (--n_workers N).
+
+N forked worker processes each sample a batch of --batch_size every step and compute the gradient of the embedding
+tables in numpy, over the memory-mapped pre adjacency of utility/out_of_core.py that they share read-only. A
+worker only propagates the n_layers-hop subgraph of its batch (utility/subgraph.py), which gives the exact loss and
+gradient. The main process is the parameter server: it writes the tables to a shared memory-mapped file, averages
+the gradients the workers write back and applies them with Adam in the tensorflow session. A step is one update
+with the gradient of N batches, like one batch N times as large. An epoch keeps the number of updates of a single
+process, so it trains N times as many samples at the cost of one worker's step per update. Evaluation, checkpoints
+and logging are unchanged. A worker that fails sends its error back, and the step raises it instead of waiting for
+the worker's result.
+
+Only lightgcn and LightGCN-alpha-1 without node dropout are supported: their propagation is linear,
+E = c * sum_k A^k E_0, so the gradient of E_0 propagates the gradient of E through the same symmetric A.
+'''
+import os
+import queue
+import random as rd
+import shutil
+import tempfile
+import traceback
+import multiprocessing
+
+import numpy as np
+import tensorflow as tf
+
+from utility.out_of_core import MmapCSR
+from utility.resources import resources
+from utility.subgraph import khop_subgraph
+
+
+def propagate(adj, embeddings, n_layers, coefficient):
+    # coefficient * sum_k A^k E, for k = 0..n_layers.
+    layer = embeddings
+    result = embeddings.copy()
+    for _ in range(n_layers):
+        layer = adj.dot(layer)
+        result += layer
+    return result * coefficient
+
+
+def bpr_gradient(adj, embeddings, n_users, users, pos_items, neg_items, n_layers, coefficient, decay, batch_size):
+    """
+    The mf and emb losses of LightGCN.create_bpr_loss for one batch and their gradient w.r.t. the stacked tables.
+    """
+    users = np.asarray(users)
+    pos_nodes = n_users + np.asarray(pos_items)
+    neg_nodes = n_users + np.asarray(neg_items)
+    final = propagate(adj, embeddings, n_layers, coefficient)
+    u, p, n = final[users], final[pos_nodes], final[neg_nodes]
+    x = np.sum(u * (p - n), axis=1)
+    mf_loss = np.mean(np.logaddexp(0., -x))
+    regularizer = (np.sum(embeddings[users] ** 2) + np.sum(embeddings[pos_nodes] ** 2) + np.sum(embeddings[neg_nodes] ** 2)) / 2.
+    emb_loss = decay * regularizer / batch_size
+
+    # d softplus(-x) / dx = -sigmoid(-x), averaged over the batch.
+    g = (-1. / (1. + np.exp(x)) / len(x))[:, None].astype(np.float32)
+    final_gradient = np.zeros_like(embeddings)
+    np.add.at(final_gradient, users, g * (p - n))
+    np.add.at(final_gradient, pos_nodes, g * u)
+    np.add.at(final_gradient, neg_nodes, -g * u)
+    gradient = propagate(adj, final_gradient, n_layers, coefficient)
+    for nodes in [users, pos_nodes, neg_nodes]:
+        np.add.at(gradient, nodes, decay / batch_size * embeddings[nodes])
+    return mf_loss, emb_loss, gradient
+
+
+def subgraph_gradient(adj, embeddings, n_users, users, pos_items, neg_items, n_layers, coefficient, decay, batch_size):
+    """
+    bpr_gradient over the n_layers-hop subgraph of the batch: the nodes with a gradient and their rows of it.
+    embeddings only needs to support indexing by node, e.g. the shared memory-mapped tables.
+    """
+    batch_nodes = [np.asarray(users), n_users + np.asarray(pos_items), n_users + np.asarray(neg_items)]
+    nodes, sub_adj = khop_subgraph(adj, np.concatenate(batch_nodes), n_layers)
+    # the subgraph numbers its nodes from 0, users and items alike.
+    users, pos_items, neg_items = [np.searchsorted(nodes, ids) for ids in batch_nodes]
+    mf_loss, emb_loss, gradient = bpr_gradient(sub_adj.tocsr(), embeddings[nodes], 0, users, pos_items, neg_items,
+                                               n_layers, coefficient, decay, batch_size)
+    return mf_loss, emb_loss, nodes, gradient
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+def collect(results, workers, poll_seconds=1.):
+    """
+    One result of every worker. Raises the error a worker sent back, or a WorkerError when a worker exited.
+    """
+    collected = []
+    while len(collected) < len(workers):
+        try:
+            result = results.get(timeout=poll_seconds)
+        except queue.Empty:
+            exited = [rank for rank, process in enumerate(workers) if not process.is_alive()]
+            if len(exited) > 0:
+                raise WorkerError('worker %d exited with code %s' % (exited[0], workers[exited[0]].exitcode))
+            continue
+        if isinstance(result, WorkerError):
+            raise result
+        collected.append(result)
+    return sorted(collected, key=lambda result: result[0])
+
+
+def worker(rank, adj_path, memory_mb, work_dir, shape, sampler, n_users, n_layers, coefficient, decay, seed, n_threads,
+           tasks, results):
+    try:
+        resources.pin_worker(rank)
+        resources.limit_threads(n_threads)
+        adj = MmapCSR(adj_path, memory_mb)
+        params = np.memmap(os.path.join(work_dir, 'params'), dtype=np.float32, mode='r', shape=shape)
+        gradient = np.memmap(os.path.join(work_dir, 'gradient_%d' % rank), dtype=np.float32, mode='r+', shape=shape)
+        # every worker samples other batches.
+        rd.seed(seed + rank)
+        np.random.seed(seed + rank)
+        while tasks.get() is not None:
+            users, pos_items, neg_items = sampler.sample()
+            mf_loss, emb_loss, nodes, gradient[nodes] = subgraph_gradient(adj, params, n_users, users, pos_items,
+                                                                          neg_items, n_layers, coefficient, decay,
+                                                                          sampler.batch_size)
+            results.put((rank, mf_loss, emb_loss, nodes))
+    except Exception:
+        results.put(WorkerError('worker %d failed:\n%s' % (rank, traceback.format_exc())))
+
+
+class DataParallelTrainer(object):
+    def __init__(self, model, adj_path, memory_mb, sampler, n_workers, lr, seed=0):
+        """
+        Builds the apply op of the averaged gradients (before the variables are initialized) and forks the workers.
+        """
+        if model.alg_type not in ['lightgcn', 'LightGCN-alpha-1'] or model.alpha_k == 'leveled':
+            raise ValueError('data-parallel training needs --alg_type lightgcn or LightGCN-alpha-1 with --alpha_k mean')
+        if model.node_dropout_flag or model.emb_dtype != tf.float32:
+            raise ValueError('data-parallel training does not support node dropout and reduced-precision tables')
+        self.tables = [model.embedding_tables['user_embedding'], model.embedding_tables['item_embedding']]
+        self.n_users = model.n_users
+        shape = (model.n_users + model.n_items, model.emb_dim)
+        self.gradient_inputs = [tf.placeholder(tf.float32, table.shape) for table in self.tables]
+        self.apply = tf.train.AdamOptimizer(learning_rate=lr).apply_gradients(zip(self.gradient_inputs, self.tables))
+
+        # /dev/shm keeps the shared tables and gradients in memory.
+        self.work_dir = tempfile.mkdtemp(prefix='lightgcn-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        self.params = np.memmap(os.path.join(self.work_dir, 'params'), dtype=np.float32, mode='w+', shape=shape)
+        self.gradients = [np.memmap(os.path.join(self.work_dir, 'gradient_%d' % rank), dtype=np.float32, mode='w+',
+                                    shape=shape) for rank in range(n_workers)]
+        coefficient = 1. / (model.n_layers + 1) if model.alg_type == 'lightgcn' else 1.
+        context = multiprocessing.get_context('fork')
+        self.results = context.Queue()
+        self.tasks = [context.Queue() for _ in range(n_workers)]
+        n_threads = resources.worker_threads(n_workers)
+        self.workers = [context.Process(target=worker, args=(rank, adj_path, memory_mb, self.work_dir, shape, sampler,
+                                                             model.n_users, model.n_layers, coefficient, model.decay,
+                                                             seed, n_threads, self.tasks[rank], self.results),
+                                        daemon=True)
+                        for rank in range(n_workers)]
+        for process in self.workers:
+            process.start()
+
+    def step(self, sess):
+        """
+        One update with a batch per worker, returns the mean losses of the batches.
+        """
+        self.params[:] = np.concatenate(sess.run(self.tables), axis=0)
+        for tasks in self.tasks:
+            tasks.put(True)
+        losses = collect(self.results, self.workers)
+        # only the rows of a worker's subgraph have a gradient.
+        gradient = np.zeros(self.params.shape, dtype=np.float32)
+        for buffer, (_, _, _, nodes) in zip(self.gradients, losses):
+            gradient[nodes] += buffer[nodes] / len(self.workers)
+        sess.run(self.apply, feed_dict={self.gradient_inputs[0]: gradient[:self.n_users],
+                                        self.gradient_inputs[1]: gradient[self.n_users:]})
+        mf_loss = np.mean([loss[1] for loss in losses])
+        emb_loss = np.mean([loss[2] for loss in losses])
+        return mf_loss + emb_loss, mf_loss, emb_loss
+
+    def sync(self, sess):
+        # the session holds the tables, nothing to copy.
+        pass
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.workers:
+            process.join()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
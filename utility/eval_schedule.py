@@ -0,0 +1,79 @@
+'''
+Decides in which epochs the training loop of LightGCN.py runs a full evaluation.
+
+fixed: every `every` epochs, as the original every-20-epoch evaluation.
+adaptive: the interval doubles (up to max_every) while the full evaluations improve the best recall by more
+than `tolerance`, and halves (down to min_every) when they stop improving. Cheap probes (recall on a fixed
+subset of the test users) run every probe_every epochs in between; a probe that drops below the best probe
+asks for a full evaluation at once.
+
+With a time budget the epoch that would end past the budget is fully evaluated and is the last one.
+'''
+from time import time
+
+import numpy as np
+
+
+class EvalScheduler(object):
+    def __init__(self, every=20, adaptive=False, min_every=5, max_every=80, tolerance=0.01, probe_every=0,
+                 time_budget=0):
+        self.adaptive = adaptive
+        self.every = every
+        self.min_every = min(min_every, every)
+        self.max_every = max(max_every, every)
+        self.tolerance = tolerance
+        self.probe_every = probe_every
+        # seconds, 0: no limit.
+        self.time_budget = time_budget
+        self.start = time()
+
+        self.interval = every
+        self.last_evaluation = 0
+        self.best = 0.
+        self.best_probe = 0.
+        self.probe_dropped = False
+        self.train_times = []
+        self.evaluation_time = 0.
+
+    def add_epoch(self, train_time):
+        self.train_times.append(train_time)
+
+    def out_of_time(self):
+        if self.time_budget <= 0 or len(self.train_times) == 0:
+            return False
+        # the next epoch (and its evaluation) would not end within the budget.
+        expected = np.mean(self.train_times) + self.evaluation_time
+        return time() - self.start + expected > self.time_budget
+
+    def evaluation_due(self, epoch):
+        if self.out_of_time():
+            return True
+        if not self.adaptive:
+            return epoch % self.every == 0
+        return self.probe_dropped or epoch - self.last_evaluation >= self.interval
+
+    def probe_due(self, epoch):
+        return self.probe_every > 0 and epoch % self.probe_every == 0 and not self.evaluation_due(epoch)
+
+    def add_probe(self, value):
+        if self.adaptive and value < self.best_probe * (1. - self.tolerance):
+            self.probe_dropped = True
+        self.best_probe = max(self.best_probe, value)
+
+    def add_evaluation(self, epoch, value, evaluation_time):
+        if self.adaptive:
+            if value > self.best * (1. + self.tolerance):
+                self.interval = min(self.interval * 2, self.max_every)
+            else:
+                self.interval = max(self.interval // 2, self.min_every)
+        self.best = max(self.best, value)
+        self.last_evaluation = epoch
+        self.probe_dropped = False
+        self.evaluation_time = evaluation_time
+
+    def get_state(self):
+        # what a resumed run needs to continue with the same interval; the budget counts per run.
+        return {name: getattr(self, name) for name in ['interval', 'last_evaluation', 'best', 'best_probe', 'probe_dropped']}
+
+    def set_state(self, state):
+        self.__dict__.update(state)
@@ -0,0 +1,80 @@
+'''
+Incremental update of the cached adjacency matrices when interactions are appended to train.txt.
+
+The node ids of the matrices are the stacked blocks (users, items); new users and items grow the blocks,
+new interactions add edges. Only the entries in a row or column of a node whose degree changed are
+renormalized, all other values are copied from the cached matrix.
+'''
+import numpy as np
+import scipy.sparse as sp
+
+
+def remap_nodes(mat, old_sizes, new_sizes):
+    """
+    The square matrix over stacked node blocks of old_sizes, with its node ids moved to blocks of new_sizes.
+    """
+    mat = mat.tocsr()
+    if list(old_sizes) != list(new_sizes):
+        old_offsets = np.concatenate([[0], np.cumsum(old_sizes)])
+        new_offsets = np.concatenate([[0], np.cumsum(new_sizes)])
+        shift = np.repeat(new_offsets[:-1] - old_offsets[:-1], old_sizes)
+        coo = mat.tocoo()
+        mat = sp.csr_matrix((coo.data, (coo.row + shift[coo.row], coo.col + shift[coo.col])),
+                            shape=(new_offsets[-1], new_offsets[-1]))
+    mat.sort_indices()
+    return mat
+
+
+def add_edges(adj, rows, cols):
+    """
+    Add the undirected edges (rows[i], cols[i]) to adj; also returns the mask of the nodes whose degree changed.
+    """
+    edges = sp.csr_matrix((np.ones(2 * len(rows), dtype=adj.dtype),
+                           (np.concatenate([rows, cols]), np.concatenate([cols, rows]))), shape=adj.shape)
+    adj = (adj + edges).tocsr()
+    adj.sort_indices()
+    changed = np.zeros(adj.shape[0], dtype=bool)
+    changed[rows] = True
+    changed[cols] = True
+    return adj, changed
+
+
+def inverse_power(degrees, power):
+    # d^-power, 0 for isolated nodes as in get_adj_mat.
+    with np.errstate(divide='ignore'):
+        d_inv = np.power(degrees, -power)
+    d_inv[np.isinf(d_inv)] = 0.
+    return d_inv
+
+
+def renormalize(old_norm, mat, changed, left, right):
+    """
+    Normalized matrix with the values left[r] * mat[r, c] * right[c].
+    Only the entries in a changed row or column are computed, the others are copied from old_norm,
+    which must have the structure of mat in every unchanged row (both in sorted CSR).
+    """
+    old_norm = old_norm.tocsr()
+    old_norm.sort_indices()
+    rows = np.repeat(np.arange(mat.shape[0]), np.diff(mat.indptr))
+    cols = mat.indices
+    data = np.empty(len(cols), dtype=np.float32)
+
+    kept = ~changed[rows]
+    # an unchanged row has the same entries in both matrices, at the same offsets from the row start.
+    old_positions = old_norm.indptr[rows[kept]] + (np.flatnonzero(kept) - mat.indptr[rows[kept]])
+    data[kept] = old_norm.data[old_positions]
+
+    update = changed[rows] | changed[cols]
+    data[update] = left[rows[update]] * mat.data[update] * right[cols[update]]
+    return sp.csr_matrix((data, cols.copy(), mat.indptr.copy()), shape=mat.shape)
+
+
+def infer_sizes(adj):
+    """
+    (n_users, n_items) of a cached user-item adjacency matrix: users only link to the items after them,
+    so the last node with a neighbour after itself is the last user.
+    """
+    adj = adj.tocsr()
+    rows = np.repeat(np.arange(adj.shape[0]), np.diff(adj.indptr))
+    n_users = int(rows[adj.indices > rows].max()) + 1
+    return n_users, adj.shape[0] - n_users
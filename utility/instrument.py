@@ -0,0 +1,80 @@
+'''
+Named timers and counters for the training loop and the evaluation (--instrument 1).
+
+Disabled timers return a shared no-op context and add/count return at once, so the calls can stay in the
+hot paths. collect() returns the totals since the previous call, together with the derived throughputs.
+'''
+import resource
+import sys
+from time import time
+from collections import defaultdict
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+
+    def __enter__(self):
+        self.start = time()
+        return self
+
+    def __exit__(self, *exc):
+        self.timers.add(self.name, time() - self.start)
+        return False
+
+
+class Timers(object):
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def timer(self, name):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def add(self, name, seconds):
+        if self.enabled:
+            self.seconds[name] += seconds
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] += n
+
+    def collect(self):
+        """
+        Seconds per timer, counts and derived rates since the last collect, as one flat dict.
+        """
+        stats = {'%s_s' % name: seconds for name, seconds in self.seconds.items()}
+        stats.update(self.counts)
+        if self.seconds['train/epoch'] > 0:
+            stats['train/samples_per_s'] = self.counts['train/samples'] / self.seconds['train/epoch']
+        if self.seconds['eval/total'] > 0:
+            stats['eval/users_per_s'] = self.counts['eval/users'] / self.seconds['eval/total']
+        stats['peak_rss_mb'] = peak_rss_mb()
+        self.seconds.clear()
+        self.counts.clear()
+        return stats
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS.
+    return rss / 2. ** 20 if sys.platform == 'darwin' else rss / 2. ** 10
+
+
+# shared by LightGCN.py and utility/batch_test.py, enabled by --instrument 1.
+timers = Timers()
@@ -8,7 +8,32 @@ Wang Xiang et al. Neural Graph Collaborative Filtering. In SIGIR 2019.
 import numpy as np
 import random as rd
 import scipy.sparse as sp
+import os
 from time import time
+from utility import incremental
+
+def normalized_adj_single(adj):
+    # D^-1 A: every row is averaged over the neighbours.
+    rowsum = np.array(adj.sum(1))
+    d_inv = np.power(rowsum, -1).flatten()
+    d_inv[np.isinf(d_inv)] = 0.
+    d_mat_inv = sp.diags(d_inv)
+
+    norm_adj = d_mat_inv.dot(adj)
+    print('generate single-normalized adjacency matrix.')
+    return norm_adj.tocoo()
+
+def normalized_adj_symmetric(adj):
+    # D^-1/2 A D^-1/2, the pre adjacency matrix of LightGCN.
+    rowsum = np.array(adj.sum(1))
+    d_inv = np.power(rowsum, -0.5).flatten()
+    
+    d_inv[np.isinf(d_inv)] = 0.
+    d_mat_inv = sp.diags(d_inv)
+    norm_adj = d_mat_inv.dot(adj)
+    norm_adj = norm_adj.dot(d_mat_inv)
+    print('generate pre adjacency matrix.')
+    return norm_adj
 
 class business_model:
     def __init__(self, id, categories, price):
@@ -85,8 +110,6 @@ class Data(object):
         self.n_items += 1
         self.n_users += 1
         self.print_statistics()
-		#matrix size num_users X num_items
-        self.R = sp.dok_matrix((self.n_users, self.n_items), dtype=np.float32)
         self.train_items, self.test_set = {}, {}
         with open(train_file) as f_train:
             with open(test_file) as f_test:
@@ -95,10 +118,6 @@ class Data(object):
                     l = l.strip('\n')
                     items = [int(i) for i in l.split(' ')]
                     uid, train_items = items[0], items[1:]
-
-                    for i in train_items:
-                        self.R[uid, i] = 1.
-                        
                     self.train_items[uid] = train_items
                     
                 for l in f_test.readlines():
@@ -111,46 +130,123 @@ class Data(object):
                     
                     uid, test_items = items[0], items[1:]
                     self.test_set[uid] = test_items
+
+        #matrix size num_users X num_items, built at once: a dok matrix filled per entry takes ~100 bytes per interaction.
+        rows = np.repeat(list(self.train_items.keys()), [len(items) for items in self.train_items.values()])
+        cols = np.concatenate([items for items in self.train_items.values()])
+        self.R = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(self.n_users, self.n_items))
+        self.R.data[:] = 1.
     
     def get_adj_mat(self):
+        # nodes whose degree changed when the cached matrices were updated with new interactions.
+        self.changed_nodes = None
         try:
             t1 = time()
             adj_mat = sp.load_npz(self.path + '/s_adj_mat.npz')
             norm_adj_mat = sp.load_npz(self.path + '/s_norm_adj_mat.npz')
             mean_adj_mat = sp.load_npz(self.path + '/s_mean_adj_mat.npz')
-            adj_mat_with_cp = sp.load_npz(self.path + '/s_adj_mat_with_cp.npz')
+            # without item_list.txt there is no matrix with categories and price to load.
+            adj_mat_with_cp = None
+            if self.item_file_missing == False:
+                adj_mat_with_cp = sp.load_npz(self.path + '/s_adj_mat_with_cp.npz')
             print('already load adj matrix', adj_mat.shape, time() - t1)
         
         except Exception:
-            adj_mat, norm_adj_mat, mean_adj_mat, adj_mat_with_cp = self.create_adj_mat()
-            sp.save_npz(self.path + '/s_adj_mat.npz', adj_mat)
-            sp.save_npz(self.path + '/s_norm_adj_mat.npz', norm_adj_mat)
-            sp.save_npz(self.path + '/s_mean_adj_mat.npz', mean_adj_mat)
-            if self.item_file_missing == False:
-                sp.save_npz(self.path + '/s_adj_mat_with_cp.npz', adj_mat_with_cp)
+            adj_mat, norm_adj_mat, mean_adj_mat, adj_mat_with_cp = self.save_adj_mat()
 
         try:
             pre_adj_mat = sp.load_npz(self.path + '/s_pre_adj_mat.npz')
         except Exception:
-            adj_mat=adj_mat
-            rowsum = np.array(adj_mat.sum(1))
-            d_inv = np.power(rowsum, -0.5).flatten()
-            
-            d_inv[np.isinf(d_inv)] = 0.
-            d_mat_inv = sp.diags(d_inv)
-            norm_adj = d_mat_inv.dot(adj_mat)
-            norm_adj = norm_adj.dot(d_mat_inv)
-            print('generate pre adjacency matrix.')
+            norm_adj = normalized_adj_symmetric(adj_mat)
             pre_adj_mat = norm_adj.tocsr()
             sp.save_npz(self.path + '/s_pre_adj_mat.npz', norm_adj)
 
-        try:
+        rebuilt = False
+        if adj_mat.shape[0] != self.n_users + self.n_items or adj_mat.nnz != 2 * self.R.nnz:
+            try:
+                # interactions were appended to train.txt after the matrices were cached.
+                adj_mat, norm_adj_mat, mean_adj_mat, pre_adj_mat, adj_mat_with_cp = \
+                    self.update_adj_mat(adj_mat, norm_adj_mat, mean_adj_mat, pre_adj_mat)
+            except ValueError as e:
+                # interactions, users or items were removed: the matrices are rebuilt as without a cache.
+                print('rebuilding the adjacency matrices: %s' % e)
+                adj_mat, norm_adj_mat, mean_adj_mat, adj_mat_with_cp = self.save_adj_mat()
+                pre_adj_mat = normalized_adj_symmetric(adj_mat).tocsr()
+                sp.save_npz(self.path + '/s_pre_adj_mat.npz', pre_adj_mat)
+                rebuilt = True
+
+        if self.changed_nodes is None and not rebuilt and os.path.exists(self.path + '/s_node_dim.npy'):
             node_dim = np.load(self.path + '/s_node_dim.npy')
-        except:
+        else:
             node_dim = self.get_node_dimensionality(adj_mat)
             np.save(self.path + '/s_node_dim', node_dim)
         return adj_mat, norm_adj_mat, mean_adj_mat, pre_adj_mat, adj_mat_with_cp, node_dim
 
+    def save_adj_mat(self):
+        # builds the matrices from train.txt and caches them.
+        adj_mat, norm_adj_mat, mean_adj_mat, adj_mat_with_cp = self.create_adj_mat()
+        sp.save_npz(self.path + '/s_adj_mat.npz', adj_mat)
+        sp.save_npz(self.path + '/s_norm_adj_mat.npz', norm_adj_mat)
+        sp.save_npz(self.path + '/s_mean_adj_mat.npz', mean_adj_mat)
+        if self.item_file_missing == False:
+            sp.save_npz(self.path + '/s_adj_mat_with_cp.npz', adj_mat_with_cp)
+        np.save(self.path + '/s_adj_sizes.npy', [self.n_users, self.n_items])
+        return adj_mat, norm_adj_mat, mean_adj_mat, adj_mat_with_cp
+
+    def update_adj_mat(self, adj_mat, norm_adj_mat, mean_adj_mat, pre_adj_mat):
+        """
+        Add the interactions of train.txt that are missing from the cached matrices, instead of rebuilding them.
+        Only the rows and columns of the nodes with new interactions are renormalized, see utility/incremental.py.
+        Raises ValueError when interactions, users or items were removed, which needs a rebuild.
+        """
+        t1 = time()
+        try:
+            old_sizes = [int(n) for n in np.load(self.path + '/s_adj_sizes.npy')]
+        except Exception:
+            old_sizes = incremental.infer_sizes(adj_mat)
+        new_sizes = [self.n_users, self.n_items]
+        if any(new < old for new, old in zip(new_sizes, old_sizes)):
+            raise ValueError('users or items were removed from train.txt')
+        adj_mat, norm_adj_mat, mean_adj_mat, pre_adj_mat = [incremental.remap_nodes(m, old_sizes, new_sizes)
+                                                            for m in [adj_mat, norm_adj_mat, mean_adj_mat, pre_adj_mat]]
+
+        new_R = self.R.tocsr() - adj_mat[:self.n_users, self.n_users:]
+        new_R.eliminate_zeros()
+        if not (new_R.data > 0).all():
+            raise ValueError('interactions were removed from train.txt')
+        users, items = new_R.nonzero()
+        adj_mat, changed = incremental.add_edges(adj_mat, users, self.n_users + items)
+
+        degrees = np.asarray(adj_mat.sum(1)).flatten()
+        ones = np.ones(adj_mat.shape[0], dtype=np.float32)
+        pre_adj_mat = incremental.renormalize(pre_adj_mat, adj_mat, changed,
+                                              incremental.inverse_power(degrees, 0.5), incremental.inverse_power(degrees, 0.5))
+        mean_adj_mat = incremental.renormalize(mean_adj_mat, adj_mat, changed, incremental.inverse_power(degrees, 1), ones)
+        norm_adj_mat = incremental.renormalize(norm_adj_mat, (adj_mat + sp.eye(adj_mat.shape[0])).tocsr(), changed,
+                                               incremental.inverse_power(degrees + 1, 1), ones)
+        print('add %d interactions to the adjacency matrix' % len(users), adj_mat.shape, time() - t1)
+
+        adj_mat_with_cp = None
+        if self.item_file_missing == False:
+            # categories and prices of new items are only known from item_list.txt, this matrix is rebuilt.
+            adj_mat_with_cp = self.create_adj_mat_with_cp(adj_mat).tocsr()
+            sp.save_npz(self.path + '/s_adj_mat_with_cp.npz', adj_mat_with_cp)
+        sp.save_npz(self.path + '/s_adj_mat.npz', adj_mat)
+        sp.save_npz(self.path + '/s_norm_adj_mat.npz', norm_adj_mat)
+        sp.save_npz(self.path + '/s_mean_adj_mat.npz', mean_adj_mat)
+        sp.save_npz(self.path + '/s_pre_adj_mat.npz', pre_adj_mat)
+        np.save(self.path + '/s_adj_sizes.npy', new_sizes)
+
+        self.changed_nodes = np.flatnonzero(changed)
+        return adj_mat, norm_adj_mat, mean_adj_mat, pre_adj_mat, adj_mat_with_cp
+
+    def restrict_training(self, users):
+        """
+        Only sample training batches of the given users; n_train then counts their interactions.
+        """
+        self.exist_users = [u for u in users if u in self.train_items]
+        self.n_train = sum(len(self.train_items[u]) for u in self.exist_users)
+
     def get_node_dimensionality(self, adj_mat):
         node_dim = np.squeeze(np.asarray(adj_mat.sum(1)))
         print(node_dim[0])
@@ -172,55 +268,6 @@ class Data(object):
         print('already create adjacency matrix', adj_mat.shape, time() - t1)
         
         t2 = time()
-        def adj_with_cat_and_price(adj): # Creates a U+I+C+P x U+I+C+P size matrix
-            size_of_ui_matrix = self.n_users + self.n_items
-            size_of_uic_matrix = self.n_users + self.n_items + self.n_cat
-            size_of_uicp_matrix = self.n_users + self.n_items + self.n_price + self.n_cat
-            adj_mat_with_cat_and_price = sp.dok_matrix((size_of_uicp_matrix, size_of_uicp_matrix), dtype=np.float32)
-            adj_mat_with_cat_and_price = adj_mat_with_cat_and_price.tolil()
-            print(adj_mat_with_cat_and_price._shape)
-
-            for i in range (5):
-                adj_mat_with_cat_and_price[int(self.n_users*i/5.0):int(self.n_users*(i+1)/5.0), self.n_users:size_of_ui_matrix] =\
-                adj[int(self.n_users*i/5.0):int(self.n_users*(i+1)/5.0), self.n_users:]
-                adj_mat_with_cat_and_price[self.n_users:size_of_ui_matrix,int(self.n_users*i/5.0):int(self.n_users*(i+1)/5.0)] =\
-                adj[int(self.n_users*i/5.0):int(self.n_users*(i+1)/5.0), self.n_users:].T
-                print("iteration: ", i)
-            print(adj_mat_with_cat_and_price._shape)
-
-            adj_connection_value = 1
-            for row in range(0, self.n_items):      # Iterates through the category list of each item to find connections
-                categories = self.business_list[row].categories
-                
-                for cat in categories:  # works for single and multiple categories pr item
-                    index = 0
-                    for all_cat in self.cat_list:
-                        if(cat == all_cat):
-                            adj_mat_with_cat_and_price[self.n_users + row, size_of_ui_matrix + index] = adj_connection_value # displace by n_users so that we give the correct item the category 
-                            adj_mat_with_cat_and_price[size_of_ui_matrix + index, self.n_users + row] = adj_connection_value # Insures symmetry in adj matrix
-                        index += 1
-                price = self.business_list[row].price
-                index = 0
-                for p in self.price_list:
-                    if p == price:
-                        adj_mat_with_cat_and_price[self.n_users + row, size_of_uic_matrix + index] = adj_connection_value
-                        adj_mat_with_cat_and_price[size_of_uic_matrix + index, self.n_users + row] = adj_connection_value
-
-                        break
-                    index += 1   
-            return adj_mat_with_cat_and_price
-
-
-        def normalized_adj_single(adj):
-            rowsum = np.array(adj.sum(1))
-            d_inv = np.power(rowsum, -1).flatten()
-            d_inv[np.isinf(d_inv)] = 0.
-            d_mat_inv = sp.diags(d_inv)
-
-            norm_adj = d_mat_inv.dot(adj)
-            print('generate single-normalized adjacency matrix.')
-            return norm_adj.tocoo()
-
         def check_adj_if_equal(adj):
             dense_A = np.array(adj.todense())
             degree = np.sum(dense_A, axis=1, keepdims=False)
@@ -232,13 +279,51 @@ class Data(object):
         norm_adj_mat = normalized_adj_single(adj_mat + sp.eye(adj_mat.shape[0]))
         mean_adj_mat = normalized_adj_single(adj_mat)
         if self.item_file_missing == False:
-            adj_with_cp = adj_with_cat_and_price(adj_mat) 
+            adj_with_cp = self.create_adj_mat_with_cp(adj_mat) 
             awc = adj_with_cp.tocsr()
         else:
             awc = None
         print('already normalize adjacency matrix', time() - t2)
         return adj_mat.tocsr(), norm_adj_mat.tocsr(), mean_adj_mat.tocsr(), awc
         
+    def create_adj_mat_with_cp(self, adj): # Creates a U+I+C+P x U+I+C+P size matrix
+        size_of_ui_matrix = self.n_users + self.n_items
+        size_of_uic_matrix = self.n_users + self.n_items + self.n_cat
+        size_of_uicp_matrix = self.n_users + self.n_items + self.n_price + self.n_cat
+        adj_mat_with_cat_and_price = sp.dok_matrix((size_of_uicp_matrix, size_of_uicp_matrix), dtype=np.float32)
+        adj_mat_with_cat_and_price = adj_mat_with_cat_and_price.tolil()
+        print(adj_mat_with_cat_and_price._shape)
+
+        for i in range (5):
+            adj_mat_with_cat_and_price[int(self.n_users*i/5.0):int(self.n_users*(i+1)/5.0), self.n_users:size_of_ui_matrix] =\
+            adj[int(self.n_users*i/5.0):int(self.n_users*(i+1)/5.0), self.n_users:]
+            adj_mat_with_cat_and_price[self.n_users:size_of_ui_matrix,int(self.n_users*i/5.0):int(self.n_users*(i+1)/5.0)] =\
+            adj[int(self.n_users*i/5.0):int(self.n_users*(i+1)/5.0), self.n_users:].T
+            print("iteration: ", i)
+        print(adj_mat_with_cat_and_price._shape)
+
+        adj_connection_value = 1
+        for row in range(0, self.n_items):      # Iterates through the category list of each item to find connections
+            categories = self.business_list[row].categories
+            
+            for cat in categories:  # works for single and multiple categories pr item
+                index = 0
+                for all_cat in self.cat_list:
+                    if(cat == all_cat):
+                        adj_mat_with_cat_and_price[self.n_users + row, size_of_ui_matrix + index] = adj_connection_value # displace by n_users so that we give the correct item the category 
+                        adj_mat_with_cat_and_price[size_of_ui_matrix + index, self.n_users + row] = adj_connection_value # Insures symmetry in adj matrix
+                    index += 1
+            price = self.business_list[row].price
+            index = 0
+            for p in self.price_list:
+                if p == price:
+                    adj_mat_with_cat_and_price[self.n_users + row, size_of_uic_matrix + index] = adj_connection_value
+                    adj_mat_with_cat_and_price[size_of_uic_matrix + index, self.n_users + row] = adj_connection_value
+
+                    break
+                index += 1   
+        return adj_mat_with_cat_and_price
+
     def negative_pool(self):
         t1 = time()
         for u in self.train_items.keys():
@@ -0,0 +1,40 @@
+'''
+Adam that only updates the rows of a sparse gradient (--emb_optimizer lazy_adam), in place of
+tf.contrib.opt.LazyAdamOptimizer, which does not exist under the tensorflow 2 compat.v1 API.
+'''
+import tensorflow as tf
+
+
+class LazyAdamOptimizer(tf.train.AdamOptimizer):
+    """
+    Dense gradients get the plain Adam update. For a sparse gradient the moments and weights of the rows in it are
+    updated, the other rows keep their moments instead of decaying them. Duplicate rows are summed by the base class.
+    """
+    def _lazy_apply(self, values, var, indices):
+        dtype = var.dtype.base_dtype
+        beta1_power, beta2_power = [tf.cast(power, dtype) for power in self._get_beta_accumulators()]
+        lr_t = tf.cast(self._lr_t, dtype)
+        beta1_t = tf.cast(self._beta1_t, dtype)
+        beta2_t = tf.cast(self._beta2_t, dtype)
+        epsilon_t = tf.cast(self._epsilon_t, dtype)
+        lr = lr_t * tf.sqrt(1 - beta2_power) / (1 - beta1_power)
+
+        m = self.get_slot(var, 'm')
+        v = self.get_slot(var, 'v')
+        m_t = tf.scatter_update(m, indices, beta1_t * tf.gather(m, indices) + (1 - beta1_t) * values,
+                                use_locking=self._use_locking)
+        v_t = tf.scatter_update(v, indices, beta2_t * tf.gather(v, indices) + (1 - beta2_t) * tf.square(values),
+                                use_locking=self._use_locking)
+        # the updated moments of the rows are read after their scatter.
+        with tf.control_dependencies([m_t, v_t]):
+            m_t_rows = tf.gather(m, indices)
+            v_t_rows = tf.gather(v, indices)
+            var_update = tf.scatter_sub(var, indices, lr * m_t_rows / (tf.sqrt(v_t_rows) + epsilon_t),
+                                        use_locking=self._use_locking)
+        return tf.group(var_update, m_t, v_t)
+
+    def _apply_sparse(self, grad, var):
+        return self._lazy_apply(grad.values, var, grad.indices)
+
+    def _resource_apply_sparse(self, grad, var, indices):
+        return self._lazy_apply(grad, var, indices)
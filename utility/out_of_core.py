@@ -0,0 +1,153 @@
+'''
+Out-of-core propagation for graphs whose adjacency does not fit in memory (--out_of_core 1).
+
+The pre adjacency D^-1/2 A D^-1/2 is built straight from train.txt, in two streaming passes and chunks of
+users, into a CSR matrix of three .npy files (indptr, indices, data) next to the dataset. The files are
+memory-mapped and the propagation multiplies one block of rows at a time, with as many rows per block as
+fit in --ooc_memory_mb; the operating system pages the rest of the matrix in and out.
+'''
+import os
+import json
+from time import time
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def read_chunks(train_file, n_items, chunk_lines):
+    """
+    (users, items) arrays of chunk_lines lines of train.txt at a time, sorted by user and item without repeats.
+    """
+    with open(train_file) as f:
+        while True:
+            lines = [l for l in (f.readline() for _ in range(chunk_lines)) if len(l.strip()) > 0]
+            if len(lines) == 0:
+                break
+            rows = [np.array(l.split(), dtype=np.int64) for l in lines]
+            users = np.concatenate([np.full(len(row) - 1, row[0]) for row in rows])
+            items = np.concatenate([row[1:] for row in rows])
+            keys = np.unique(users * n_items + items)
+            yield keys // n_items, keys % n_items
+
+
+def train_file_stamp(train_file):
+    # size and modification time of train.txt, a matrix built from other interactions is stale.
+    stat = os.stat(train_file)
+    return {'train_size': stat.st_size, 'train_mtime_ns': stat.st_mtime_ns}
+
+
+def build_pre_adj(path, train_file, n_users, n_items, chunk_lines=10000):
+    """
+    Writes the pre adjacency matrix of the users and items of train_file to path as a CSR matrix.
+    Only the degrees and one chunk of interactions are held in memory.
+    """
+    t1 = time()
+    stamp = train_file_stamp(train_file)
+    n_nodes = n_users + n_items
+    degrees = np.zeros(n_nodes, dtype=np.int64)
+    for users, items in read_chunks(train_file, n_items, chunk_lines):
+        degrees += np.bincount(users, minlength=n_nodes) + np.bincount(n_users + items, minlength=n_nodes)
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    nnz = int(degrees.sum())
+    open_memmap = np.lib.format.open_memmap
+    indptr = open_memmap(os.path.join(path, 'indptr.npy'), mode='w+', dtype=np.int64, shape=(n_nodes + 1,))
+    indptr[0] = 0
+    indptr[1:] = np.cumsum(degrees)
+    index_dtype = np.int32 if n_nodes < 2 ** 31 else np.int64
+    indices = open_memmap(os.path.join(path, 'indices.npy'), mode='w+', dtype=index_dtype, shape=(nnz,))
+    data = open_memmap(os.path.join(path, 'data.npy'), mode='w+', dtype=np.float32, shape=(nnz,))
+    d_inv = np.zeros(n_nodes, dtype=np.float64)
+    d_inv[degrees > 0] = np.power(degrees[degrees > 0], -0.5)
+
+    # users come in increasing order, so appending them to the item rows keeps those rows sorted as well.
+    filled = np.zeros(n_items, dtype=np.int64)
+    last_user = -1
+    for users, items in read_chunks(train_file, n_items, chunk_lines):
+        assert users[0] > last_user, 'out-of-core training needs the lines of train.txt in increasing user order'
+        last_user = users[-1]
+        values = (d_inv[users] * d_inv[n_users + items]).astype(np.float32)
+        start, end = indptr[users[0]], indptr[users[-1] + 1]
+        indices[start:end] = n_users + items
+        data[start:end] = values
+
+        order = np.argsort(items, kind='stable')
+        items, users, values = items[order], users[order], values[order]
+        first = np.searchsorted(items, items)
+        positions = indptr[n_users + items] + filled[items] + np.arange(len(items)) - first
+        indices[positions] = users
+        data[positions] = values
+        filled += np.bincount(items, minlength=n_items)
+
+    for array in [indptr, indices, data]:
+        array.flush()
+    with open(os.path.join(path, 'sizes.json'), 'w') as f:
+        json.dump(dict(n_users=n_users, n_items=n_items, nnz=nnz, **stamp), f)
+    print('built the out-of-core pre adjacency matrix with %d entries [%.1fs]' % (nnz, time() - t1))
+
+
+def load_pre_adj(path, train_file, n_users, n_items, memory_mb=256):
+    """
+    The memory-mapped pre adjacency matrix of path, built first when missing, of other sizes or older than
+    the interactions of train_file (e.g. after --incremental appended some with the same id ranges).
+    """
+    sizes = None
+    if os.path.exists(os.path.join(path, 'sizes.json')):
+        with open(os.path.join(path, 'sizes.json')) as f:
+            sizes = json.load(f)
+    expected = dict(n_users=n_users, n_items=n_items, **train_file_stamp(train_file))
+    if sizes is None or any(sizes.get(name) != value for name, value in expected.items()) or \
+            not os.path.exists(os.path.join(path, 'data.npy')) or \
+            np.load(os.path.join(path, 'data.npy'), mmap_mode='r').shape[0] != sizes['nnz']:
+        build_pre_adj(path, train_file, n_users, n_items)
+    return MmapCSR(path, memory_mb)
+
+
+class MmapCSR(object):
+    def __init__(self, path, memory_mb=256):
+        self.indptr = np.load(os.path.join(path, 'indptr.npy'), mmap_mode='r')
+        self.indices = np.load(os.path.join(path, 'indices.npy'), mmap_mode='r')
+        self.data = np.load(os.path.join(path, 'data.npy'), mmap_mode='r')
+        # what the matrix was built from, derived data such as partitions is cached against it.
+        with open(os.path.join(path, 'sizes.json')) as f:
+            self.sizes = json.load(f)
+        n_nodes = len(self.indptr) - 1
+        self.shape = (n_nodes, n_nodes)
+        self.nnz = len(self.data)
+        # row blocks of at most memory_mb of indices and values (at least one row each).
+        entry_bytes = self.indices.itemsize + self.data.itemsize
+        block_nnz = max(1, int(memory_mb * 2 ** 20 / entry_bytes))
+        bounds = np.searchsorted(self.indptr, np.arange(block_nnz, self.nnz, block_nnz), side='right') - 1
+        bounds = np.unique(np.concatenate([[0], bounds, [n_nodes]]))
+        self.blocks = list(zip(bounds[:-1], bounds[1:]))
+
+    def count_nonzero(self):
+        return self.nnz
+
+    def degrees(self):
+        return np.diff(self.indptr).astype(np.float32)
+
+    def block(self, start, end):
+        v_start, v_end = self.indptr[start], self.indptr[end]
+        return sp.csr_matrix((np.asarray(self.data[v_start:v_end]), np.asarray(self.indices[v_start:v_end]),
+                              np.asarray(self.indptr[start:end + 1]) - v_start), shape=(end - start, self.shape[1]))
+
+    def __getitem__(self, nodes):
+        # the rows of nodes as an in-memory csr matrix, e.g. for utility.subgraph.khop_subgraph.
+        nodes = np.asarray(nodes)
+        starts = np.asarray(self.indptr[nodes])
+        degrees = np.asarray(self.indptr[nodes + 1]) - starts
+        positions = np.repeat(starts - (np.cumsum(degrees) - degrees), degrees) + np.arange(degrees.sum())
+        return sp.csr_matrix((np.asarray(self.data[positions]), np.asarray(self.indices[positions]),
+                              np.concatenate([[0], np.cumsum(degrees)])), shape=(len(nodes), self.shape[1]))
+
+    def dot(self, x):
+        out = np.empty((self.shape[0], x.shape[1]), dtype=np.float32)
+        for start, end in self.blocks:
+            out[start:end] = self.block(start, end).dot(x)
+        return out
+
+    def tocsr(self):
+        # the whole matrix in memory, e.g. to compare against the in-memory adjacency.
+        return sp.vstack([self.block(start, end) for start, end in self.blocks]).tocsr()
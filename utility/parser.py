@@ -7,7 +7,7 @@ Wang Xiang et al. Neural Graph Collaborative Filtering. In SIGIR 2019.
 '''
 import argparse
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Run NGCF.")
     parser.add_argument('--weights_path', nargs='?', default='',
                         help='Store model path.')
@@ -36,17 +36,47 @@ def parse_args():
     parser.add_argument('--batch_size', type=int, default=1024,
                         help='Batch size.')
 
+    parser.add_argument('--emb_dtype', nargs='?', default='float32',
+                        help='Storage type of the embedding tables from {float32, float16, bfloat16}. Propagation and loss are always computed in float32.')
+
     parser.add_argument('--regs', nargs='?', default='[1e-5,1e-5,1e-2]',
                         help='Regularizations.')
     parser.add_argument('--lr', type=float, default=0.01,
                         help='Learning rate.')
+    parser.add_argument('--emb_optimizer', nargs='?', default='adam',
+                        help='Specify the optimizer from {adam, lazy_adam, adagrad}. lazy_adam and adagrad only update the rows of a sparse gradient, see --subgraph.')
+    parser.add_argument('--subgraph', type=int, default=0,
+                        help='0: Propagate over the whole graph for every batch, 1: Propagate over the k-hop subgraph of the batch, so that gradients only touch its rows.')
 
     parser.add_argument('--model_type', nargs='?', default='lightgcn',
                         help='Specify the name of model (lightgcn).')
     parser.add_argument('--adj_type', nargs='?', default='pre',
                         help='Specify the type of the adjacency (laplacian) matrix from {plain, norm, mean, adj_with_cp}.')
     parser.add_argument('--alg_type', nargs='?', default='lightgcn',
-                        help='Specify the type of the graph convolutional layer from {ngcf, gcn, gcmc, pas, ngcfpas, gcf, gcf-sum-minus-self-con, gcf-sum, gcf-minus-self-con}.')
+                        help='Specify the type of the graph convolutional layer from {lightgcn, LightGCN-alpha-1, LightGCN-concat, ngcf, gcn, gcmc, pas, ngcfpas, gcf, gcf-only-ip, gcf-sum, gcf-sum-only-ip, gcf-minus-ip}, see utility/propagation.py.')
+    parser.add_argument('--n_fold', type=int, default=100,
+                        help='Number of row blocks the adjacency matrix is split into for propagation, 1: a single sparse matmul per layer.')
+    parser.add_argument('--out_of_core', type=int, default=0,
+                        help='1: Keep the pre adjacency matrix in a memory-mapped file and propagate it block by block, for graphs that do not fit in memory (see utility/out_of_core.py).')
+    parser.add_argument('--ooc_memory_mb', type=float, default=256,
+                        help='Memory budget in MB of the adjacency block multiplied at once by --out_of_core 1.')
+    parser.add_argument('--n_partitions', type=int, default=0,
+                        help='With --out_of_core 1, split the graph into this many parts, each trained by its own process that owns the embeddings and optimizer state of its nodes and only exchanges the embeddings of boundary nodes (see utility/partition.py). 0 or 1: one process.')
+    parser.add_argument('--n_workers', type=int, default=0,
+                        help='Number of data-parallel worker processes that each train a batch per step and share the memory-mapped adjacency (see utility/data_parallel.py), 0: train in this process.')
+
+    parser.add_argument('--cpus', nargs='?', default='',
+                        help='CPUs the run sizes its thread pools for, e.g. [0,1,2,3], default: all the process may run on (see utility/resources.py).')
+    parser.add_argument('--intra_op_threads', type=int, default=0,
+                        help='Threads of a tensorflow op, 0: one per CPU of --cpus.')
+    parser.add_argument('--inter_op_threads', type=int, default=0,
+                        help='Tensorflow ops run at the same time, 0: one per CPU of --cpus.')
+    parser.add_argument('--eval_threads', type=int, default=0,
+                        help='Threads of the C++ and python evaluators, 0: one per CPU of --cpus.')
+    parser.add_argument('--pin_cpus', type=int, default=0,
+                        help='1: Bind the process to --cpus and every --n_workers/--n_partitions worker process to one of them.')
+    parser.add_argument('--resource_config', nargs='?', default='',
+                        help='JSON file of the settings above written by benchmarks/autotune.py, options given on the command line take precedence.')
 
     parser.add_argument('--gpu_id', type=int, default=0,
                         help='0 for NAIS_prod, 1 for NAIS_concat')
@@ -61,8 +91,65 @@ def parse_args():
     parser.add_argument('--Ks', nargs='?', default='[20]',
                         help='Top k(s) recommend')
 
+    parser.add_argument('--incremental', type=int, default=0,
+                        help='1: Warm-start from the model stored with --save_flag 1 after interactions were appended to train.txt, '
+                             'only training the users near the new interactions.')
+    parser.add_argument('--incremental_hops', type=int, default=1,
+                        help='Users within this many hops of the new interactions are trained by --incremental 1.')
     parser.add_argument('--save_flag', type=int, default=0,
                         help='0: Disable model saver, 1: Activate model saver')
+    parser.add_argument('--eval_every', type=int, default=20,
+                        help='Epochs between two full evaluations (the initial interval of --eval_schedule adaptive).')
+    parser.add_argument('--eval_schedule', nargs='?', default='fixed',
+                        help='Specify the evaluation schedule from {fixed, adaptive}: adaptive doubles the interval while the '
+                             'recall improves by more than --eval_tolerance and halves it otherwise.')
+    parser.add_argument('--eval_min_every', type=int, default=5,
+                        help='Shortest interval of --eval_schedule adaptive.')
+    parser.add_argument('--eval_max_every', type=int, default=80,
+                        help='Longest interval of --eval_schedule adaptive.')
+    parser.add_argument('--eval_tolerance', type=float, default=0.01,
+                        help='Relative recall change that counts as an improvement (or a drop of a probe).')
+    parser.add_argument('--probe_every', type=int, default=0,
+                        help='Epochs between two probes (recall on --probe_users test users) between full evaluations, 0: no probes.')
+    parser.add_argument('--probe_users', type=int, default=1000,
+                        help='Number of test users of a probe.')
+    parser.add_argument('--train_recall', type=int, default=1,
+                        help='0: Skip the recall on the training users in the evaluation epochs, 1: Compute it.')
+    parser.add_argument('--train_recall_users', type=int, default=0,
+                        help='Compute the training recall on a fixed random subset of this many users (per split with --evaluation multiple), 0: all.')
+    parser.add_argument('--test_loss_batches', type=int, default=-1,
+                        help='Number of sampled batches the test loss is averaged over, -1: as many as in a training epoch, 0: skip the test loss.')
+    parser.add_argument('--stopping_patience', type=int, default=5,
+                        help='Number of full evaluations without improvement before early stopping.')
+    parser.add_argument('--time_budget', type=float, default=0,
+                        help='Wall-clock budget of the training in minutes, the last epoch within it is evaluated. 0: no limit.')
+    parser.add_argument('--instrument', type=int, default=0,
+                        help='1: Log per-epoch timers (sampling, sampler stalls, session runs, evaluation phases), throughputs '
+                             'and peak RSS, and write them to TensorBoard.')
+    parser.add_argument('--profile_steps', nargs='?', default='[]',
+                        help='Training steps (counted from 0 over all epochs) to trace, e.g. [10,11]. Their op timelines, a cProfile and '
+                             'tracemalloc capture of their sampling and of the first evaluation are written to --profile_dir.')
+    parser.add_argument('--profile_dir', nargs='?', default='',
+                        help='Directory of the profiles, default: profile/ in the TensorBoard directory of the run.')
+    parser.add_argument('--checkpoint_every', type=int, default=0,
+                        help='Write a resumable checkpoint of the full training state every this many epochs, 0: never.')
+    parser.add_argument('--checkpoint_keep', type=int, default=2,
+                        help='Number of resumable checkpoints kept.')
+    parser.add_argument('--resume', type=int, default=0,
+                        help='1: Continue training from the latest resumable checkpoint of the same settings, if any.')
+
+    parser.add_argument('--export_flag', type=int, default=0,
+                        help='0: Disable embedding export, 1: Export the final embeddings for serving/ after training')
+    parser.add_argument('--export_path', nargs='?', default='',
+                        help='Directory of the embedding export, default: export/{dataset}/LightGCN/{alg_type}.')
+
+    parser.add_argument('--ann_nprobe', type=int, default=0,
+                        help='0: Exact evaluation, >0: Approximate evaluation over the nprobe nearest lists of an IVF item index')
+    parser.add_argument('--ann_lists', type=int, default=0,
+                        help='Number of lists of the IVF item index, 0: sqrt of the number of items.')
+
+    parser.add_argument('--topk_cache_mb', type=float, default=0,
+                        help='Memory bound in MB of the cache of top-K lists reused by evaluations of the same weights, 0: no cache.')
 
     parser.add_argument('--test_flag', nargs='?', default='part',
                         help='Specify the test type from {part, full}, indicating whether the reference is done in mini-batch')
@@ -79,4 +166,4 @@ def parse_args():
     parser.add_argument('--log_file', nargs='?', default='',
                         help='Specify file path that print statements should log to')
     
-    return parser.parse_args()
+    return parser.parse_args(argv)
@@ -0,0 +1,394 @@
+'''
+Graph-partitioned training across processes (--out_of_core 1 --n_partitions P).
+
+partition_nodes splits the nodes of the memory-mapped pre adjacency into P parts of about the same number of
+edges: chunks of nodes, in random order, go to the part that holds most of their neighbours, discounted by how
+full the part is (linear deterministic greedy, one chunk at a time), and boundary nodes are then moved to the
+part of most of their neighbours while that keeps the balance. Both count the neighbours per part of a chunk of
+nodes with one sparse matrix, the statistics of a partition are CSR ops over the row blocks of the adjacency.
+
+Each of P forked processes owns a part: the adjacency rows of its nodes, their embeddings and their Adam moments.
+The main process samples a batch and the parts train it together. Per layer, forward and backward, a part writes
+the rows of its boundary nodes (the ones in the halo of another part) to its shared send buffer in /dev/shm and
+reads its halo rows from the send buffers of the owners, so only boundary embeddings cross parts. The final
+embeddings of the batch nodes are exchanged alike for the loss, every part then propagates the gradient of its
+rows and applies Adam to them. The session process keeps the tables for evaluation and checkpoints only: they are
+copied from the parts once per epoch by sync(), it neither holds the gradients nor the optimizer state, so a
+checkpoint cannot resume the Adam moments of the parts. A part that fails breaks the barrier of the others and sends
+its error back, which the step raises, as does a part that dies; a barrier wait also gives up after a timeout.
+
+Like utility/data_parallel.py, only lightgcn and LightGCN-alpha-1 without node dropout are supported.
+'''
+import os
+import json
+import shutil
+import tempfile
+import traceback
+import multiprocessing
+
+import numpy as np
+import scipy.sparse as sp
+import tensorflow as tf
+
+from utility.data_parallel import WorkerError, collect
+from utility.out_of_core import MmapCSR
+from utility.resources import resources
+
+
+def neighbour_counts(adj, nodes, parts, n_parts):
+    """
+    Number of neighbours of every node of nodes in every part, unassigned (-1) neighbours are not counted.
+    """
+    nodes = np.asarray(nodes)
+    starts = np.asarray(adj.indptr[nodes])
+    degrees = np.asarray(adj.indptr[nodes + 1]) - starts
+    offsets = np.cumsum(degrees) - degrees
+    positions = np.repeat(starts - offsets, degrees) + np.arange(degrees.sum())
+    column_parts = parts[np.asarray(adj.indices[positions])]
+    # unassigned neighbours are counted in an extra column that is dropped.
+    counts = sp.csr_matrix((np.ones(len(positions), dtype=np.int32), np.where(column_parts >= 0, column_parts, n_parts),
+                            np.concatenate([[0], np.cumsum(degrees)])), shape=(len(nodes), n_parts + 1))
+    return counts.toarray()[:, :n_parts]
+
+
+def first_fit(choices, degrees, loads, capacity):
+    # the nodes that fit into their chosen part, in order, while it stays within capacity.
+    order = np.argsort(choices, kind='stable')
+    sorted_choices = choices[order]
+    totals = np.cumsum(degrees[order])
+    group_starts = np.searchsorted(sorted_choices, sorted_choices)
+    group_totals = totals - (totals[group_starts] - degrees[order][group_starts])
+    fits = np.empty(len(choices), dtype=bool)
+    fits[order] = loads[sorted_choices] + group_totals <= capacity
+    return fits
+
+
+def partition_nodes(adj, n_parts, imbalance=0.05, n_chunks=64, n_refine=4, seed=0):
+    """
+    Part of every node of adj (an MmapCSR), with at most (1 + imbalance) times the mean number of edges per part.
+    """
+    n_nodes = adj.shape[0]
+    degrees = np.diff(adj.indptr)
+    capacity = (1. + imbalance) * max(1, degrees.sum()) / n_parts
+    parts = np.full(n_nodes, -1, dtype=np.int64)
+    loads = np.zeros(n_parts)
+    rng = np.random.RandomState(seed)
+    for chunk in np.array_split(rng.permutation(n_nodes), n_chunks):
+        while len(chunk) > 0:
+            # the jitter breaks ties between parts without neighbours of a node at random.
+            score = (neighbour_counts(adj, chunk, parts, n_parts) + rng.uniform(0., 1e-3, (len(chunk), n_parts))) \
+                    * (1. - loads / capacity)
+            # full parts only take a node when every part is full.
+            score[loads[None, :] + degrees[chunk, None] > capacity] -= 1e9
+            choices = np.argmax(score, axis=1)
+            fits = first_fit(choices, degrees[chunk], loads, capacity)
+            if not fits.any():
+                fits[:] = True
+            parts[chunk[fits]] = choices[fits]
+            loads += np.bincount(choices[fits], weights=degrees[chunk[fits]], minlength=n_parts)
+            chunk = chunk[~fits]
+
+    for _ in range(n_refine):
+        moved = 0
+        # a chunk of nodes at a time, so that two neighbours rarely move away from each other.
+        for active in np.array_split(rng.permutation(np.flatnonzero(degrees)), n_chunks):
+            counts = neighbour_counts(adj, active, parts, n_parts)
+            own = parts[active]
+            own_counts = counts[np.arange(len(active)), own]
+            counts[loads[None, :] + degrees[active, None] > capacity] = -1
+            counts[np.arange(len(active)), own] = -1
+            best = np.argmax(counts, axis=1)
+            gains = counts[np.arange(len(active)), best] - own_counts
+            candidates = np.flatnonzero(gains > 0)
+            # the largest gains first.
+            candidates = candidates[np.argsort(-gains[candidates], kind='stable')]
+            fits = first_fit(best[candidates], degrees[active[candidates]], loads, capacity)
+            movers = candidates[fits]
+            loads -= np.bincount(own[movers], weights=degrees[active[movers]], minlength=n_parts)
+            loads += np.bincount(best[movers], weights=degrees[active[movers]], minlength=n_parts)
+            parts[active[movers]] = best[movers]
+            moved += len(movers)
+        if moved == 0:
+            break
+    return parts
+
+
+def load_parts(adj, path, n_parts, seed=0):
+    # partitions are cached next to the adjacency they were computed for, with the sizes and train.txt stamp of
+    # that adjacency: a rebuilt matrix (e.g. other interactions with the same id ranges) is partitioned again.
+    parts_file = os.path.join(path, 'parts_%d.npy' % n_parts)
+    source_file = os.path.join(path, 'parts_%d.json' % n_parts)
+    source = dict(adj.sizes, seed=seed)
+    if os.path.exists(parts_file) and os.path.exists(source_file):
+        with open(source_file) as f:
+            if json.load(f) == source:
+                return np.load(parts_file)
+    parts = partition_nodes(adj, n_parts, seed=seed)
+    np.save(parts_file, parts)
+    with open(source_file, 'w') as f:
+        json.dump(source, f)
+    return parts
+
+
+def halo_nodes(adj, parts, n_parts):
+    """
+    The halo of every part (the sorted neighbours of its nodes owned by other parts), the adjacency entries per
+    part and the number of entries between parts, block by block of adj.
+    """
+    n_nodes = adj.shape[0]
+    loads = np.zeros(n_parts, dtype=np.int64)
+    cut = 0
+    keys = []
+    for start, end in adj.blocks:
+        row_parts = np.repeat(parts[start:end], np.diff(adj.indptr[start:end + 1]))
+        columns = np.asarray(adj.indices[adj.indptr[start]:adj.indptr[end]]).astype(np.int64)
+        boundary = parts[columns] != row_parts
+        loads += np.bincount(row_parts, minlength=n_parts)
+        cut += int(boundary.sum())
+        keys.append(np.unique(row_parts[boundary] * n_nodes + columns[boundary]))
+    keys = np.unique(np.concatenate(keys))
+    bounds = np.searchsorted(keys // n_nodes, np.arange(n_parts + 1))
+    halos = [keys[bounds[part]:bounds[part + 1]] % n_nodes for part in range(n_parts)]
+    return halos, loads, cut
+
+
+def partition_stats(adj, parts, n_parts, dim):
+    """
+    Edge cut, edges per part and the embedding rows and bytes exchanged per layer.
+    """
+    halos, loads, cut = halo_nodes(adj, parts, n_parts)
+    halo_rows = sum(len(halo) for halo in halos)
+    return {'n_parts': n_parts, 'edge_cut': cut // 2, 'edge_cut_ratio': float(cut) / max(1, adj.nnz),
+            'edges_per_part': loads.tolist(), 'halo_rows_per_layer': int(halo_rows),
+            'bytes_per_layer': int(halo_rows) * dim * 4}
+
+
+def local_block(adj, nodes, parts, part):
+    """
+    The rows of nodes with their columns renumbered as [nodes, halo], and the halo nodes.
+    """
+    blocks = [adj.block(start, end) for start, end in contiguous_ranges(nodes)]
+    rows = sp.vstack(blocks).tocsr() if len(blocks) > 0 else sp.csr_matrix((0, adj.shape[1]), dtype=np.float32)
+    columns = np.unique(rows.indices)
+    halo = columns[parts[columns] != part]
+    local_ids = np.full(adj.shape[1], -1, dtype=np.int64)
+    local_ids[nodes] = np.arange(len(nodes))
+    local_ids[halo] = len(nodes) + np.arange(len(halo))
+    rows = sp.csr_matrix((rows.data, local_ids[rows.indices], rows.indptr), shape=(len(nodes), len(nodes) + len(halo)))
+    return rows, halo
+
+
+def contiguous_ranges(nodes):
+    # sorted nodes as (start, end) ranges of consecutive ids.
+    if len(nodes) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(nodes) != 1) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(nodes)]])
+    return [(nodes[s], nodes[e - 1] + 1) for s, e in zip(starts, ends)]
+
+
+def open_buffer(work_dir, name, mode):
+    # the shapes of the shared buffers are stored next to them.
+    with open(os.path.join(work_dir, name + '.json')) as f:
+        buffer = json.load(f)
+    return np.memmap(os.path.join(work_dir, name), dtype=buffer['dtype'], mode=mode, shape=tuple(buffer['shape']))
+
+
+def create_buffer(work_dir, name, dtype, shape):
+    with open(os.path.join(work_dir, name + '.json'), 'w') as f:
+        json.dump({'dtype': np.dtype(dtype).name, 'shape': list(shape)}, f)
+    return np.memmap(os.path.join(work_dir, name), dtype=dtype, mode='w+', shape=shape)
+
+
+class Part(object):
+    """
+    The state of one part in its worker process: the adjacency rows, embeddings and Adam moments of its nodes.
+    """
+    def __init__(self, part, adj_path, parts, boundary, work_dir, batch_size, n_layers, coefficient, decay, lr):
+        self.part = part
+        self.parts = parts
+        self.nodes = np.flatnonzero(parts == part)
+        self.rows, self.halo = local_block(MmapCSR(adj_path), self.nodes, parts, part)
+        n_parts = len(boundary)
+        self.embeddings = open_buffer(work_dir, 'embeddings_%d' % part, 'r+')
+        # the rows this part sends and, per owner, where its halo rows are in the owner's send buffer.
+        self.send_rows = np.searchsorted(self.nodes, boundary[part])
+        owners = parts[self.halo]
+        self.receive = [(np.flatnonzero(owners == owner), np.searchsorted(boundary[owner], self.halo[owners == owner]))
+                        for owner in range(n_parts)]
+        # two sets of send buffers, a part writes the next layer while others still read the previous one.
+        self.send = [[open_buffer(work_dir, 'send_%d_%d' % (parity, owner), 'r+') for owner in range(n_parts)]
+                     for parity in range(2)]
+        self.n_exchanges = 0
+        self.batch = open_buffer(work_dir, 'batch', 'r')
+        self.batch_final = open_buffer(work_dir, 'batch_final', 'r+')
+        self.m = np.zeros_like(self.embeddings)
+        self.v = np.zeros_like(self.embeddings)
+        self.n_updates = 0
+        self.batch_size = batch_size
+        self.n_layers = n_layers
+        self.coefficient = coefficient
+        self.decay = decay
+        self.lr = lr
+
+    def exchange(self, layer, barrier):
+        # the halo rows of layer, after every part has written its boundary rows.
+        send = self.send[self.n_exchanges % 2]
+        self.n_exchanges += 1
+        send[self.part][:] = layer[self.send_rows]
+        barrier.wait()
+        halo = np.empty((len(self.halo), layer.shape[1]), dtype=np.float32)
+        for owner, (positions, rows) in enumerate(self.receive):
+            halo[positions] = send[owner][rows]
+        return halo
+
+    def propagate(self, x, barrier):
+        # coefficient * sum_k A^k x on the rows of this part, as utility.data_parallel.propagate.
+        layer = x
+        result = x.copy()
+        for _ in range(self.n_layers):
+            layer = self.rows.dot(np.concatenate([layer, self.exchange(layer, barrier)]))
+            result += layer
+        return result * self.coefficient
+
+    def train(self, barrier):
+        """
+        One Adam update of the rows of this part with the batch, returns its mf loss and its share of the emb loss.
+        """
+        embeddings = np.array(self.embeddings)
+        batch = np.array(self.batch)
+        final = self.propagate(embeddings, barrier)
+        owned = self.parts[batch] == self.part
+        local = np.searchsorted(self.nodes, batch[owned])
+        self.batch_final[owned] = final[local]
+        barrier.wait()
+        u, p, n = np.array(self.batch_final)
+        x = np.sum(u * (p - n), axis=1)
+        mf_loss = np.mean(np.logaddexp(0., -x))
+
+        # as utility.data_parallel.bpr_gradient, for the batch rows of this part.
+        g = (-1. / (1. + np.exp(x)) / len(x))[:, None].astype(np.float32)
+        final_gradient = np.zeros_like(embeddings)
+        for role, role_gradient in enumerate([g * (p - n), g * u, -g * u]):
+            np.add.at(final_gradient, np.searchsorted(self.nodes, batch[role][owned[role]]), role_gradient[owned[role]])
+        gradient = self.propagate(final_gradient, barrier)
+        regularizer = np.sum(embeddings[local] ** 2) / 2.
+        np.add.at(gradient, local, self.decay / self.batch_size * embeddings[local])
+
+        # the dense update of tf.train.AdamOptimizer with its default betas and epsilon.
+        self.n_updates += 1
+        self.m = 0.9 * self.m + 0.1 * gradient
+        self.v = 0.999 * self.v + 0.001 * gradient ** 2
+        lr = self.lr * np.sqrt(1. - 0.999 ** self.n_updates) / (1. - 0.9 ** self.n_updates)
+        self.embeddings[:] = embeddings - lr * self.m / (np.sqrt(self.v) + 1e-8)
+        return mf_loss, self.decay * regularizer / self.batch_size
+
+
+def worker(part, n_threads, barrier, tasks, results, *args):
+    try:
+        resources.pin_worker(part)
+        resources.limit_threads(n_threads)
+        state = Part(part, *args)
+        while tasks.get() is not None:
+            results.put((part,) + state.train(barrier))
+    except Exception:
+        # the error is sent before the other parts are released from the barrier with theirs.
+        results.put(WorkerError('part %d failed:\n%s' % (part, traceback.format_exc())))
+        barrier.abort()
+
+
+class PartitionedTrainer(object):
+    def __init__(self, model, adj_path, memory_mb, sampler, n_parts, lr, seed=0, barrier_timeout=600.):
+        """
+        Partitions the adjacency, builds the ops that copy the tables in and out of the session (before the
+        variables are initialized) and forks one process per part. barrier_timeout is the longest a part waits
+        for the others at an exchange.
+        """
+        if model.alg_type not in ['lightgcn', 'LightGCN-alpha-1'] or model.alpha_k == 'leveled':
+            raise ValueError('partitioned training needs --alg_type lightgcn or LightGCN-alpha-1 with --alpha_k mean')
+        if model.node_dropout_flag or model.emb_dtype != tf.float32:
+            raise ValueError('partitioned training does not support node dropout and reduced-precision tables')
+        adj = MmapCSR(adj_path, memory_mb)
+        self.parts = load_parts(adj, adj_path, n_parts, seed)
+        self.stats = partition_stats(adj, self.parts, n_parts, model.emb_dim)
+        # the nodes of every part in the halo of another one.
+        boundary = np.unique(np.concatenate(halo_nodes(adj, self.parts, n_parts)[0]))
+        boundary = [boundary[self.parts[boundary] == part] for part in range(n_parts)]
+        self.nodes = [np.flatnonzero(self.parts == part) for part in range(n_parts)]
+        self.sampler = sampler
+        self.n_users = model.n_users
+        self.tables = [model.embedding_tables['user_embedding'], model.embedding_tables['item_embedding']]
+        self.table_inputs = [tf.placeholder(tf.float32, table.shape) for table in self.tables]
+        self.assign = [tf.assign(table, table_input) for table, table_input in zip(self.tables, self.table_inputs)]
+        self.loaded = False
+
+        # /dev/shm keeps the shards and the exchanged rows in memory.
+        self.work_dir = tempfile.mkdtemp(prefix='lightgcn-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        dim = model.emb_dim
+        self.embeddings = [create_buffer(self.work_dir, 'embeddings_%d' % part, np.float32, (len(nodes), dim))
+                           for part, nodes in enumerate(self.nodes)]
+        for parity in range(2):
+            for part in range(n_parts):
+                create_buffer(self.work_dir, 'send_%d_%d' % (parity, part), np.float32, (len(boundary[part]), dim))
+        self.batch = create_buffer(self.work_dir, 'batch', np.int64, (3, sampler.batch_size))
+        create_buffer(self.work_dir, 'batch_final', np.float32, (3, sampler.batch_size, dim))
+        coefficient = 1. / (model.n_layers + 1) if model.alg_type == 'lightgcn' else 1.
+        context = multiprocessing.get_context('fork')
+        self.barrier = context.Barrier(n_parts, timeout=barrier_timeout)
+        self.results = context.Queue()
+        self.tasks = [context.Queue() for _ in range(n_parts)]
+        n_threads = resources.worker_threads(n_parts)
+        self.workers = [context.Process(target=worker, args=(part, n_threads, self.barrier, self.tasks[part], self.results,
+                                                             adj_path, self.parts, boundary, self.work_dir,
+                                                             sampler.batch_size, model.n_layers, coefficient,
+                                                             model.decay, lr), daemon=True)
+                        for part in range(n_parts)]
+        for process in self.workers:
+            process.start()
+
+    def load(self, sess):
+        # the initial (or restored) tables of the session, the parts start their Adam moments from zero.
+        tables = np.concatenate(sess.run(self.tables), axis=0)
+        for nodes, embeddings in zip(self.nodes, self.embeddings):
+            embeddings[:] = tables[nodes]
+        self.loaded = True
+
+    def step(self, sess):
+        """
+        One update with a batch of --batch_size trained by all parts, returns the loss of the batch.
+        """
+        if not self.loaded:
+            self.load(sess)
+        users, pos_items, neg_items = self.sampler.sample()
+        self.batch[:] = [users, self.n_users + np.asarray(pos_items), self.n_users + np.asarray(neg_items)]
+        for tasks in self.tasks:
+            tasks.put(True)
+        try:
+            losses = collect(self.results, self.workers)
+        except WorkerError:
+            # the parts still waiting for a dead one are released.
+            self.barrier.abort()
+            raise
+        # every part computes the mf loss of the whole batch, the emb loss is summed over the parts.
+        mf_loss = losses[0][1]
+        emb_loss = sum(loss[2] for loss in losses)
+        return mf_loss + emb_loss, mf_loss, emb_loss
+
+    def sync(self, sess):
+        # the session tables are only read by evaluation and checkpoints.
+        tables = np.empty((sum(len(nodes) for nodes in self.nodes), self.embeddings[0].shape[1]), dtype=np.float32)
+        for nodes, embeddings in zip(self.nodes, self.embeddings):
+            tables[nodes] = embeddings
+        sess.run(self.assign, feed_dict={self.table_inputs[0]: tables[:self.n_users],
+                                         self.table_inputs[1]: tables[self.n_users:]})
+
+    def summary(self):
+        return json.dumps(self.stats)
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.workers:
+            process.join()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
@@ -0,0 +1,98 @@
+'''
+Opt-in profiling of chosen training steps (--profile_steps, --profile_dir):
+    step_<n>.json: Chrome trace (chrome://tracing) of the ops of training step n, from tf.RunMetadata;
+    <tag>.prof, <tag>_cpu.txt: cProfile of a profiled call (Data.sample of a profiled step, the first evaluation);
+    <tag>_memory.txt: the lines that allocated most memory during that call (tracemalloc, which slows down
+    the threaded python evaluator about 25 times, so the evaluation is traced on a few users in a separate call).
+The op times of all traced steps are aggregated per op type and per op, summary() formats them.
+'''
+import os
+import io
+import cProfile
+import pstats
+import tracemalloc
+from collections import defaultdict
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+class Profiler(object):
+    def __init__(self, profile_dir, steps):
+        self.profile_dir = profile_dir
+        self.steps = set(steps)
+        self.enabled = len(self.steps) > 0
+        if self.enabled and not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+        self.captured = set()
+        self.traced_steps = []
+        self.op_type_micros = defaultdict(int)
+        self.op_micros = defaultdict(int)
+
+    def wants(self, step):
+        return step in self.steps
+
+    def run(self, sess, fetches, feed_dict, step):
+        """
+        sess.run, traced when step is one of the profiled steps.
+        """
+        if not self.wants(step):
+            return sess.run(fetches, feed_dict=feed_dict)
+        run_metadata = tf.RunMetadata()
+        result = sess.run(fetches, feed_dict=feed_dict, run_metadata=run_metadata,
+                          options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE))
+        with open(os.path.join(self.profile_dir, 'step_%d.json' % step), 'w') as f:
+            f.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+        for device in run_metadata.step_stats.dev_stats:
+            for node in device.node_stats:
+                # the timeline label reads 'name = OpType(inputs)'.
+                op_type = node.timeline_label.split(' = ')[-1].split('(')[0] if ' = ' in node.timeline_label else node.node_name
+                micros = node.op_end_rel_micros - node.op_start_rel_micros
+                self.op_type_micros[op_type] += micros
+                self.op_micros['%s (%s)' % (node.node_name, op_type)] += micros
+        self.traced_steps.append(step)
+        return result
+
+    def call(self, tag, fn, *args, trace_memory=True, **kwargs):
+        """
+        fn(*args, **kwargs), under cProfile (and tracemalloc) the first time tag is seen.
+        cProfile only sees the calling thread, the time of worker threads shows up as lock waits.
+        """
+        if not self.enabled or tag in self.captured:
+            return fn(*args, **kwargs)
+        self.captured.add(tag)
+        profile = cProfile.Profile()
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            result = profile.runcall(fn, *args, **kwargs)
+            snapshot, peak = None, 0
+            if trace_memory:
+                snapshot, peak = tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1]
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+
+        path = os.path.join(self.profile_dir, tag)
+        profile.dump_stats(path + '.prof')
+        with open(path + '_cpu.txt', 'w') as f:
+            pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(40)
+        if snapshot is not None:
+            with open(path + '_memory.txt', 'w') as f:
+                f.write('peak traced memory: %.1f MiB, still allocated at the end of the call:\n' % (peak / 2. ** 20))
+                for stat in snapshot.statistics('lineno')[:40]:
+                    f.write('%s\n' % stat)
+        return result
+
+    def summary(self, top=15):
+        if len(self.traced_steps) == 0:
+            return 'no traced steps'
+        out = io.StringIO()
+        total = float(sum(self.op_type_micros.values()))
+        out.write('op time of the traced steps %s (%.1fms per step), written to %s\n' % (
+            sorted(self.traced_steps), total / 1000. / len(self.traced_steps), self.profile_dir))
+        for title, micros in [('op type', self.op_type_micros), ('op', self.op_micros)]:
+            out.write('%-70s %10s %7s\n' % (title, 'ms/step', 'share'))
+            for name, t in sorted(micros.items(), key=lambda x: -x[1])[:top]:
+                out.write('%-70s %10.2f %6.1f%%\n' % (name[:70], t / 1000. / len(self.traced_steps), 100. * t / total))
+        return out.getvalue()
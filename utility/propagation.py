@@ -0,0 +1,247 @@
+'''
+Propagation engine shared by the graph convolution variants of LightGCN.py.
+
+A variant only declares the parameters it needs, its per-layer transform and how the layer outputs
+are combined; fold splitting, node dropout and the sparse matmul are done once in PropagationEngine.
+New variants are added with @register_variant and selected with --alg_type.
+'''
+import numpy as np
+import tensorflow as tf
+
+VARIANTS = dict()
+
+
+def register_variant(*names):
+    def register(cls):
+        for name in names:
+            VARIANTS[name] = cls
+        return cls
+    return register
+
+
+def dropout_nodes(values, rows, cols, n_nodes, keep_prob):
+    """
+    Dropout for the nodes of a sparse adjacency matrix given by its (row, col, value) arrays.
+    One keep/drop decision is drawn per node, an entry survives when both its row and column node are kept,
+    i.e. with probability keep_prob**2 (keep_prob for a self loop). The survivors are rescaled by the inverse,
+    so that the expected matrix is the original one.
+    """
+    random_tensor = keep_prob
+    random_tensor += tf.random_uniform([n_nodes])
+    node_mask = tf.floor(random_tensor)
+    edge_mask = tf.gather(node_mask, rows) * tf.gather(node_mask, cols)
+    scale = tf.where(tf.equal(rows, cols), tf.fill(tf.shape(edge_mask), tf.div(1., keep_prob)),
+                     tf.fill(tf.shape(edge_mask), tf.div(1., keep_prob * keep_prob)))
+
+    return tf.convert_to_tensor(values) * edge_mask * scale
+
+
+class PropagationEngine(object):
+    def __init__(self, adj, n_fold=1, keep_prob=None):
+        """
+        adj is either a scipy sparse matrix, split into n_fold row blocks that share one value array,
+        or a tf.SparseTensor (e.g. a subgraph fed per batch) multiplied in one block.
+        keep_prob is the node keep probability, None disables node dropout.
+        """
+        if isinstance(adj, tf.SparseTensor):
+            n_nodes = adj.dense_shape[0]
+            rows, cols, values = adj.indices[:, 0], adj.indices[:, 1], adj.values
+            folds = [(adj.indices, 0, None, adj.dense_shape)]
+        else:
+            adj = adj.tocsr().astype(np.float32)
+            adj.sort_indices()
+            n_nodes = adj.shape[0]
+            rows = np.repeat(np.arange(n_nodes, dtype=np.int64), np.diff(adj.indptr))
+            cols = adj.indices.astype(np.int64)
+            values = adj.data
+            folds = []
+            fold_len = n_nodes // n_fold
+            for i_fold in range(n_fold):
+                start = i_fold * fold_len
+                if i_fold == n_fold - 1:
+                    end = n_nodes
+                else:
+                    end = (i_fold + 1) * fold_len
+                v_start, v_end = adj.indptr[start], adj.indptr[end]
+                indices = np.stack([rows[v_start:v_end] - start, cols[v_start:v_end]], axis=1)
+                folds.append((indices, v_start, v_end, [end - start, n_nodes]))
+
+        if keep_prob is not None:
+            values = dropout_nodes(values, rows, cols, n_nodes, keep_prob)
+        self.folds = [tf.SparseTensor(indices, values[v_start:v_end], shape) for indices, v_start, v_end, shape in folds]
+
+    def matmul(self, embeddings):
+        if len(self.folds) == 1:
+            return tf.sparse_tensor_dense_matmul(self.folds[0], embeddings)
+        return tf.concat([tf.sparse_tensor_dense_matmul(A, embeddings) for A in self.folds], 0)
+
+    def propagate(self, variant, ego_embeddings, weights, n_layers):
+        all_embeddings = [ego_embeddings] if variant.include_ego else []
+        for k in range(0, n_layers):
+            side_embeddings = self.matmul(ego_embeddings)
+            ego_embeddings, embeddings = variant.layer(k, ego_embeddings, side_embeddings, weights)
+            all_embeddings += [embeddings]
+        return variant.combine(all_embeddings)
+
+
+class OutOfCoreEngine(PropagationEngine):
+    def __init__(self, adj, keep_prob=None):
+        """
+        adj is a utility.out_of_core.MmapCSR, multiplied block by block outside of the graph. It must be
+        symmetric (the pre adjacency), so that the gradient A^T dy streams through the same blocks.
+        """
+        if keep_prob is not None:
+            raise ValueError('node dropout is not supported with --out_of_core 1')
+        self.adj = adj
+
+    def matmul(self, embeddings):
+        def dot(x):
+            y = tf.py_func(lambda x: self.adj.dot(x), [x], tf.float32, stateful=False)
+            y.set_shape([self.adj.shape[0], x.shape[1]])
+            return y
+
+        @tf.custom_gradient
+        def symmetric_matmul(x):
+            return dot(x), lambda dy: dot(dy)
+        return symmetric_matmul(embeddings)
+
+
+class Variant(object):
+    # the per-layer weight matrices of the variant, of 'gc', 'bi' and 'mlp'.
+    weights = []
+    # embedding tables stacked in the order of the rows of the adjacency matrix.
+    tables = ['user', 'item']
+    # 'norm' propagates over norm_adj, 'cat_and_price' over the user-item-category-price adjacency.
+    adjacency = 'norm'
+    # whether the ego embeddings are passed to the combiner with the layer outputs.
+    include_ego = True
+    node_dropout = True
+
+    def __init__(self, alpha_k='mean', layer_effects=None):
+        self.alpha_k = alpha_k
+        self.layer_effects = layer_effects
+
+    def layer(self, k, ego_embeddings, side_embeddings, weights):
+        """
+        Returns the input of the next layer and the output of layer k.
+        """
+        return side_embeddings, side_embeddings
+
+    def combine(self, embeddings):
+        return tf.concat(embeddings, 1)
+
+
+@register_variant('lightgcn')
+class LightGCNVariant(Variant):
+    def combine(self, embeddings):
+        embeddings = tf.stack(embeddings, 1)
+        if self.alpha_k == 'leveled':
+            # one weight per layer, broadcast over the nodes and the embedding dimensions.
+            coeficients = np.reshape(np.array(self.layer_effects, dtype=np.float32), [1, -1, 1])
+            return tf.reduce_sum(tf.multiply(embeddings, coeficients), axis=1, keepdims=False)
+        return tf.reduce_mean(embeddings, axis=1, keepdims=False)
+
+
+@register_variant('LightGCN-alpha-1')
+class LightGCNSumVariant(Variant):
+    def combine(self, embeddings):
+        return tf.reduce_sum(tf.stack(embeddings, 1), axis=1, keepdims=False)
+
+
+@register_variant('LightGCN-concat')
+class LightGCNConcatVariant(Variant):
+    pass
+
+
+# adjacency matrix of I x U,C,P (one category pr. item)
+@register_variant('pas')
+class PriceAwareSimpleVariant(Variant):
+    tables = ['user', 'item', 'cat', 'price']
+    adjacency = 'cat_and_price'
+
+    def combine(self, embeddings):
+        return tf.reduce_mean(tf.stack(embeddings, 1), axis=1, keepdims=False)
+
+
+@register_variant('ngcf')
+class NGCFVariant(Variant):
+    weights = ['gc', 'bi']
+
+    def layer(self, k, ego_embeddings, side_embeddings, weights):
+        sum_embeddings = tf.nn.leaky_relu(tf.matmul(side_embeddings, weights['W_gc_%d' % k]) + weights['b_gc_%d' % k])
+        # bi messages of neighbors.
+        bi_embeddings = tf.multiply(ego_embeddings, side_embeddings)
+        # transformed bi messages of neighbors.
+        bi_embeddings = tf.nn.leaky_relu(tf.matmul(bi_embeddings, weights['W_bi_%d' % k]) + weights['b_bi_%d' % k])
+        # non-linear activation.
+        ego_embeddings = sum_embeddings + bi_embeddings
+        # normalize the distribution of embeddings.
+        return ego_embeddings, tf.nn.l2_normalize(ego_embeddings, axis=1)
+
+
+@register_variant('ngcfpas')
+class NGCFPriceAwareVariant(NGCFVariant):
+    weights = ['gc', 'bi']
+    tables = ['user', 'item', 'cat', 'price']
+    adjacency = 'cat_and_price'
+
+
+# Original GCF
+@register_variant('gcf')
+class GCFVariant(Variant):
+    def layer(self, k, ego_embeddings, side_embeddings, weights):
+        ego_embeddings = side_embeddings + tf.multiply(ego_embeddings, side_embeddings)
+        return ego_embeddings, tf.nn.l2_normalize(ego_embeddings, axis=1)
+
+
+# Original GCF without inner product, every layer propagates the initial embeddings.
+@register_variant('gcf-minus-ip')
+class GCFMinusIPVariant(Variant):
+    def layer(self, k, ego_embeddings, side_embeddings, weights):
+        return ego_embeddings, tf.nn.l2_normalize(side_embeddings, axis=1)
+
+
+# GCF only with IP
+@register_variant('gcf-only-ip')
+class GCFOnlyIPVariant(Variant):
+    def layer(self, k, ego_embeddings, side_embeddings, weights):
+        ego_embeddings = tf.multiply(ego_embeddings, side_embeddings)
+        return ego_embeddings, tf.nn.l2_normalize(ego_embeddings, axis=1)
+
+
+# GCF with summing layers instead of concatenating layers
+@register_variant('gcf-sum')
+class GCFSumVariant(GCFVariant):
+    def combine(self, embeddings):
+        return tf.reduce_mean(tf.stack(embeddings, 1), axis=1, keepdims=False)
+
+
+# GCF with summing layers instead of concatenating layers and only with IP
+@register_variant('gcf-sum-only-ip')
+class GCFSumOnlyIPVariant(GCFOnlyIPVariant):
+    def combine(self, embeddings):
+        return tf.reduce_mean(tf.stack(embeddings, 1), axis=1, keepdims=False)
+
+
+@register_variant('gcn')
+class GCNVariant(Variant):
+    weights = ['gc']
+    node_dropout = False
+
+    def layer(self, k, ego_embeddings, side_embeddings, weights):
+        embeddings = tf.nn.leaky_relu(tf.matmul(side_embeddings, weights['W_gc_%d' % k]) + weights['b_gc_%d' % k])
+        return embeddings, embeddings
+
+
+@register_variant('gcmc')
+class GCMCVariant(Variant):
+    weights = ['gc', 'mlp']
+    include_ego = False
+    node_dropout = False
+
+    def layer(self, k, ego_embeddings, side_embeddings, weights):
+        # convolutional layer.
+        embeddings = tf.nn.leaky_relu(tf.matmul(side_embeddings, weights['W_gc_%d' % k]) + weights['b_gc_%d' % k])
+        # dense layer.
+        mlp_embeddings = tf.matmul(embeddings, weights['W_mlp_%d' % k]) + weights['b_mlp_%d' % k]
+        return embeddings, mlp_embeddings
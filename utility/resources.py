@@ -0,0 +1,82 @@
+'''
+The CPU resources of a training run, shared by LightGCN.py, utility/batch_test.py and the worker processes of
+utility/data_parallel.py and utility/partition.py (--cpus, --intra_op_threads, --inter_op_threads,
+--eval_threads, --pin_cpus, --resource_config).
+
+Every pool is sized from one CPU set, by default the CPUs the process may run on, so that a run restricted by
+taskset, a cgroup or --cpus sizes the tensorflow pools and the evaluator threads alike instead of assuming
+the whole machine. With --pin_cpus 1 the process is bound to the set and every forked worker to one CPU of it.
+benchmarks/autotune.py measures the settings on the current machine and writes a --resource_config.
+'''
+import os
+import json
+
+# thread counts read by the BLAS and OpenMP runtimes when they are loaded.
+THREAD_ENV = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class Resources(object):
+    def __init__(self):
+        self.configure()
+
+    def configure(self, cpus=None, intra_op_threads=0, inter_op_threads=0, eval_threads=0, pin=False):
+        """
+        0 threads: one per CPU of the set, as tensorflow does for the whole machine.
+        """
+        available = available_cpus()
+        self.cpus = [cpu for cpu in cpus if cpu in available] if cpus else available
+        assert len(self.cpus) > 0, 'none of the CPUs %s is available, choose from %s' % (cpus, available)
+        self.intra_op_threads = intra_op_threads or len(self.cpus)
+        self.inter_op_threads = inter_op_threads or len(self.cpus)
+        self.eval_threads = eval_threads or len(self.cpus)
+        self.pin = pin
+        if pin and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.cpus)
+
+    def configure_from_args(self, args):
+        # options left at their defaults take the value of --resource_config.
+        settings = dict()
+        if args.resource_config != '':
+            with open(args.resource_config) as f:
+                settings = json.load(f)
+        self.configure(eval(args.cpus) if args.cpus != '' else settings.get('cpus'),
+                       args.intra_op_threads or settings.get('intra_op_threads', 0),
+                       args.inter_op_threads or settings.get('inter_op_threads', 0),
+                       args.eval_threads or settings.get('eval_threads', 0),
+                       args.pin_cpus == 1 or settings.get('pin', False))
+
+    def pin_worker(self, rank):
+        # forked workers inherit the set of the process, a pinned worker runs on one of its CPUs.
+        if self.pin and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, [self.cpus[rank % len(self.cpus)]])
+
+    def worker_threads(self, n_workers):
+        # the CPUs of the set are shared by the workers, one thread each when there are more workers than CPUs.
+        return max(1, len(self.cpus) // n_workers)
+
+    def limit_threads(self, n_threads):
+        """
+        Caps the BLAS and OpenMP threads of this (forked worker) process: through the environment for the runtimes
+        loaded from now on and, when threadpoolctl is installed, for the ones numpy already loaded.
+        """
+        for name in THREAD_ENV:
+            os.environ[name] = str(n_threads)
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            return
+        threadpool_limits(n_threads)
+
+    def get_settings(self):
+        return {'cpus': self.cpus, 'intra_op_threads': self.intra_op_threads, 'inter_op_threads': self.inter_op_threads,
+                'eval_threads': self.eval_threads, 'pin': self.pin}
+
+
+# configured by LightGCN.py from its options, the defaults serve the tools that only import the evaluation.
+resources = Resources()
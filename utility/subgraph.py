@@ -0,0 +1,34 @@
+'''
+K-hop subgraph extraction, used to train on the neighbourhood of a sampled batch instead of the whole graph.
+'''
+import numpy as np
+
+
+def khop_subgraph(adj, seeds, n_hops):
+    """
+    Nodes within n_hops of the seed nodes, and the adjacency matrix restricted to them.
+    A node at distance d from the seeds only feeds layers up to n_hops - d, so propagating n_hops
+    layers on the restricted matrix gives the same embeddings as the full graph for the seeds.
+    """
+    in_subgraph = np.zeros(adj.shape[0], dtype=bool)
+    frontier = np.unique(seeds)
+    in_subgraph[frontier] = True
+    for _ in range(n_hops):
+        if len(frontier) == 0:
+            break
+        neighbours = np.unique(adj[frontier].indices)
+        frontier = neighbours[~in_subgraph[neighbours]]
+        in_subgraph[frontier] = True
+
+    nodes = np.flatnonzero(in_subgraph)
+    sub_adj = adj[nodes][:, nodes].tocoo()
+    return nodes, sub_adj
+
+
+def split_nodes(nodes, table_sizes):
+    """
+    Split sorted node ids of the stacked tables (users, items, ...) into per-table row ids.
+    """
+    offsets = np.concatenate([[0], np.cumsum(table_sizes)])
+    bounds = np.searchsorted(nodes, offsets)
+    return [nodes[bounds[t]:bounds[t + 1]] - offsets[t] for t in range(len(table_sizes))]
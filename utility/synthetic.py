@@ -0,0 +1,168 @@
+'''
+Synthetic datasets in the format read by utility/load_data.Data, for scaling and stress tests:
+    train.txt, test.txt: one line 'user item item ...' per user;
+    item_list.txt: 'org_id remap_id category price' per item, as Data/yelp2020 (with --n_categories).
+
+The user degrees follow a power law (Pareto with shape user_alpha) scaled to n_interactions, the items a
+user interacts with are drawn by a Zipf popularity (rank^-item_alpha) without repetition. Users are generated
+and written in chunks of about chunk_interactions interactions, so only the per-user degrees and one chunk
+are held in memory, e.g. for 100M+ interactions:
+    python -m utility.synthetic --path Data/synthetic-1m --n_users 1000000 --n_items 500000 --n_interactions 100000000
+'''
+import os
+import argparse
+from time import time
+
+import numpy as np
+
+
+def user_degrees(rng, n_users, n_items, n_interactions, alpha, min_degree=2):
+    """
+    Power-law degrees in [min_degree, n_items // 2] that sum to n_interactions (when reachable).
+    """
+    weights = rng.pareto(alpha, n_users) + 1.
+    max_degree = max(min_degree, n_items // 2)
+    # the scale is searched so that the clipped degrees sum to n_interactions, the rounding error goes to random users.
+    low, high = 0., float(n_interactions) / weights.min()
+    for _ in range(100):
+        scale = (low + high) / 2.
+        if np.clip(np.floor(weights * scale), min_degree, max_degree).sum() > n_interactions:
+            high = scale
+        else:
+            low = scale
+    degrees = np.clip(np.floor(weights * low), min_degree, max_degree).astype(np.int64)
+    missing = int(n_interactions - degrees.sum())
+    if missing > 0:
+        candidates = np.flatnonzero(degrees < max_degree)
+        degrees[rng.choice(candidates, min(missing, len(candidates)), replace=False)] += 1
+    return degrees
+
+
+def sample_items(rng, users, degrees, popularity, cdf, ranked_items, max_rounds=20):
+    """
+    Distinct items for a chunk of consecutive users, as (user, item) arrays grouped by user in random order.
+    Items are drawn by popularity and drawn again for the users that lost items to duplicates; users with a
+    large share of all items are sampled without replacement at once instead, which rejection would not finish.
+    """
+    n_items = len(ranked_items)
+    finished = degrees > n_items // 20
+    complete = [users[idx] * n_items + ranked_items[rng.choice(n_items, degrees[idx], replace=False, p=popularity)]
+                for idx in np.flatnonzero(finished)]
+    keys = np.zeros(0, dtype=np.int64)
+    missing = np.where(finished, 0, degrees)
+    for _ in range(max_rounds):
+        if not missing.any():
+            break
+        # 10% more draws than missing items, to absorb most duplicates in one round.
+        draw_users = np.repeat(users, missing + (missing + 9) // 10)
+        draw_items = ranked_items[np.minimum(np.searchsorted(cdf, rng.random_sample(len(draw_users))), n_items - 1)]
+        keys = np.unique(np.concatenate([keys, draw_users * n_items + draw_items]))
+
+        # keep degree random items of every user, the complete users leave the next rounds.
+        key_users = keys // n_items - users[0]
+        keys = keys[np.lexsort((rng.random_sample(len(keys)), key_users))]
+        key_users = keys // n_items - users[0]
+        starts = np.searchsorted(key_users, np.arange(len(users)))
+        keep = np.arange(len(keys)) - starts[key_users] < degrees[key_users]
+        keys, key_users = keys[keep], key_users[keep]
+        missing = np.where(finished, 0, degrees - np.bincount(key_users, minlength=len(users)))
+        finished |= missing == 0
+        done = finished[key_users]
+        complete.append(keys[done])
+        keys = keys[~done]
+
+    keys = np.concatenate(complete + [keys])
+    key_users = keys // n_items
+    keys = keys[np.lexsort((rng.random_sample(len(keys)), key_users))]
+    return keys // n_items, keys % n_items
+
+
+def write_chunk(f_train, f_test, users, items, test_ratio):
+    items = items.astype(str)
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(users - users[0]))])
+    n_train, n_test = 0, 0
+    for u, start, end in zip(range(users[0], users[-1] + 1), bounds[:-1], bounds[1:]):
+        if end == start:
+            continue
+        # items are in random order, the first ones are the test items; every user keeps a training item.
+        n_user_test = min(int(round(test_ratio * (end - start))), end - start - 1)
+        if n_user_test > 0:
+            f_test.write('%d %s\n' % (u, ' '.join(items[start:start + n_user_test])))
+        f_train.write('%d %s\n' % (u, ' '.join(items[start + n_user_test:end])))
+        n_train += end - start - n_user_test
+        n_test += n_user_test
+    return n_train, n_test
+
+
+def generate(path, n_users, n_items, n_interactions, user_alpha=1.5, item_alpha=0.8, test_ratio=0.2,
+             n_categories=0, n_prices=0, seed=0, chunk_interactions=5000000):
+    """
+    Write a synthetic dataset to path; returns the numbers of training and test interactions.
+    """
+    rng = np.random.RandomState(seed)
+    t1 = time()
+    degrees = user_degrees(rng, n_users, n_items, n_interactions, user_alpha)
+    popularity = 1. / np.arange(1, n_items + 1) ** item_alpha
+    cdf = np.cumsum(popularity) / popularity.sum()
+    # item ids in popularity order; the last id is the most popular one, so that Data counts all n_items items.
+    ranked_items = rng.permutation(n_items)
+    last = np.flatnonzero(ranked_items == n_items - 1)[0]
+    ranked_items[[0, last]] = ranked_items[[last, 0]]
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    n_train, n_test = 0, 0
+    chunk_ends = np.searchsorted(np.cumsum(degrees), np.arange(chunk_interactions, degrees.sum(), chunk_interactions)) + 1
+    with open(os.path.join(path, 'train.txt'), 'w') as f_train, open(os.path.join(path, 'test.txt'), 'w') as f_test:
+        for start, end in zip(np.concatenate([[0], chunk_ends]), np.concatenate([chunk_ends, [n_users]])):
+            if start >= end:
+                continue
+            users, items = sample_items(rng, np.arange(start, end, dtype=np.int64), degrees[start:end],
+                                        popularity / popularity.sum(), cdf, ranked_items)
+            chunk_train, chunk_test = write_chunk(f_train, f_test, users, items, test_ratio)
+            n_train += int(chunk_train)
+            n_test += int(chunk_test)
+            print('generated users %d-%d, %d interactions [%.1fs]' % (start, end, n_train + n_test, time() - t1))
+
+    if n_categories > 0:
+        # one category per item with a power-law category size, and a uniform price level.
+        category_popularity = 1. / np.arange(1, n_categories + 1) ** item_alpha
+        categories = rng.choice(n_categories, n_items, p=category_popularity / category_popularity.sum())
+        prices = rng.randint(1, max(n_prices, 1) + 1, n_items)
+        with open(os.path.join(path, 'item_list.txt'), 'w') as f:
+            f.write('org_id remap_id\n')
+            for i in range(n_items):
+                f.write('item%d %d category%d %d\n' % (i, i, categories[i], prices[i]))
+    return n_train, n_test
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset in the format of Data.")
+    parser.add_argument('--path', nargs='?', required=True,
+                        help='Directory the dataset is written to, e.g. Data/synthetic.')
+    parser.add_argument('--n_users', type=int, default=100000,
+                        help='Number of users.')
+    parser.add_argument('--n_items', type=int, default=50000,
+                        help='Number of items.')
+    parser.add_argument('--n_interactions', type=int, default=5000000,
+                        help='Number of interactions, training and test.')
+    parser.add_argument('--user_alpha', type=float, default=1.5,
+                        help='Pareto shape of the user degrees, smaller is more skewed.')
+    parser.add_argument('--item_alpha', type=float, default=0.8,
+                        help='Zipf exponent of the item popularity, larger is more skewed.')
+    parser.add_argument('--test_ratio', type=float, default=0.2,
+                        help='Share of the interactions of every user in test.txt.')
+    parser.add_argument('--n_categories', type=int, default=0,
+                        help='Number of item categories, 0: no item_list.txt.')
+    parser.add_argument('--n_prices', type=int, default=4,
+                        help='Number of price levels of item_list.txt.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed.')
+    parser.add_argument('--chunk_interactions', type=int, default=5000000,
+                        help='Number of interactions generated and written at once.')
+    args = parser.parse_args()
+
+    n_train, n_test = generate(args.path, args.n_users, args.n_items, args.n_interactions, args.user_alpha,
+                               args.item_alpha, args.test_ratio, args.n_categories, args.n_prices, args.seed,
+                               args.chunk_interactions)
+    print('n_users=%d, n_items=%d, n_train=%d, n_test=%d' % (args.n_users, args.n_items, n_train, n_test))